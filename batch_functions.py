@@ -0,0 +1,254 @@
+# Description:
+# This file compiles a library of BIF files in parallel. Every network is compiled in its own worker process, so a
+# network that fails, runs out of memory or exceeds its timeout does not affect the others. At most `processes`
+# workers run at the same time, by default one per core.
+# For every network the compiled circuit is written to (output_directory)/(name)/(name).ac, in the format of
+# serialize_functions, and a summary of the whole run is written to (output_directory)/summary.json
+# Format of the summary of a single network ::
+# {
+#     "name": "asia", ## name of the BIF file without its extension
+#     "path": "....Absolute_path_to_bif_file....",
+#     "status": "compiled", ## possible values: compiled/failed/timeout/over_budget
+#     "error": None, ## reason of the failure, None for compiled networks
+#     "circuit_path": "arithmetic-circuits/asia/asia.ac", ## None unless compiled
+#     "nodes_stats": {"total": 203, ..}, ## statistics of the session the network was compiled with
+#     "circuit_nodes": 150, "circuit_edges": 260, ## size of the flat compiled circuit, after its simplification
+#     "simplification": [{"pass": "collapse_unary_nodes", "before": {"nodes": 180, "edges": 290},
+#                         "after": {"nodes": 150, "edges": 260}}, ..], ## size before and after every pass
+#     "elimination_strategy": "min_fill", ## strategy of the compiled order, a fallback when the requested one was
+#                                         ## over the budget
+#     "estimate": {"nodes": 210, "memory": 197750, ..}, ## estimate of the compiled order, see compile_functions
+#     "compile_time": 0.41, ## seconds, including the parsing of the BIF file
+#     "peak_memory": 104857600, ## peak private resident memory of the worker process in bytes
+# }
+# max_memory caps the private resident memory of a worker, the memory it allocated itself without the pages shared
+# with the parent process. On Linux the parent samples /proc/(pid)/smaps_rollup of every worker each
+# MEMORY_POLL_INTERVAL seconds and terminates the workers above the cap, which are reported as "failed" with the
+# error "memory limit exceeded". Where /proc is not available the cap is set as RLIMIT_DATA of the worker instead,
+# and peak_memory is the increase of the peak resident memory of the worker during the compilation.
+# The compilation of every network is estimated before any node is created (see compile_functions): max_memory and
+# timeout are also the max_memory and max_time of the budget of every network unless the budget sets them, so a
+# network over them falls back to another elimination order or is reported as "over_budget" at once, instead of
+# being terminated
+
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import sys
+import time
+
+try:
+    import resource  # used for the memory cap and the peak memory where /proc is not available, not on Windows
+except ImportError:
+    resource = None
+
+import compile_functions as comp
+import serialize_functions as sz
+import trace_functions as trace
+
+SUMMARY_FILE_NAME = "summary.json"
+MEMORY_POLL_INTERVAL = 0.1  # seconds between two samples of the memory of the workers
+
+
+# lists the BIF files of a library. The source is either a directory, where every .bif file is used, or a manifest
+# file with one path per line. Empty lines and lines starting with # are skipped, relative paths of a manifest are
+# relative to the directory of the manifest
+# Input: {source: "....path_to_directory_or_manifest...."}
+# Output: ["....Absolute_path_to_bif_file....", ..]
+def get_bif_files(source):
+    if os.path.isdir(source):
+        return [os.path.abspath(os.path.join(source, file_name)) for file_name in sorted(os.listdir(source))
+                if file_name.lower().endswith(".bif")]
+
+    bif_files = []
+    with open(source) as manifest:
+        for line in manifest:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                bif_files.append(os.path.abspath(os.path.join(os.path.dirname(source), line)))
+    return bif_files
+
+
+def get_network_name(absolute_file_path):
+    return os.path.basename(absolute_file_path).split(".")[0]
+
+
+# peak resident memory of the current process in bytes, ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+# A forked worker inherits the peak of its parent, so only the increase during a compilation describes the network
+# Input: None
+# Output: 104857600 OR None
+def get_peak_memory():
+    if resource is None:
+        return None
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_memory if sys.platform == "darwin" else peak_memory * 1024
+
+
+# private resident memory of a process in bytes (Private_Clean + Private_Dirty of /proc/(pid)/smaps_rollup), the
+# pages a forked worker still shares with its parent are not counted
+# Input: {pid: 4242}
+# Output: 104857600 OR None (no /proc, or the process has exited)
+def get_private_memory(pid):
+    try:
+        with open("/proc/" + str(pid) + "/smaps_rollup") as smaps_file:
+            return sum(int(line.split()[1]) * 1024 for line in smaps_file if line.startswith("Private_"))
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def can_poll_memory():
+    return os.path.exists("/proc/self/smaps_rollup")
+
+
+# Compiles a single network and writes its circuit, this runs inside the worker process.
+# Without /proc max_memory limits the data segment of the worker, so a network that is too large raises a MemoryError
+# Input: {absolute_file_path: "....Absolute_path_to_bif_file....", output_directory: "arithmetic-circuits",
+#         elimination_strategy: "topological", max_memory: 4294967296, simplification_passes: [simp.fold_constants, ..],
+#         budget: {..budget_format..}}
+# Output: {..network_summary_format..}
+def compile_network(absolute_file_path, output_directory, elimination_strategy, max_memory=None,
+                    simplification_passes=None, budget=None):
+    if max_memory is not None and resource is not None and not can_poll_memory():
+        resource.setrlimit(resource.RLIMIT_DATA, (max_memory, max_memory))
+
+    tracer = trace.create_tracer()  # the find_elimination_order event holds the strategy used and its estimate
+    start_peak_memory = get_peak_memory()
+    start_time = time.perf_counter()
+    circuit, buckets, session, simplification_report = comp.compile_bif_file(absolute_file_path, elimination_strategy,
+                                                                             simplification_passes, tracer,
+                                                                             budget=budget)
+    compile_time = time.perf_counter() - start_time
+    peak_memory = None if start_peak_memory is None else get_peak_memory() - start_peak_memory
+
+    order_event = next(event for event in tracer["events"] if event["phase"] == "find_elimination_order")
+    name = get_network_name(absolute_file_path)
+    os.makedirs(os.path.join(output_directory, name), exist_ok=True)
+    circuit_path = os.path.join(output_directory, name, name + ".ac")
+    sz.write_circuit_file(circuit, circuit_path)
+    return {
+        "name": name,
+        "path": absolute_file_path,
+        "status": "compiled",
+        "error": None,
+        "circuit_path": circuit_path,
+        "nodes_stats": session["nodes_stats"],
+        "circuit_nodes": len(circuit["opcodes"]),
+        "circuit_edges": len(circuit["children"]),
+        "simplification": simplification_report,
+        "elimination_strategy": order_event["strategy"],
+        "estimate": order_event["estimate"],
+        "compile_time": compile_time,
+        "peak_memory": peak_memory,
+    }
+
+
+# entry point of a worker process, the summary or the error is sent back to the parent through the connection
+def run_worker(connection, absolute_file_path, output_directory, elimination_strategy, max_memory,
+               simplification_passes, budget):
+    try:
+        connection.send(compile_network(absolute_file_path, output_directory, elimination_strategy, max_memory,
+                                        simplification_passes, budget))
+    except comp.BudgetExceededError as error:
+        connection.send(create_failed_summary(absolute_file_path, "over_budget", str(error)))
+    except MemoryError:
+        connection.send(create_failed_summary(absolute_file_path, "failed", "memory limit exceeded"))
+    except Exception as error:
+        connection.send(create_failed_summary(absolute_file_path, "failed", type(error).__name__ + ": " + str(error)))
+    finally:
+        connection.close()
+
+
+def create_failed_summary(absolute_file_path, status, error):
+    return {
+        "name": get_network_name(absolute_file_path),
+        "path": absolute_file_path,
+        "status": status,
+        "error": error,
+        "circuit_path": None,
+        "nodes_stats": None,
+        "circuit_nodes": None,
+        "circuit_edges": None,
+        "simplification": None,
+        "elimination_strategy": None,
+        "estimate": None,
+        "compile_time": None,
+        "peak_memory": None,
+    }
+
+
+# Compiles every BIF file of a directory or manifest across a pool of worker processes and writes the summary.
+# A worker running longer than timeout seconds is terminated and its network is reported with the status "timeout".
+# A worker above max_memory bytes is terminated and reported as "failed", see the description at the top of this file.
+# A worker killed by the system is reported as "failed" with its exit code. A network whose estimate exceeds the
+# budget with every allowed elimination order is reported as "over_budget"
+# Input: {source: "....path_to_directory_or_manifest....", output_directory: "arithmetic-circuits",
+#         elimination_strategy: "auto", processes: 8, timeout: 600, max_memory: 4294967296,
+#         simplification_passes: [simp.fold_constants, ..], budget: {..budget_format..}}
+# Output: [{..network_summary_format..}, ..] in the order of the BIF files
+def compile_bif_files(source, output_directory="arithmetic-circuits", elimination_strategy="topological",
+                      processes=None, timeout=None, max_memory=None, simplification_passes=None, budget=None):
+    bif_files = get_bif_files(source)
+    budget = dict(budget or {})
+    budget.setdefault("max_memory", max_memory)
+    budget.setdefault("max_time", timeout)
+    processes = processes or os.cpu_count() or 1
+    summaries = [None] * len(bif_files)
+    pending = list(range(len(bif_files)))
+    running = {}  # process sentinel -> (index of the BIF file, process, connection, start time)
+    peak_memories = {}  # process sentinel -> largest private resident memory sampled for the worker
+    poll_memory = can_poll_memory()
+
+    while pending or running:
+        while pending and len(running) < processes:
+            index = pending.pop(0)
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=run_worker, args=(sender, bif_files[index], output_directory,
+                                                                        elimination_strategy, max_memory,
+                                                                        simplification_passes, budget))
+            process.start()
+            sender.close()
+            running[process.sentinel] = (index, process, receiver, time.monotonic())
+            peak_memories[process.sentinel] = None
+
+        wait_time = MEMORY_POLL_INTERVAL if poll_memory else None
+        if timeout is not None:
+            wait_time = min(wait_time or timeout, max(0.0, min(start + timeout for index, process, receiver, start
+                                                                in running.values()) - time.monotonic()))
+        finished = multiprocessing.connection.wait(list(running), wait_time)
+
+        for sentinel in list(running):
+            index, process, receiver, start = running[sentinel]
+            memory = get_private_memory(process.pid) if poll_memory and sentinel not in finished else None
+            if memory is not None:
+                peak_memories[sentinel] = max(memory, peak_memories[sentinel] or 0)
+
+            if sentinel in finished:
+                process.join()
+                if receiver.poll():
+                    summaries[index] = receiver.recv()
+                    if peak_memories[sentinel] is not None and summaries[index]["status"] == "compiled":
+                        summaries[index]["peak_memory"] = peak_memories[sentinel]
+                else:
+                    summaries[index] = create_failed_summary(bif_files[index], "failed",
+                                                             "worker exited with code " + str(process.exitcode))
+            elif max_memory is not None and memory is not None and memory > max_memory:
+                process.terminate()
+                process.join()
+                summaries[index] = create_failed_summary(bif_files[index], "failed", "memory limit exceeded")
+            elif timeout is not None and time.monotonic() - start >= timeout:
+                process.terminate()
+                process.join()
+                summaries[index] = create_failed_summary(bif_files[index], "timeout",
+                                                         "exceeded " + str(timeout) + " seconds")
+            else:
+                continue
+            receiver.close()
+            del running[sentinel]
+            del peak_memories[sentinel]
+            print("Compiled network ::", summaries[index]["name"], "::", summaries[index]["status"])
+
+    os.makedirs(output_directory, exist_ok=True)
+    with open(os.path.join(output_directory, SUMMARY_FILE_NAME), "w") as summary_file:
+        json.dump(summaries, summary_file, indent=2)
+    return summaries
@@ -0,0 +1,355 @@
+# Description:
+# This file implements an offline benchmark of the compilation and evaluation of arithmetic circuits. It runs on the
+# BIF files bundled in benchmarks/networks and on synthetic BNs created by generate_random_bn, so every run uses the
+# same networks, evidence and random seeds.
+# Every network is benchmarked in a new process and the results are checked against pgmpy's VariableElimination.
+# The results are written as JSON and can be compared with the results of an earlier run with
+# compare_benchmark_results.
+# Format of the result of a single network ::
+# {
+#     "name": "asia",
+#     "parse_time": 0.02, ## seconds to read, check and convert the BIF file
+#     "elimination_order_time": 0.001,
+#     "sum_product_network_time": 0.01, ## comp.create_sum_product_network
+#     "compile_time": 0.004, ## circuit_functions.compile_arithmetic_circuit and the simplification passes
+#     "nodes_stats": {"total": 145, ..}, "circuit_nodes": 111, "circuit_edges": 148,
+#     "node_memory": {"nodes": 145, "node_bytes": 23200, ..}, ## memory of the nodes of the sum product network and
+#                                                             ## memory saved by Node, see sf.get_node_memory
+#     "parse_peak_memory": 64376221, ## bytes allocated at the peak of parsing the BIF file, see tracemalloc
+#     "peak_memory": 1048576, ## bytes allocated at the peak of the elimination order, network and compilation
+#     "queries_per_second": 5000.0, "batch_queries_per_second": 90000.0, ## evaluations of random evidence
+#     "generated_queries_per_second": 60000.0, ## single queries with the generated evaluator of codegen_functions,
+#                                              ## None above codegen_functions.MAX_GENERATED_NODES nodes
+#     "max_error": 1e-16, "correct": True, ## largest difference with pgmpy over the checked queries
+# }
+
+import contextlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import batch_functions as bf
+import bn_functions as bnf
+import circuit_functions as cf
+import codegen_functions as cg
+import compile_functions as comp
+import simplify_functions as simp
+import structure_functions as sf
+import trace_functions as trace
+
+NETWORKS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "networks")
+DEFAULT_RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "results.json")
+ERROR_TOLERANCE = 1e-6
+
+# settings of the synthetic networks: the parents of a node are drawn from the `treewidth` nodes created before it,
+# which bounds the treewidth of the network by `treewidth`
+default_synthetic_networks = [
+    {"node_count": 50, "arity": 2, "treewidth": 3, "max_parents": 2, "seed": 0},
+    {"node_count": 100, "arity": 3, "treewidth": 3, "max_parents": 3, "seed": 1},
+    {"node_count": 200, "arity": 2, "treewidth": 5, "max_parents": 3, "seed": 2},
+]
+
+# a synthetic network whose min_fill order creates factors of about 6e14 entries, see check_wide_network_budget
+wide_synthetic_network = {"node_count": 300, "arity": 3, "treewidth": 80, "max_parents": 3, "seed": 0}
+
+
+# Creates a random BN in the bn_graph_nodes format of bn_functions.get_bn_graph_nodes. Node i draws up to max_parents
+# parents from the nodes i - treewidth .. i - 1, the CPT rows are drawn uniformly and normalized
+# Input: {node_count: 50, arity: 2, treewidth: 3, max_parents: 2, seed: 0}
+# Output: {"X0":{"states":["s0", "s1"], "parents":[], "values":[[0.3], [0.7]]}, ..}
+def generate_random_bn(node_count, arity, treewidth, max_parents=2, seed=0):
+    generator = random.Random(seed)
+    bn_graph_nodes = {}
+    for i in range(node_count):
+        candidates = ["X" + str(j) for j in range(max(0, i - treewidth), i)]
+        parents = sorted(generator.sample(candidates, min(len(candidates), generator.randint(0, max_parents))),
+                         key=lambda item: int(item[1:]))
+        rows = []
+        for _ in range(arity ** len(parents)):
+            row = [generator.random() + 1e-3 for _ in range(arity)]
+            rows.append([value / sum(row) for value in row])
+        bn_graph_nodes["X" + str(i)] = {
+            "states": ["s" + str(state) for state in range(arity)],
+            "parents": parents,
+            "values": [list(column) for column in zip(*rows)],  # one row per state, one column per parent assignment
+        }
+    return bn_graph_nodes
+
+
+# writes a BN in the bn_graph_nodes format to a BIF file, the columns of the values follow the order of
+# itertools.product over the parent states (the last parent changes fastest)
+# Input: {bn_graph_nodes: {"X0":{"states":["s0", "s1"], "parents":[], "values":[[0.3], [0.7]]}}, path: "..", name: ".."}
+# Output: None
+def write_bif_file(bn_graph_nodes, path, name="unknown"):
+    with open(path, "w") as bif_file:
+        bif_file.write("network " + name + " {\n}\n")
+        for node, value in bn_graph_nodes.items():
+            bif_file.write("variable " + node + " {\n  type discrete [ " + str(len(value["states"])) + " ] { " +
+                           ", ".join(value["states"]) + " };\n}\n")
+        for node, value in bn_graph_nodes.items():
+            columns = [list(column) for column in zip(*value["values"])]
+            if not value["parents"]:
+                bif_file.write("probability ( " + node + " ) {\n  table " + ", ".join(map(repr, columns[0])) +
+                               ";\n}\n")
+                continue
+            bif_file.write("probability ( " + node + " | " + ", ".join(value["parents"]) + " ) {\n")
+            parent_states = itertools.product(*[bn_graph_nodes[parent]["states"] for parent in value["parents"]])
+            for states, column in zip(parent_states, columns):
+                bif_file.write("  (" + ", ".join(states) + ") " + ", ".join(map(repr, column)) + ";\n")
+            bif_file.write("}\n")
+
+
+# Draws evidence by forward sampling the BN, so every evidence has a probability above 0. Each evidence observes
+# between 1 and max_observed random variables of the sample
+# Input: {bn_graph_nodes: {..}, universal_dict: {"A":{"0":0.9, ..}}, count: 2, max_observed: 3, seed: 0}
+# Output: [{"B": "0"}, {"A": "1", "C": "0"}]
+def sample_evidence(bn_graph_nodes, universal_dict, count, max_observed=3, seed=0):
+    generator = random.Random(seed)
+    topological_order = list(reversed(bnf.find_topological_elimination_order(bn_graph_nodes)))
+    evidence_list = []
+    for _ in range(count):
+        sample = {}
+        for node in topological_order:
+            parent_states = [sample[parent] for parent in bn_graph_nodes[node]["parents"]]
+            weights = [universal_dict[node][",".join([str(state)] + parent_states)]
+                       for state in bn_graph_nodes[node]["states"]]
+            sample[node] = str(generator.choices(bn_graph_nodes[node]["states"], weights)[0])
+        observed = generator.sample(topological_order, generator.randint(1, min(max_observed, len(sample))))
+        evidence_list.append({node: sample[node] for node in observed})
+    return evidence_list
+
+
+# Compares the circuit with pgmpy's VariableElimination on the probability of every evidence and on the posterior
+# marginals of up to checked_variables unobserved variables
+# Input: {circuit: {..compiled_circuit_format..}, bn_network: {..parsed_network_format..}, evidence_list: [{"B": "0"}]}
+# Output: 1e-16 (largest absolute difference)
+def check_against_pgmpy(circuit, bn_network, evidence_list, checked_variables=3):
+    from pgmpy.inference import VariableElimination  # only needed by the benchmark
+
+    inference = VariableElimination(bnf.get_pgmpy_model(bn_network))
+    max_error = 0.0
+    for evidence in evidence_list:
+        probability = np.prod(list(cf.evaluate_compiled_circuit(circuit, evidence).values()))
+        expected = inference.query(list(evidence), joint=True, show_progress=False).get_value(**evidence)
+        max_error = max(max_error, abs(probability - expected))
+
+        posteriors = cf.compute_posterior_marginals(circuit, evidence)
+        for variable in [variable for variable in posteriors if variable not in evidence][:checked_variables]:
+            factor = inference.query([variable], evidence=evidence, show_progress=False)
+            for state, expected in zip(factor.state_names[variable], factor.values):
+                max_error = max(max_error, abs(posteriors[variable][str(state)] - expected))
+    return float(max_error)
+
+
+# returns the bytes allocated at the peak since the last call, above the memory allocated at that call
+# Input: {current_memory: [30420582]} allocated memory at the last call, updated by the call
+# Output: 1048576
+def get_phase_peak_memory(current_memory):
+    current, peak = tracemalloc.get_traced_memory()
+    phase_peak_memory = peak - current_memory[0]
+    tracemalloc.reset_peak()
+    current_memory[0] = current
+    return phase_peak_memory
+
+
+# Parses and compiles a network, the time of every phase is stored in result. With trace_memory the peak memory of
+# the parsing and of the other phases are stored instead, the time of tracemalloc would distort the timings
+# Input: {absolute_file_path: "....Absolute_path_to_bif_file....", elimination_strategy: "auto", result: {},
+#         trace_memory: False}
+# Output: (bn_network, bn_graph_nodes, universal_dict, {..session..}, {..compiled_circuit_format..})
+def compile_phases(absolute_file_path, elimination_strategy, result, trace_memory=False):
+    timings = {}
+    if trace_memory:
+        tracemalloc.start()
+        current_memory = [tracemalloc.get_traced_memory()[0]]
+    start_time = time.perf_counter()
+    bn_network = bnf.read_bn_file(absolute_file_path)
+    bnf.check_bn_model(bn_network)
+    bn_graph_nodes = bnf.get_bn_graph_nodes(bn_network)
+    universal_dict = sf.create_universal_dict(bn_graph_nodes)
+    timings["parse_time"] = time.perf_counter() - start_time
+    if trace_memory:
+        result["parse_peak_memory"] = get_phase_peak_memory(current_memory)
+
+    start_time = time.perf_counter()
+    elimination_order = bnf.find_elimination_order(bn_graph_nodes, elimination_strategy)
+    timings["elimination_order_time"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    session = sf.create_session()
+    buckets = comp.create_sum_product_network(elimination_order, universal_dict, bn_graph_nodes, session)
+    timings["sum_product_network_time"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    circuit, simplification_report = simp.simplify_circuit(cf.compile_arithmetic_circuit(buckets))
+    timings["compile_time"] = time.perf_counter() - start_time
+    if trace_memory:
+        result["peak_memory"] = get_phase_peak_memory(current_memory)
+        tracemalloc.stop()
+    else:
+        result.update(timings)
+    return bn_network, bn_graph_nodes, universal_dict, session, circuit
+
+
+# Benchmarks a single network, this runs inside a new process. The output of the compiler is discarded.
+# The peak memory is measured with tracemalloc in a second, untimed compilation, so it does not slow down the timings
+# and does not include the memory of the imported libraries
+# Input: {absolute_file_path: "....Absolute_path_to_bif_file....", elimination_strategy: "auto", query_count: 1000,
+#         check_count: 5, seed: 0}
+# Output: {..benchmark_result_format..}
+def benchmark_network(absolute_file_path, elimination_strategy, query_count, check_count, seed):
+    result = {"name": bf.get_network_name(absolute_file_path)}
+    with contextlib.redirect_stdout(io.StringIO()):
+        bn_network, bn_graph_nodes, universal_dict, session, circuit = compile_phases(absolute_file_path,
+                                                                                      elimination_strategy, result)
+        compile_phases(absolute_file_path, elimination_strategy, result, trace_memory=True)
+
+    result["nodes_stats"] = session["nodes_stats"]
+    result["node_memory"] = sf.get_node_memory(session)
+    result["circuit_nodes"] = len(circuit["opcodes"])
+    result["circuit_edges"] = len(circuit["children"])
+
+    evidence_list = sample_evidence(bn_graph_nodes, universal_dict, query_count, seed=seed)
+    start_time = time.perf_counter()
+    for evidence in evidence_list:
+        cf.evaluate_compiled_circuit(circuit, evidence)
+    result["queries_per_second"] = query_count / (time.perf_counter() - start_time)
+    start_time = time.perf_counter()
+    cf.evaluate_compiled_circuit_batch(circuit, evidence_list)
+    result["batch_queries_per_second"] = query_count / (time.perf_counter() - start_time)
+    result["generated_queries_per_second"] = None
+    if len(circuit["opcodes"]) <= cg.MAX_GENERATED_NODES:
+        cg.get_generated_evaluator(circuit)  # the code generation is not timed, like the compilation of the circuit
+        start_time = time.perf_counter()
+        for evidence in evidence_list:
+            cg.evaluate_generated_circuit(circuit, evidence)
+        result["generated_queries_per_second"] = query_count / (time.perf_counter() - start_time)
+
+    result["max_error"] = check_against_pgmpy(circuit, bn_network, evidence_list[:check_count])
+    result["correct"] = result["max_error"] <= ERROR_TOLERANCE
+    return result
+
+
+# Regression check of the budgets of compile_functions: a synthetic network far too wide to compile has to be rejected
+# with BudgetExceededError before any node is created, its estimate must not overflow into a size within the budget
+# Input: {budget: {"max_nodes": 10000000, "fallback_strategies": []}}
+# Output: True
+def check_wide_network_budget(budget=None):
+    budget = budget or {"max_nodes": 10 ** 7, "fallback_strategies": []}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "wide.bif")
+        write_bif_file(generate_random_bn(**wide_synthetic_network), path, "wide")
+        tracer = trace.create_tracer()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                comp.compile_bif_file(path, "min_fill", tracer=tracer, budget=budget)
+        except comp.BudgetExceededError:
+            return not any(event["phase"] == "create_cpt_factors" for event in tracer["events"])
+    return False
+
+
+# Runs the benchmark on the bundled networks and the synthetic networks and writes the results to output_path.
+# The networks are benchmarked one after the other, each in a new process, so the timings do not compete for cores
+# Input: {networks: ["asia", "alarm"] (None for every bundled network), synthetic_networks: [{node_count: 50, ..}],
+#         output_path: "benchmarks/results.json", elimination_strategy: "auto", query_count: 1000, check_count: 5,
+#         seed: 0}
+# Output: {environment: {..}, settings: {..}, networks: [{..benchmark_result_format..}, ..]}
+def run_benchmarks(networks=None, synthetic_networks=None, output_path=DEFAULT_RESULTS_PATH,
+                   elimination_strategy="auto", query_count=1000, check_count=5, seed=0):
+    if networks is None:
+        networks = [bf.get_network_name(path) for path in bf.get_bif_files(NETWORKS_DIRECTORY)]
+    if synthetic_networks is None:
+        synthetic_networks = default_synthetic_networks
+
+    results = []
+    with tempfile.TemporaryDirectory() as synthetic_directory:
+        bif_files = [os.path.join(NETWORKS_DIRECTORY, name + ".bif") for name in networks]
+        for settings in synthetic_networks:
+            name = "synthetic_n{node_count}_a{arity}_w{treewidth}_p{max_parents}_s{seed}".format(**settings)
+            bif_files.append(os.path.join(synthetic_directory, name + ".bif"))
+            write_bif_file(generate_random_bn(**settings), bif_files[-1], name)
+
+        for absolute_file_path in bif_files:
+            with multiprocessing.Pool(processes=1) as pool:
+                results.append(pool.apply(benchmark_network, (absolute_file_path, elimination_strategy, query_count,
+                                                              check_count, seed)))
+            print("Benchmarked network ::", results[-1]["name"], "::", {key: results[-1][key] for key in
+                  ("compile_time", "circuit_nodes", "queries_per_second", "correct")})
+
+    budget_check = check_wide_network_budget()
+    print("Budget check of a wide network ::", "correct" if budget_check else "INCORRECT")
+    report = {
+        "budget_check": budget_check,  # a network too wide to compile is rejected before any node is created
+        "environment": {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+                        "compiler_version": cf.COMPILER_VERSION},
+        "settings": {"elimination_strategy": elimination_strategy, "query_count": query_count,
+                     "check_count": check_count, "seed": seed, "synthetic_networks": synthetic_networks},
+        "networks": results,
+    }
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "w") as results_file:
+        json.dump(report, results_file, indent=2)
+    return report
+
+
+# (metric, True if a higher value is better) compared by compare_benchmark_results
+compared_metrics = [
+    ("parse_time", False),
+    ("elimination_order_time", False),
+    ("sum_product_network_time", False),
+    ("compile_time", False),
+    ("circuit_nodes", False),
+    ("circuit_edges", False),
+    ("parse_peak_memory", False),
+    ("peak_memory", False),
+    ("queries_per_second", True),
+    ("batch_queries_per_second", True),
+    ("generated_queries_per_second", True),
+]
+
+
+# Compares two result files and lists the metrics of every network that got worse by more than the tolerance
+# (relative), the networks that are no longer correct and a failed budget check
+# Input: {baseline_path: "benchmarks/baseline.json", results_path: "benchmarks/results.json", tolerance: 0.1}
+# Output: ["alarm: compile_time 0.21 -> 0.35", ..]
+def compare_benchmark_results(baseline_path, results_path=DEFAULT_RESULTS_PATH, tolerance=0.1):
+    with open(baseline_path) as baseline_file:
+        baseline = {result["name"]: result for result in json.load(baseline_file)["networks"]}
+    with open(results_path) as results_file:
+        report = json.load(results_file)
+    results = report["networks"]
+
+    regressions = []
+    if report.get("budget_check") is False:
+        regressions.append("budget check: a network too wide to compile was not rejected by its budget")
+    for result in results:
+        if result["name"] not in baseline:
+            continue
+        if not result["correct"]:
+            regressions.append(result["name"] + ": incorrect, max_error " + str(result["max_error"]))
+        for metric, higher_is_better in compared_metrics:
+            old, new = baseline[result["name"]].get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(result["name"] + ": " + metric + " " + str(old) + " -> " + str(new))
+    return regressions
+
+
+if __name__ == "__main__":
+    run_benchmarks()
+    if len(sys.argv) > 1:  # python benchmark_functions.py benchmarks/baseline.json
+        for regression in compare_benchmark_results(sys.argv[1]):
+            print("Regression ::", regression)
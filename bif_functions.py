@@ -0,0 +1,235 @@
+# Description:
+# This file contains a streaming parser of BIF files. The file is read line by line and split into tokens, and the
+# blocks are parsed as the tokens arrive, so nothing but the network itself is kept in memory and no parser library
+# has to be imported. Comments (// and /* */) are skipped and double quotes are read as spaces, like pgmpy's BIFReader.
+# The grammar parsed ::
+#   network (name) { property ..; }
+#   variable (name) { type discrete [ (state count) ] { (state), (state), .. }; property ..; }
+#   probability ( (name) | (parent), (parent), .. ) {
+#       ((parent state), ..) (value), ..; ## one line per assignment of the parents
+#       table (value), ..; ## the values of every state, one state after the other, as read by pgmpy
+#       default (value), ..; ## the values of the assignments of the parents without a line
+#       property ..;
+#   }
+# Format of a parsed network ::
+# {
+#     "name": "asia",
+#     "variables": ["asia", "tub", ..], ## in the order of the variable blocks
+#     "states": {"asia": ["yes", "no"], ..},
+#     "parents": {"asia": [], "tub": ["asia"], ..},
+#     "values": {"tub": [[0.05, 0.01], [0.95, 0.99]], ..}, ## one row per state, one column per assignment of the
+#                                                          ## parents, the last parent changing fastest
+# }
+
+import itertools
+import re
+
+TOKEN_PATTERN = re.compile(r"[{}()\[\];,|]|[^\s{}()\[\];,|]+")
+SEPARATORS = {",", "|"}
+BRACKETS = {"{", "}", "(", ")", "[", "]", ";"}
+
+
+# removes the comments of a line, in_comment tells whether the line starts inside a /* */ comment
+# Input: {line: "variable A { // first", in_comment: False}
+# Output: ("variable A { ", False)
+def remove_comments(line, in_comment):
+    text = ""
+    while line:
+        if in_comment:
+            end = line.find("*/")
+            if end == -1:
+                return text, True
+            line, in_comment = line[end + 2:], False
+            continue
+        line_comment, block_comment = line.find("//"), line.find("/*")
+        if line_comment != -1 and (block_comment == -1 or line_comment < block_comment):
+            return text + line[:line_comment], False
+        if block_comment == -1:
+            return text + line, False
+        text, line, in_comment = text + line[:block_comment] + " ", line[block_comment + 2:], True
+    return text, in_comment
+
+
+# Splits the lines of a BIF file into tokens, lazily
+# Input: {bif_file: ..file object..}
+# Output: generator of (token, line number), ex: ("variable", 3), ("asia", 3), ("{", 3), ..
+def get_bif_tokens(bif_file):
+    in_comment = False
+    for line_number, line in enumerate(bif_file, 1):
+        line, in_comment = remove_comments(line.replace('"', " "), in_comment)
+        for token in TOKEN_PATTERN.findall(line):
+            yield token, line_number
+
+
+# returns the next token, the end of the file is an error since every block is closed by a token
+# Input: {tokens: ..generator of get_bif_tokens..}
+# Output: ("asia", 3)
+def next_token(tokens):
+    item = next(tokens, None)
+    if item is None:
+        raise ValueError("Unexpected end of the BIF file")
+    return item
+
+
+# reads the next token and checks that it is the expected one, returns its line number
+def expect_token(tokens, expected):
+    token, line_number = next_token(tokens)
+    if token != expected:
+        raise ValueError("Expected '" + expected + "' but found '" + token + "' at line " + str(line_number))
+    return line_number
+
+
+# Reads the tokens up to the closing token and returns them without the separators (commas and |)
+# Input: {tokens: ..generator of get_bif_tokens.., closing_token: ";"}
+# Output: ["0.05", "0.95"]
+def read_items(tokens, closing_token):
+    items = []
+    token, line_number = next_token(tokens)
+    while token != closing_token:
+        if token in BRACKETS:
+            raise ValueError("Unexpected '" + token + "' at line " + str(line_number))
+        if token not in SEPARATORS:
+            items.append(token)
+        token, line_number = next_token(tokens)
+    return items
+
+
+def read_values(tokens):
+    token, line_number = next_token(tokens)
+    values = []
+    while token != ";":
+        if token not in SEPARATORS:
+            try:
+                values.append(float(token))
+            except ValueError:
+                raise ValueError("Invalid probability '" + token + "' at line " + str(line_number)) from None
+        token, line_number = next_token(tokens)
+    return values
+
+
+# skips the tokens of a property up to its closing ;, the value of a property may contain any token
+def skip_statement(tokens):
+    while next_token(tokens)[0] != ";":
+        pass
+
+
+# skips the tokens of a block up to its closing }, the block may contain nested {} blocks
+def skip_block(tokens):
+    depth = 1
+    while depth > 0:
+        token, line_number = next_token(tokens)
+        depth += {"{": 1, "}": -1}.get(token, 0)
+
+
+# Parses the rest of a variable block, after the "variable" keyword
+# Input: {network: {..parsed_network_format..}, tokens: ..generator of get_bif_tokens..}
+# Output: None, the variable is added to the network
+def parse_variable_block(network, tokens):
+    name, line_number = next_token(tokens)
+    if name in network["states"]:
+        raise ValueError("Variable '" + name + "' is defined twice, at line " + str(line_number))
+    expect_token(tokens, "{")
+
+    token, line_number = next_token(tokens)
+    while token != "}":
+        if token == "type":
+            next_token(tokens)  # discrete
+            expect_token(tokens, "[")
+            state_count = read_items(tokens, "]")
+            expect_token(tokens, "{")
+            states = read_items(tokens, "}")
+            expect_token(tokens, ";")
+            if len(state_count) != 1 or state_count[0] != str(len(states)):
+                raise ValueError("Variable '" + name + "' declares " + " ".join(state_count) + " states but lists " +
+                                 str(len(states)) + ", at line " + str(line_number))
+            network["variables"].append(name)
+            network["states"][name] = states
+        elif token == "property":
+            skip_statement(tokens)
+        else:
+            raise ValueError("Unexpected '" + token + "' in variable '" + name + "' at line " + str(line_number))
+        token, line_number = next_token(tokens)
+
+    if name not in network["states"]:
+        raise ValueError("Variable '" + name + "' has no type, at line " + str(line_number))
+
+
+# Parses the rest of a probability block, after the "probability" keyword. The variables of the CPT have to be
+# defined by variable blocks before it, like in every BIF file written by the usual tools
+# Input: {network: {..parsed_network_format..}, tokens: ..generator of get_bif_tokens..}
+# Output: None, the parents and values of the variable are added to the network
+def parse_probability_block(network, tokens):
+    line_number = expect_token(tokens, "(")
+    names = read_items(tokens, ")")
+    if not names:
+        raise ValueError("CPT without a variable at line " + str(line_number))
+    for item in names:
+        if item not in network["states"]:
+            raise ValueError("Unknown variable '" + item + "' in the CPT at line " + str(line_number))
+    name, parents = names[0], names[1:]
+    if name in network["values"]:
+        raise ValueError("Variable '" + name + "' has two CPTs, at line " + str(line_number))
+    expect_token(tokens, "{")
+
+    state_count = len(network["states"][name])
+    parent_states = [network["states"][parent] for parent in parents]
+    table, default, columns = None, None, {}
+    token, line_number = next_token(tokens)
+    while token != "}":
+        if token == "table":
+            table = read_values(tokens)
+        elif token == "default":
+            default = read_values(tokens)
+        elif token == "(":
+            assignment = tuple(read_items(tokens, ")"))
+            columns[assignment] = read_values(tokens)
+            if len(columns[assignment]) != state_count:
+                raise ValueError("Expected " + str(state_count) + " values for " + ",".join(assignment) + " in the CPT "
+                                 "of '" + name + "' at line " + str(line_number))
+        elif token == "property":
+            skip_statement(tokens)
+        else:
+            raise ValueError("Unexpected '" + token + "' in the CPT of '" + name + "' at line " + str(line_number))
+        token, line_number = next_token(tokens)
+
+    column_count = 1
+    for states in parent_states:
+        column_count *= len(states)
+    if table is not None:
+        if len(table) != state_count * column_count:
+            raise ValueError("Expected " + str(state_count * column_count) + " values in the table of '" + name +
+                             "' but found " + str(len(table)))
+        values = [table[i * column_count:(i + 1) * column_count] for i in range(state_count)]
+    else:
+        values = [[] for i in range(state_count)]
+        for assignment in itertools.product(*parent_states):
+            column = columns.pop(assignment, default)
+            if column is None or len(column) != state_count:
+                raise ValueError("Missing values for " + ",".join(assignment) + " in the CPT of '" + name + "'")
+            for i in range(state_count):
+                values[i].append(column[i])
+        if columns:
+            raise ValueError("Unknown parent states " + ",".join(next(iter(columns))) + " in the CPT of '" + name + "'")
+
+    network["parents"][name] = parents
+    network["values"][name] = values
+
+
+# Main function of the file, parses a BIF file into the parsed network format described at the top of this file
+# Input: {path: "....Absolute_path_to_bif_file...."}
+# Output: {..parsed_network_format..}
+def parse_bif_file(path):
+    network = {"name": None, "variables": [], "states": {}, "parents": {}, "values": {}}
+    with open(path) as bif_file:
+        tokens = get_bif_tokens(bif_file)
+        for token, line_number in tokens:
+            if token == "network":
+                network["name"] = " ".join(read_items(tokens, "{")) or None
+                skip_block(tokens)
+            elif token == "variable":
+                parse_variable_block(network, tokens)
+            elif token == "probability":
+                parse_probability_block(network, tokens)
+            else:
+                raise ValueError("Unexpected '" + token + "' at line " + str(line_number) + " of " + path)
+    return network
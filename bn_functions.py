@@ -1,156 +1,135 @@
 # Description:
 # This file contains all the functions implementing the functionalities of a bayesian network
 
-from pgmpy.readwrite import BIFReader
-from pgmpy.models import BayesianNetwork
-from pgmpy.factors.discrete import TabularCPD
-from pgmpy.inference.EliminationOrder import WeightedMinFill, MinFill, MinWeight, MinNeighbors
-import networkx as nx
-
 import helper
-import structure_functions as sf
+import bif_functions as bif
+import circuit_functions as cf
+import factor_functions as ff
 
+CPT_SUM_TOLERANCE = 0.01  # same tolerance as the check of pgmpy's TabularCPD
 
-# reads the bif file and converts it into common format using BIFReader
-# Input: {path: "....Absolute_path_to_bif_file...."}
-# Output: {...bn_object_from_pgmpy...}
-def read_bn_file(path):
-    return BIFReader(path)
+bn_check_backends = ["native", "pgmpy"]
 
 
-# checks whether the BN model, read from the file, is correct or incorrect. Throws an error if incorrect
-# Input: {bn_network: ...bn_object_from_pgmpy...}
+# reads the bif file with the streaming parser of bif_functions, pgmpy is not needed
+# Input: {path: "....Absolute_path_to_bif_file...."}
+# Output: {..parsed_network_format..}
+def read_bn_file(path):
+    return bif.parse_bif_file(path)
+
+
+# creates the pgmpy model of a parsed network, pgmpy is imported here only since importing it takes seconds
+# Input: {bn_network: {..parsed_network_format..}}
+# Output: ..BayesianNetwork_object_from_pgmpy..
+def get_pgmpy_model(bn_network):
+    from pgmpy.factors.discrete import TabularCPD
+    from pgmpy.models import BayesianNetwork
+
+    model = BayesianNetwork()
+    model.add_nodes_from(bn_network["variables"])
+    model.add_edges_from((parent, node) for node in bn_network["variables"] for parent in bn_network["parents"][node])
+    model.name = bn_network["name"]
+    for node in bn_network["variables"]:
+        parents = bn_network["parents"][node]
+        state_names = {item: bn_network["states"][item] for item in [node] + parents}
+        model.add_cpds(TabularCPD(node, len(bn_network["states"][node]), bn_network["values"][node], evidence=parents,
+                                  evidence_card=[len(bn_network["states"][parent]) for parent in parents],
+                                  state_names=state_names))
+    return model
+
+
+# checks whether the BN model, read from the file, is correct or incorrect. Throws an error if incorrect.
+# The native check verifies that every variable has a CPT whose columns are distributions and that the BN has no
+# cycle, the pgmpy backend runs the check of pgmpy's BayesianNetwork instead
+# Input: {bn_network: {..parsed_network_format..}, backend: "native"/"pgmpy"}
 # Output: True or ERROR
-def check_bn_model(bn_network):
-    if bn_network.get_model().check_model():
-        return True
-    else:
+def check_bn_model(bn_network, backend="native"):
+    if backend == "pgmpy":
+        if get_pgmpy_model(bn_network).check_model():
+            return True
         raise Exception("Bayesian Network model is Incorrect!")
+    if backend != "native":
+        raise ValueError("Unknown check backend '" + backend + "', expected one of " + str(bn_check_backends))
+
+    for node in bn_network["variables"]:
+        if node not in bn_network["values"]:
+            raise Exception("Bayesian Network model is Incorrect! Variable '" + node + "' has no CPT")
+        for column in zip(*bn_network["values"][node]):
+            if min(column) < 0 or abs(sum(column) - 1) > CPT_SUM_TOLERANCE:
+                raise Exception("Bayesian Network model is Incorrect! The CPT of '" + node + "' has a column " +
+                                str(list(column)) + " that is not a distribution")
+    find_topological_elimination_order({node: {"parents": bn_network["parents"][node]}  # raises an error for a cycle
+                                        for node in bn_network["variables"]})
+    return True
 
 
 # reads the bn_network and creates common dict used for further conversions.
-# Input: {bn_network: ...bn_object_from_pgmpy...}
-# Output: {bn_graph_nodes: {"A":{"states":["0", "1"], "parents":[], "values":[[0.9, 0.1]}},
-#           parents: {"B": ["A"]},
-#           non_leaf_nodes: ["A"]}
+# Input: {bn_network: {..parsed_network_format..}}
+# Output: {"A":{"states":["0", "1"], "parents":[], "values":[[0.9], [0.1]]}}
 def get_bn_graph_nodes(bn_network):
     bn_graph_nodes = {}
-    non_leaf_nodes = []
-    states = bn_network.get_states()
-    values = bn_network.get_values()
-    parents = bn_network.get_parents()
-    for node in bn_network.get_variables():
+    for node in bn_network["variables"]:
         bn_graph_nodes[node] = {
-            "states": states[node],
-            "values": values[node],
-            "parents": parents[node]
-        }
-        non_leaf_nodes = list(set(non_leaf_nodes + parents[node]))
-    return bn_graph_nodes, parents, non_leaf_nodes
-
-
-# Calculates the marginal and updates the distribution accordingly as per the representation of a node format
-# Input: {distribution: {"0,0": {..node_format..}, "0,1": {..}}, node: "B", parents: "A", variable_index: 5}
-# Output: {"0": {..node_format..}, "1": {..node_format..}}
-# The output is basically a marginalized distribution of A obtained by summing appropriate values of B
-def marginalize(distribution, node, parents, variable_index=0):
-    distribution = helper.convert_keys_to_tuple(distribution)  # conversion to tuple for easier calculation
-    marginalized_distribution = {}
-
-    for key, value in distribution.items():
-        marginalized_key = key[:variable_index] + key[
-                                                  variable_index + 1:]  # selecting every other keys except the one to be removed
-
-        # creating indicator and value nodes and the product node for the same indicator node
-        indicator_node = sf.create_node("indicator", 1, [], node, key[variable_index])
-        value_node = sf.create_node("value", value, [], node, key[variable_index])
-        product_node = sf.create_node("product", None, [indicator_node, value_node], node, key[variable_index])
-
-        if marginalized_key in marginalized_distribution:
-            # Just adding thus node to the references of an already present sum node
-            marginalized_distribution[marginalized_key]["references"].append(product_node)
-        else:
-            # Creating a sum node to highlight the summing of 2 product nodes
-            marginalized_distribution[marginalized_key] = sf.create_node("sum", None, [product_node], parents,
-                                                                         ",".join(marginalized_key))
-    return helper.convert_keys_to_string(marginalized_distribution)  # conversion of keys to string
-
-
-# Same functionality as the function above with the only difference of not creation of indicator/sum/product nodes
-# Input: {distribution: {"0,0": {..node_format..}, "0,1": {..}}, variables_other_than_node: "B", variable_index: 5}
-# Output: {"0": {..node_format..}, "1": {..node_format..}}
-def marginalize_onto(distribution, variables_other_than_node, variable_index):
-    distribution = helper.convert_keys_to_tuple(distribution)
-    marginalized_distribution = {}
-
-    for key, value in distribution.items():
-        marginalized_key = key[:variable_index] + key[variable_index + 1:]
-
-        if marginalized_key in marginalized_distribution:
-            marginalized_distribution[marginalized_key]["references"].append(value)
-        else:
-            marginalized_distribution[marginalized_key] = sf.create_node("sum", None, [value],
-                                                                         variables_other_than_node,
-                                                                         ",".join(marginalized_key))
-    helper.convert_keys_to_string(distribution)
-    return helper.convert_keys_to_string(marginalized_distribution)
-
-
-# Function used to create the initial product nodes between the indicator nodes and probability nodes
-# Input: {node:"B", parents:["A"], universal_dict: {"A":{"0":0.9, "1":0.1} ..}, non_leaf_nodes: ["A"]}
-# Output: {product_nodes: {"0": {..node_format..} ..}, marginalized_onto: ["A"], node_name: "B,A"}
-def create_product_nodes(node, parents, universal_dict, non_leaf_nodes):
-    product_nodes = {}
-
-    # This condition identifies if the current node is a leaf node,
-    # in that case we directly calculate marginal over its parents
-    if len(parents) != 0 and node not in non_leaf_nodes:
-        # Marginalize onto the parents
-        marginalized = {
-            ",".join(parents): {
-                "product_nodes": marginalize(universal_dict[node], node, ",".join(parents))
-            },
-            "marginalized_onto": [",".join(parents)]
+            "states": bn_network["states"][node],
+            "values": bn_network["values"][node],
+            "parents": bn_network["parents"][node]
         }
-        return marginalized
-
-    # node_name is used for creating potentials later on in the process
-    node_name = node
-    if len(parents) != 0:
-        node_name = node + "," + ",".join(parents)
-
-    # creates indicator/value and their product nodes in the graph
-    for key, value in universal_dict[node].items():
-        indicator_node = sf.create_node("indicator", 1, [], node, key.split(",")[0])
-        value_node = sf.create_node("value", value, [], node, key)
-        product_node = sf.create_node("product", None, [indicator_node, value_node], node, key)
-        product_nodes[key] = product_node
-    return {"product_nodes": product_nodes, "marginalized_onto": [], "node_name": node_name}
+    return bn_graph_nodes
+
+
+# Parses the evidence and validates it against the indicators of the circuit below the root, like
+# circuit_functions.parse_evidence. Unknown variables or values raise an error instead of silently turning every
+# indicator on
+# Input: {root: {..node_format..}, evidence: "B=0,A=1" or {"B": "0", "A": "1"}}
+# Output: {"B": "0", "A": "1"}
+def validate_evidence(root, evidence):
+    if type(evidence) == str or evidence is None:
+        evidence = helper.parse_evidence_string(evidence)
+
+    indicators = set()
+    for node in cf.topological_sort_nodes([root]):
+        if node["type"] == "indicator":
+            indicators.add((node["node"], node["variable_value"]))
+    variables = {variable for variable, variable_value in indicators}
+    for variable, variable_value in evidence.items():
+        if variable not in variables:
+            raise ValueError("Unknown evidence variable '" + variable + "'")
+        if (variable, variable_value) not in indicators:
+            raise ValueError("Unknown value '" + variable_value + "' for evidence variable '" + variable + "'")
+    return evidence
 
 
 # Functions evaluates the created AC and returns appropriate responses as per the inputs
-# Input: {node: {..node_format..}, evidence: "B=0|A=1"}
+# The evidence is parsed and validated once at the root and the dict is passed down to the children
+# Input: {node: {..node_format..}, evidence: "B=0,A=1" or {"B": "0", "A": "1"}}
 # Output: 0.55
 def evaluate_arithmetic_circuit(node, evidence=None):
+    return evaluate_arithmetic_node(node, validate_evidence(node, evidence))
+
+
+# recursive part of evaluate_arithmetic_circuit, the evidence is the validated dict
+# Input: {node: {..node_format..}, evidence: {"B": "0", "A": "1"}}
+# Output: 0.55
+def evaluate_arithmetic_node(node, evidence):
     # print(node["type"])
     node_type = node["type"]
 
     if node_type == "value":
         return node["value"]
     elif node_type == "sum":
-        if type(node["references"]) == list:
-            result = sum(evaluate_arithmetic_circuit(child, evidence) for child in node["references"])
+        if type(node["references"]) != dict:
+            result = sum(evaluate_arithmetic_node(child, evidence) for child in node["references"])
             # print(node_type + ":" + node["node"] + ":" + node["variable_value"] + ":" + str(result))
             return result
         else:
-            result = sum(evaluate_arithmetic_circuit(child_value, evidence) for child_key, child_value in
+            result = sum(evaluate_arithmetic_node(child_value, evidence) for child_key, child_value in
                          node["references"].items())
             # print(node_type + ":" + node["node"] + ":" + node["variable_value"] + ":" + str(result))
             return result
     elif node_type == "product":
         result = 1
         for child in node["references"]:
-            result *= evaluate_arithmetic_circuit(child, evidence)
+            result *= evaluate_arithmetic_node(child, evidence)
         # print(node_type+":"+node["node"]+":"+node["variable_value"]+":"+str(result))
         return result
 
@@ -159,251 +138,131 @@ def evaluate_arithmetic_circuit(node, evidence=None):
     if not evidence:
         return 1
 
-    indicator_value = None
-    for item in evidence.split(","):
-        item = item.split("=")   # Example: evidence = "B=0|A=1" then item = B=0
-        item_variable = item[0].strip()  # item[0] = B
-        item_value = item[1].strip()  # item[1] = 0
-
-        if node["node"] == item_variable and node["variable_value"] == item_value:
-            # print("TURNING ON Indicator for ::", node)
-            indicator_value = 1
-        elif node["node"] == item_variable and node["variable_value"] != item_value:
-            # print("OFFF for Indicator for ::", node)
-            indicator_value = 0
-
     # Execution of this condition checks for the case when current_node = C and evidence is on B and A,
     # in that case, all the indicators for current node (which is C) have to be turned on
-    if indicator_value is None:
-        indicator_value = 1
+    if node["node"] not in evidence:
+        return 1
 
     # print(node_type + ":" + node["node"] + ":" + node["variable_value"] + ":" + str(indicator_value))
-    return indicator_value
-
-
-# function finds the elimination orders using the bn_network and common bn_graph_node network
-# Input: {bn_network: ...bn_object_from_pgmpy...,
-#         bn_graph_nodes: {"A":{"states":["0", "1"], "parents":[], "values":[[0.9, 0.1]}}
-#         }
-# Output: {"topological": ["B", "A"], "min_fill": [..], "min_weight": [..],
-#           "min_neighbors": [..], "weighted_min_fill": [..]}
-def find_elimination_order(bn_network, bn_graph_nodes):
-    edges = bn_network.get_edges()
-    cpds = []
-
-    model = BayesianNetwork(edges)
-
-    for node in bn_graph_nodes:
-        parents_states_dimension = []
-        for parent in bn_graph_nodes[node]['parents']:
-            parents_states_dimension.append(len(bn_graph_nodes[parent]['states']))
-
-        if len(parents_states_dimension):
-            cpds.append(TabularCPD(
-                node,
-                len(bn_graph_nodes[node]['states']),
-                bn_graph_nodes[node]['values'],
-                bn_graph_nodes[node]['parents'],
-                parents_states_dimension))
-        else:
-            cpds.append(TabularCPD(
-                node,
-                len(bn_graph_nodes[node]['states']),
-                bn_graph_nodes[node]['values']))
-
-    model.add_cpds(*cpds)
-
-    model.check_model()
-    elimination_orders = {}
-    elimination_orders['min_fill'] = MinFill(model).get_elimination_order(bn_network.get_variables())
-    elimination_orders['min_weight'] = MinWeight(model).get_elimination_order(bn_network.get_variables())
-    elimination_orders['min_neighbors'] = MinNeighbors(model).get_elimination_order(bn_network.get_variables())
-    elimination_orders['weighted_min_fill'] = WeightedMinFill(model).get_elimination_order(bn_network.get_variables())
-    elimination_orders['topological'] = list(reversed(list(nx.topological_sort(model))))
-    return elimination_orders
-
-
-# function used to remove the node from a distribution, basically create a marginal over the rest of the variables
-# Input: {new_buckets: {"B,C,A": {..node_format..}}, bucket_name: "B,C,A", selected_node_index: 1}
-# Output: {"B,A": {..node_format..}}
-def remove_node_from_potential(new_buckets, bucket_name, selected_node_index, common_values):
-    delete_bucket_item = True  # used to delete the existing bucket from new_buckets dict
-
-    # deduce the bucket name when node C is removed from B,C,A
-    variables_other_than_node = bucket_name.split(",")
-    del variables_other_than_node[selected_node_index]
-    variables_other_than_node = ",".join(variables_other_than_node)
-
-    # Handles the case when you want to remove the only bucket that exists in new_bucket
-    if len(variables_other_than_node) == 0:
-        variables_other_than_node = bucket_name
-        delete_bucket_item = False
-
-    # calculates the marginal distribution over every other variable except the one we need to remove
-    marginalized_distribution = marginalize_onto(new_buckets[bucket_name], variables_other_than_node,
-                                                 selected_node_index)
-
-    # delete the old bucket, in our case delete "B,C,A": {..node_format..}
-    if delete_bucket_item:
-        del new_buckets[bucket_name]
-
-    # handles the case when we have {new_buckets: {"B,C,A":{..}, "B,A":{..}}, bucket_name: "B,C,A"}
-    # basically the case when we already have a bucket with the same name as we created after marginalizing,
-    # In that case, we will have to create a potential over the contents of both the buckets
-    if variables_other_than_node in new_buckets and delete_bucket_item:
-        return calculate_potential(new_buckets[variables_other_than_node], marginalized_distribution,
-                                   variables_other_than_node, {}, selected_node_index, 0, False,
-                                   variables_other_than_node, True, common_values)
-
-    # When we only have 1 bucket in new_bucket, and we create the marginal over itself, we get key:"" as response.
-    # To handle that we just check for the length of the key to assign the proper values
-    for key in marginalized_distribution.keys():
-        if len(key) == 0:
-            new_buckets[variables_other_than_node] = marginalized_distribution[key]
-            break
-        else:
-            new_buckets[variables_other_than_node] = marginalized_distribution
-            break
-    return new_buckets
-
-
-# function provides the bucket name after checking all the necessary conditions
-# Input: {new_buckets: {"A":{..}}, bucket_item: "B,C", current_node_name:"A"}
-# Output: {bucket_name: "B,C,A", is_name_changed: True, new_buckets:{}}
-def deduce_bucket_name(new_buckets, bucket_item, current_node_name):
-    is_name_changed = False
-    bucket_name = bucket_item
-    common_values = {}
-
-    for node in current_node_name:
-        if node not in bucket_name:
-            result = bucket_name.split(",")
-            result.append(node)
-            bucket_name = ",".join(result)
-        else:
-            common_values[node] = current_node_name.index(node)
-
-        # bucket_name = ",".join(list(set(result + [node])))
-
-    if len(bucket_name) > len(bucket_item):
-        is_name_changed = True
-
-    # this condition checks that if there are variables that are not in the potential to be calculated, then we add them
-    # if len(",".join(current_node_name)) > 0 and ",".join(current_node_name) not in bucket_name:
-    #     is_name_changed = True
-    #     bucket_name = ",".join(bucket_item.split(",") + current_node_name)
-
-    # we remove the existing network since we will be calculating a new potential over the new variables
-    if bucket_item in new_buckets:
-        del new_buckets[bucket_item]
-    return bucket_name, is_name_changed, new_buckets, common_values
-
-
-def remove_common_values(current_node_key, current_node_index, common_values):
-  current_key = current_node_key
-  del current_key[current_node_index]
-  for key,value in common_values.items():
-    del current_key[value]
-  return current_key
-
-
-# This function uses the functions defined above and calculates a potential over variables
-# Input: {selected_node_obj: {"0,0":{..}, "0,1":{..}}, current_node_obj: {"0,0":{..}, "0,1":{..}},
-#         bucket_name: "B,C,A", new_buckets:{"B,C":{..}}, selected_node_index: 1, current_node_index: 0,
-#         is_name_changed: True, current_node: "B", is_bucket_item_equal_to_bucket_name: False}
-# Output: {"B,C,A":{..}}
-def calculate_potential(selected_node_obj, current_node_obj, bucket_name, new_buckets, selected_node_index,
-                        current_node_index, is_name_changed, current_node, is_bucket_item_equal_to_bucket_name, common_values):
-    for selected_node_key, selected_node_value in selected_node_obj.items():  # loop over all the possible values
-        selected_node_key = selected_node_key.split(",")  # splitting for ease in calculation
-
-        for current_node_key, current_node_value in current_node_obj.items(): # loop over all values for current node
-            current_node_key = current_node_key.split(",")  # splitting for ease in calculation
-
-            # Condition is to identify the case when we want to create potential between 2 buckets with same key-values
-            # pairs but different altogether
-            if is_bucket_item_equal_to_bucket_name:
-                if ",".join(current_node_key) == ",".join(selected_node_key):
-                    if bucket_name not in new_buckets:
-                        new_buckets[bucket_name] = {}
-                    new_buckets[bucket_name][",".join(selected_node_key)] = sf.create_node("product", None,
-                                                                                           [selected_node_value,
-                                                                                            current_node_value],
-                                                                                           current_node,
-                                                                                           ",".join(current_node_key))
-                    continue
-                else:
-                    continue
-
-            # Condition to check for the same variable value for node in either keys
-            # if selected_node is for B,C > selected_node_key can be 0,0 / 0,1 / 1,0 / 0,0 and selected_node_index = 0
-            # if current_node is for B,A > current_node_key can be 0,0 / 0,1 / 1,0 / 0,0 and current_node_index = 0
-            # therefore we need to check selected_node_key[0] = current_node_key[0] for all these cases
-            if selected_node_key[selected_node_index] == current_node_key[current_node_index]:
-
-                if bucket_name not in new_buckets:
-                    new_buckets[bucket_name] = {}
-
-                # current_key = current_node_key
-                # del current_key[current_node_index]
-                current_key = remove_common_values(current_node_key, current_node_index, common_values)
-
-                new_bucket_node_key = ",".join(selected_node_key)
-                if is_name_changed:
-                    # if name is changed, meaning we have appended another node in the name and thus will have new key
-                    new_bucket_node_key = ",".join(selected_node_key + current_key)
-
-                # if we have already created a product node for the given key, we do not want to overwrite it.
-                is_duplicate = False
-                if new_bucket_node_key in new_buckets[bucket_name]:
-                    is_duplicate = True
-                if not is_duplicate:
-                    new_buckets[bucket_name][new_bucket_node_key] = sf.create_node("product", None,
-                                                                                   [selected_node_value,
-                                                                                    current_node_value],
-                                                                                   current_node,
-                                                                                   ",".join(current_node_key))
-    return new_buckets
-
-
-# function uses all the above functions to eliminate a node from the dict of buckets.
-# First, it calculates the new bucket name based on the inputs
-# then it calculates the potentials and updates the buckets
-# then removes the node from the buckets
-# Input : {node: "B", node_value_obj: {"0,0":{..}, "0,1":{..}}, buckets: {"B,C,A": {..}}, current_node_name: "B,A"}
-# Output: {"C,A": {..}}
-def eliminate_node(node, node_value_obj, buckets, current_node_name):
-    print("Eliminating node ::", node)
-
-    # removing the node to be eliminated from the node_name to achieve nodes for which potential bucket would be created
-    current_node_index = current_node_name.split(",").index(node)
-    current_node_name = current_node_name.split(",")
-    del current_node_name[current_node_index]
-
-    new_buckets = {}
-    # print("BUCKET ::", buckets.keys())
-
-    for item in buckets:
-        if node not in item:
-            # if the current bucket does not contain the node variable, then we leave that bucket as it is
-            new_buckets[item] = buckets[item]
-            continue
-
-        # finding the index of the node variable to be removed for calculation of potentials
-        index = item.split(",").index(node)
-        if index > -1:
-            bucket_name, is_name_changed, new_buckets, common_values = deduce_bucket_name(new_buckets, item, current_node_name)
-
-            # True, means potential bucket we will be calculating already exists in the buckets' dict,
-            # False, means they are different buckets and thus requires normal calculation
-            is_bucket_item_equal_to_bucket_name = item == bucket_name and len(buckets[item].keys()) == len(
-                node_value_obj.keys())
-            new_buckets = calculate_potential(buckets[item], node_value_obj, bucket_name, new_buckets, index,
-                                              current_node_index, is_name_changed, node,
-                                              is_bucket_item_equal_to_bucket_name, common_values)
-            new_buckets = remove_node_from_potential(new_buckets, bucket_name, index, common_values)
-        else:
-            # if the current bucket does not contain the node variable, then we leave that bucket as it is
-            new_buckets[item] = buckets[item]
-
-    return new_buckets
+    return 1 if evidence[node["node"]] == node["variable_value"] else 0
+
+
+# creates the moral graph of the BN, every node is connected to its parents, its children and the other parents of its
+# children. The graph is used by the elimination order heuristics below
+# Input: {bn_graph_nodes: {"A":{"states":["0", "1"], "parents":[], ..}, "B":{"parents":["A"], ..}}}
+# Output: {"A": {"B"}, "B": {"A"}}
+def get_moral_graph(bn_graph_nodes):
+    graph = {node: set() for node in bn_graph_nodes}
+    for node, value in bn_graph_nodes.items():
+        family = [node] + list(value["parents"])
+        for i in range(len(family)):
+            for j in range(i + 1, len(family)):
+                graph[family[i]].add(family[j])
+                graph[family[j]].add(family[i])
+    return graph
+
+
+# cost functions of the greedy elimination order heuristics, the variable with the lowest cost is eliminated next
+# Input: {graph: {"A": {"B"}, ..}, cardinalities: {"A": 2, ..}, node: "A"}
+# Output: 4
+def min_neighbors_cost(graph, cardinalities, node):
+    return len(graph[node])
+
+
+def min_weight_cost(graph, cardinalities, node):
+    weight = 1
+    for neighbor in graph[node]:
+        weight *= cardinalities[neighbor]
+    return weight
+
+
+def min_fill_cost(graph, cardinalities, node):
+    neighbors = list(graph[node])
+    return sum(1 for i in range(len(neighbors)) for j in range(i + 1, len(neighbors))
+               if neighbors[j] not in graph[neighbors[i]])
+
+
+def weighted_min_fill_cost(graph, cardinalities, node):
+    neighbors = list(graph[node])
+    return sum(cardinalities[neighbors[i]] * cardinalities[neighbors[j]]
+               for i in range(len(neighbors)) for j in range(i + 1, len(neighbors))
+               if neighbors[j] not in graph[neighbors[i]])
+
+
+elimination_cost_functions = {
+    "min_fill": min_fill_cost,
+    "min_weight": min_weight_cost,
+    "min_neighbors": min_neighbors_cost,
+    "weighted_min_fill": weighted_min_fill_cost,
+}
+
+
+# Greedy elimination order: repeatedly eliminates the node with the lowest cost from the moral graph and connects its
+# neighbors. Ties are broken by the order of the nodes in bn_graph_nodes, so the result is deterministic
+# Input: {bn_graph_nodes: {"A":{"states":["0", "1"], "parents":[], ..}, ..}, cost_function: min_fill_cost}
+# Output: ["B", "A"]
+def find_greedy_elimination_order(bn_graph_nodes, cost_function):
+    graph = get_moral_graph(bn_graph_nodes)
+    cardinalities = {node: len(value["states"]) for node, value in bn_graph_nodes.items()}
+    elimination_order = []
+
+    while graph:
+        node = min(graph, key=lambda item: cost_function(graph, cardinalities, item))
+        neighbors = graph.pop(node)
+        for neighbor in neighbors:
+            graph[neighbor].discard(node)
+            graph[neighbor].update(item for item in neighbors if item != neighbor)
+        elimination_order.append(node)
+    return elimination_order
+
+
+# reversed topological order of the BN, every node is eliminated before its parents
+# Input: {bn_graph_nodes: {"A":{"parents":[], ..}, "B":{"parents":["A"], ..}}}
+# Output: ["B", "A"]
+def find_topological_elimination_order(bn_graph_nodes):
+    children = {node: [] for node in bn_graph_nodes}
+    missing_parents = {}
+    for node, value in bn_graph_nodes.items():
+        missing_parents[node] = len(value["parents"])
+        for parent in value["parents"]:
+            children[parent].append(node)
+
+    topological_order = [node for node in bn_graph_nodes if missing_parents[node] == 0]
+    for node in topological_order:  # the list grows while it is being iterated
+        for child in children[node]:
+            missing_parents[child] -= 1
+            if missing_parents[child] == 0:
+                topological_order.append(child)
+
+    if len(topological_order) != len(bn_graph_nodes):
+        raise Exception("Bayesian Network contains a cycle!")
+    return list(reversed(topological_order))
+
+
+elimination_strategies = ["topological"] + list(elimination_cost_functions) + ["auto"]
+
+
+# function finds the elimination order of the BN with the selected strategy, only the requested strategy is computed.
+# "auto" computes the order of every other strategy, estimates the induced width and circuit size of each one with
+# factor_functions.estimate_circuit_size and returns the order with the smallest largest factor, then the smallest
+# circuit
+# Input: {bn_graph_nodes: {"A":{"states":["0", "1"], "parents":[], "values":[[0.9, 0.1]}},
+#         strategy: "topological"/"min_fill"/"min_weight"/"min_neighbors"/"weighted_min_fill"/"auto"}
+# Output: ["B", "A"]
+def find_elimination_order(bn_graph_nodes, strategy="topological"):
+    if strategy == "topological":
+        return find_topological_elimination_order(bn_graph_nodes)
+    if strategy in elimination_cost_functions:
+        return find_greedy_elimination_order(bn_graph_nodes, elimination_cost_functions[strategy])
+    if strategy != "auto":
+        raise ValueError("Unknown elimination order strategy '" + strategy + "', expected one of " +
+                         str(elimination_strategies))
+
+    best_order, best_cost = None, None
+    for candidate in elimination_strategies[:-1]:
+        elimination_order = find_elimination_order(bn_graph_nodes, candidate)
+        estimate = ff.estimate_circuit_size(bn_graph_nodes, elimination_order)
+        cost = (estimate["max_factor_size"], estimate["nodes"] + estimate["edges"], estimate["induced_width"])
+        if best_cost is None or cost < best_cost:
+            best_order, best_cost = elimination_order, cost
+    return best_order
@@ -0,0 +1,121 @@
+# Description:
+# This file implements an on-disk cache of compiled arithmetic circuits, so a BIF file that has not changed is not
+# parsed and compiled again. The circuits are stored in a directory, one file per circuit, named by a hash of the BIF
+# content, the elimination order strategy, the simplification passes and circuit_functions.COMPILER_VERSION.
+# The files use the memory-mappable format of serialize_functions, so the processes loading the same circuit share it.
+# Files are written to a temporary file and renamed into place, so processes sharing the directory never read a
+# partial circuit. The least recently used circuits are removed once the directory exceeds its size limit.
+
+import hashlib
+import os
+import tempfile
+import time
+
+try:
+    import fcntl  # used to serialize the eviction between processes, not available on Windows
+except ImportError:
+    fcntl = None
+
+import circuit_functions as cf
+import serialize_functions as sz
+import simplify_functions as simp
+
+CACHE_FILE_EXTENSION = ".circuit"
+TEMPORARY_FILE_EXTENSION = ".tmp"
+STALE_TEMPORARY_FILE_AGE = 60 * 60  # seconds, a temporary file this old was left behind by a writer that was killed
+DEFAULT_MAX_CACHE_SIZE = 1024 * 1024 * 1024  # 1 GiB
+
+
+# calculates the key of a circuit from the content of the BIF file, the elimination strategy, the names of the
+# simplification passes (None for simplify_functions.default_passes) and the compiler version
+# Input: {absolute_file_path: "....Absolute_path_to_bif_file....", elimination_strategy: "auto",
+#         simplification_passes: [simp.fold_constants, ..]}
+# Output: "3f2a..."
+def get_cache_key(absolute_file_path, elimination_strategy, simplification_passes=None):
+    digest = hashlib.sha256()
+    with open(absolute_file_path, "rb") as bif_file:
+        for chunk in iter(lambda: bif_file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    pass_names = ",".join(simplification_pass.__name__ for simplification_pass in
+                          (simp.default_passes if simplification_passes is None else simplification_passes))
+    digest.update(("|" + elimination_strategy + "|" + pass_names + "|" + str(cf.COMPILER_VERSION)).encode())
+    return digest.hexdigest()
+
+
+def get_cache_path(cache_directory, cache_key):
+    return os.path.join(cache_directory, cache_key + CACHE_FILE_EXTENSION)
+
+
+# loads a compiled circuit from the cache and marks it as recently used. A missing or unreadable file is a cache miss
+# Input: {cache_directory: "arithmetic-circuits/cache", cache_key: "3f2a..."}
+# Output: {..compiled_circuit_format..} OR None
+def load_circuit(cache_directory, cache_key):
+    cache_path = get_cache_path(cache_directory, cache_key)
+    try:
+        circuit = sz.read_circuit_file(cache_path)
+        os.utime(cache_path)  # the modification time is used as the last access time for the LRU eviction
+    except (OSError, ValueError):
+        return None
+    return circuit
+
+
+# stores a compiled circuit in the cache, then evicts the least recently used circuits above max_cache_size
+# Input: {cache_directory: "arithmetic-circuits/cache", cache_key: "3f2a..", circuit: {..compiled_circuit_format..}}
+# Output: "arithmetic-circuits/cache/3f2a...circuit"
+def store_circuit(cache_directory, cache_key, circuit, max_cache_size=DEFAULT_MAX_CACHE_SIZE):
+    os.makedirs(cache_directory, exist_ok=True)
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=cache_directory, suffix=TEMPORARY_FILE_EXTENSION)
+    try:
+        os.close(file_descriptor)
+        sz.write_circuit_file(circuit, temporary_path)
+        os.replace(temporary_path, get_cache_path(cache_directory, cache_key))
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+    evict_circuits(cache_directory, max_cache_size)
+    return get_cache_path(cache_directory, cache_key)
+
+
+# removes the least recently used circuits until the cache directory is not bigger than max_cache_size.
+# Temporary files older than STALE_TEMPORARY_FILE_AGE are removed first, the younger ones belong to running writers and
+# count toward the size of the cache.
+# Another process may remove the same files at the same time, so files that disappear are simply skipped
+# Input: {cache_directory: "arithmetic-circuits/cache", max_cache_size: 1073741824}
+# Output: ["arithmetic-circuits/cache/1a2b...circuit", ..] removed files
+def evict_circuits(cache_directory, max_cache_size=DEFAULT_MAX_CACHE_SIZE):
+    with open(os.path.join(cache_directory, ".lock"), "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        entries = []
+        removed_files = []
+        cache_size = 0
+        for file_name in os.listdir(cache_directory):
+            if not file_name.endswith(CACHE_FILE_EXTENSION) and not file_name.endswith(TEMPORARY_FILE_EXTENSION):
+                continue
+            cache_path = os.path.join(cache_directory, file_name)
+            try:
+                file_stat = os.stat(cache_path)
+                if file_name.endswith(TEMPORARY_FILE_EXTENSION):
+                    if time.time() - file_stat.st_mtime > STALE_TEMPORARY_FILE_AGE:
+                        os.remove(cache_path)
+                        removed_files.append(cache_path)
+                    else:
+                        cache_size += file_stat.st_size
+                    continue
+            except OSError:  # already removed by another process
+                continue
+            entries.append((file_stat.st_mtime, file_stat.st_size, cache_path))
+
+        cache_size += sum(entry[1] for entry in entries)
+        for modification_time, file_size, cache_path in sorted(entries):
+            if cache_size <= max_cache_size:
+                break
+            try:
+                os.remove(cache_path)
+                removed_files.append(cache_path)
+            except OSError:  # already removed by another process, or still mapped on Windows
+                pass
+            cache_size -= file_size
+    return removed_files
@@ -0,0 +1,649 @@
+# Description:
+# This file lowers the arithmetic circuit created by main.create_sum_product_network (nested dicts in the node format
+# of structure_functions.create_node) into a flat program of arrays in topological order, and evaluates that program
+# iteratively. Shared nodes are visited once and deep circuits no longer hit the recursion limit.
+# Format of a compiled circuit ::
+# {
+#     "opcodes": array([..]), ## one opcode per node, see the OP_* constants below
+#     "child_offsets": array([..]), ## children of node i are children[child_offsets[i]:child_offsets[i + 1]]
+#     "children": array([..]), ## indices of the child nodes, a child index is always smaller than its parent index
+#     "values": array([..]), ## probability value of parameter nodes, 0 for every other node
+#     "levels": array([..]), ## 0 for leaves, otherwise 1 + the highest level among the children
+#     "indicators": [("A", "0"), ..], ## (variable, variable_value) of indicator i, which is always node i
+#     "roots": {"A": 12}, ## bucket name -> index of the root node of that bucket
+#     "parameters": [("A", "0"), ("B", "0,1"), ..], ## (variable, CPT entry) of parameter slot i
+#     "parameter_nodes": array([..]), ## index of the parameter node reading slot i of the parameter vector
+#     "folded_parameters": {("B", "1,0"): 0.0}, ## (variable, CPT entry) -> value of the parameters removed by
+#                                               ## simplify_functions.fold_constants, optional
+#     "families": {"B": ["B", "A"]}, ## variable -> variable and parents of its CPT, used by plot_graph to select the
+#                                    ## nodes of a variable, optional and not stored by serialize_functions
+# }
+
+import heapq
+import numpy as np
+
+import helper
+
+OP_INDICATOR = 0
+OP_PARAMETER = 1
+OP_SUM = 2
+OP_PRODUCT = 3
+
+node_type_opcodes = {"indicator": OP_INDICATOR, "value": OP_PARAMETER, "sum": OP_SUM, "product": OP_PRODUCT}
+
+# "COMPILER_VERSION" has to be increased whenever the compiled circuits change, it invalidates the stored circuits.
+# The example in the metadata format of serialize_functions has to be updated with it
+COMPILER_VERSION = 3
+
+
+# returns the children of a node, the references of a sum node can either be a list or a dict of nodes
+# Input: {node: {..node_format..}}
+# Output: [{..node_format..}, ..]
+def get_node_children(node):
+    references = node["references"]
+    if type(references) == dict:
+        return list(references.values())
+    return references
+
+
+# Function lists every node reachable from the roots exactly once, children before their parents.
+# The traversal uses an explicit stack, so the depth of the circuit is not limited by the recursion limit
+# Input: {roots: [{..node_format..}, ..]}
+# Output: [{..node_format..}, ..] in topological order
+def topological_sort_nodes(roots):
+    ordered_nodes = []
+    visited = set()
+
+    for root in roots:
+        stack = [(root, False)]
+        while stack:
+            node, is_expanded = stack.pop()
+            if is_expanded:
+                ordered_nodes.append(node)
+                continue
+            if id(node) in visited:
+                continue
+            visited.add(id(node))
+            stack.append((node, True))
+            for child in reversed(get_node_children(node)):
+                if id(child) not in visited:
+                    stack.append((child, False))
+    return ordered_nodes
+
+
+# Compiles the buckets of the sum product network into the flat array format described at the top of this file.
+# Indicator nodes are identified by (variable, variable_value) and placed first, so indicator i is node i.
+# A sum/product node without any children is folded into the constant it evaluates to (0 and 1 respectively).
+# Every parameter node gets a slot of the parameter vector, identified by its variable and CPT entry
+# Input: {buckets: {"A": {..node_format..}}}
+# Output: {..compiled_circuit_format..}
+def compile_arithmetic_circuit(buckets):
+    ordered_nodes = topological_sort_nodes(list(buckets.values()))
+
+    indicators = []
+    indicator_ids = {}  # (variable, variable_value) -> indicator id
+    node_indices = {}  # id(node) -> index in the flat arrays
+    for node in ordered_nodes:
+        if node["type"] == "indicator":
+            indicator = (node["node"], node["variable_value"])
+            if indicator not in indicator_ids:
+                indicator_ids[indicator] = len(indicators)
+                indicators.append(indicator)
+            node_indices[id(node)] = indicator_ids[indicator]
+
+    opcodes = [OP_INDICATOR] * len(indicators)
+    values = [0.0] * len(indicators)
+    levels = [0] * len(indicators)
+    child_offsets = [0] * (len(indicators) + 1)
+    children = []
+    parameters = []
+    parameter_nodes = []
+    for node in ordered_nodes:
+        if node["type"] == "indicator":
+            continue
+
+        node_children = get_node_children(node)
+        opcode = node_type_opcodes[node["type"]]
+        value = 0.0
+        level = 0
+        if opcode == OP_PARAMETER:
+            value = float(node["value"])
+            parameters.append((node["node"], node["variable_value"]))
+            parameter_nodes.append(len(opcodes))
+        elif len(node_children) == 0:
+            value = 0.0 if opcode == OP_SUM else 1.0
+            opcode = OP_PARAMETER
+        else:
+            child_indices = [node_indices[id(child)] for child in node_children]
+            children.extend(child_indices)
+            level = 1 + max(levels[child] for child in child_indices)
+
+        node_indices[id(node)] = len(opcodes)
+        opcodes.append(opcode)
+        values.append(value)
+        levels.append(level)
+        child_offsets.append(len(children))
+
+    return {
+        "opcodes": np.array(opcodes, dtype=np.int8),
+        "child_offsets": np.array(child_offsets, dtype=np.int64),
+        "children": np.array(children, dtype=np.int64),
+        "values": np.array(values, dtype=np.float64),
+        "levels": np.array(levels, dtype=np.int32),
+        "indicators": indicators,
+        "roots": {key: node_indices[id(value)] for key, value in buckets.items()},
+        "parameters": parameters,
+        "parameter_nodes": np.array(parameter_nodes, dtype=np.int64),
+    }
+
+
+# Creates the lookup tables between the variables of the circuit and the ids of their indicators.
+# The tables are created once and kept in the circuit under "indicator_index"
+# Input: {circuit: {..compiled_circuit_format..}}
+# Output: {variable_indicators: {"A": [0, 1]}, indicator_ids: {("A", "0"): 0, ("A", "1"): 1}}
+def get_indicator_index(circuit):
+    if "indicator_index" in circuit:
+        return circuit["indicator_index"]
+
+    variable_indicators = {}  # variable -> ids of all its indicators
+    indicator_ids = {}  # (variable, variable_value) -> indicator id
+    for indicator_id, (variable, variable_value) in enumerate(circuit["indicators"]):
+        variable_indicators.setdefault(variable, []).append(indicator_id)
+        indicator_ids[(variable, variable_value)] = indicator_id
+
+    circuit["indicator_index"] = {"variable_indicators": variable_indicators, "indicator_ids": indicator_ids}
+    return circuit["indicator_index"]
+
+
+# Parses and validates the evidence against the variables of the circuit, this is done once per query.
+# Unknown variables or values raise an error instead of silently turning every indicator on
+# Input: {circuit: {..compiled_circuit_format..}, evidence: "B=0,A=1" or {"B": "0", "A": "1"}}
+# Output: [(indicator ids of B, indicator id of B=0), (indicator ids of A, indicator id of A=1)]
+def parse_evidence(circuit, evidence):
+    if type(evidence) == str or evidence is None:
+        evidence = helper.parse_evidence_string(evidence)
+
+    indicator_index = get_indicator_index(circuit)
+    parsed_evidence = []
+    for variable, variable_value in evidence.items():
+        if variable not in indicator_index["variable_indicators"]:
+            raise ValueError("Unknown evidence variable '" + variable + "'")
+        if (variable, variable_value) not in indicator_index["indicator_ids"]:
+            raise ValueError("Unknown value '" + variable_value + "' for evidence variable '" + variable + "'")
+        parsed_evidence.append((indicator_index["variable_indicators"][variable],
+                                indicator_index["indicator_ids"][(variable, variable_value)]))
+    return parsed_evidence
+
+
+# Creates the value of every indicator for the given evidence: indicators of observed variables are 1 only for the
+# observed value, the indicators of every other variable stay turned on
+# Input: {circuit: {..compiled_circuit_format..}, evidence: "B=0,A=1" or {"B": "0", "A": "1"}}
+# Output: [1, 0, 1, 1, ..]
+def get_indicator_values(circuit, evidence=None):
+    indicator_values = [1.0] * len(circuit["indicators"])
+    for variable_indicator_ids, indicator_id in parse_evidence(circuit, evidence):
+        for variable_indicator_id in variable_indicator_ids:
+            indicator_values[variable_indicator_id] = 0.0
+        indicator_values[indicator_id] = 1.0
+    return indicator_values
+
+
+# Runs the flat program once and returns the value of every node, the loop visits every node exactly once.
+# With maximize, sum nodes take the maximum of their children instead (max-product evaluation)
+# Input: {circuit: {..compiled_circuit_format..}, indicator_values: [1, 0, ..], maximize: False}
+# Output: [1, 0, .., 0.55]
+def evaluate_nodes(circuit, indicator_values, maximize=False):
+    opcodes = circuit["opcodes"].tolist()
+    child_offsets = circuit["child_offsets"].tolist()
+    children = circuit["children"].tolist()
+    values = circuit["values"].tolist()
+
+    node_values = list(indicator_values) + [0.0] * (len(opcodes) - len(indicator_values))
+    for i in range(len(indicator_values), len(opcodes)):
+        opcode = opcodes[i]
+        if opcode == OP_PARAMETER:
+            node_values[i] = values[i]
+        elif opcode == OP_SUM and maximize:
+            node_values[i] = max(node_values[child] for child in children[child_offsets[i]:child_offsets[i + 1]])
+        elif opcode == OP_SUM:
+            result = 0.0
+            for child in children[child_offsets[i]:child_offsets[i + 1]]:
+                result += node_values[child]
+            node_values[i] = result
+        else:
+            result = 1.0
+            for child in children[child_offsets[i]:child_offsets[i + 1]]:
+                result *= node_values[child]
+            node_values[i] = result
+    return node_values
+
+
+# Evaluates the compiled circuit for the given evidence, it is the flat counterpart of
+# bn_functions.evaluate_arithmetic_circuit and returns the value of every root of the buckets.
+# With maximize, the roots hold the probability of the most probable explanation instead of the evidence
+# Input: {circuit: {..compiled_circuit_format..}, evidence: "B=0,A=1" or {"B": "0", "A": "1"}, maximize: False}
+# Output: {"A": 0.55}
+def evaluate_compiled_circuit(circuit, evidence=None, maximize=False):
+    node_values = evaluate_nodes(circuit, get_indicator_values(circuit, evidence), maximize)
+    return {key: node_values[index] for key, index in circuit["roots"].items()}
+
+
+# Creates the matrix of indicator values for a batch of evidence, row i holds the indicators for evidence_list[i].
+# Every evidence is validated once with parse_evidence, then only the indicators of observed variables are written
+# Input: {circuit: {..compiled_circuit_format..}, evidence_list: ["B=0,A=1", {"B": "1"}, None]}
+# Output: array([[1, 0, 0, 1], [0, 1, 1, 1], [1, 1, 1, 1]])
+def get_indicator_matrix(circuit, evidence_list):
+    indicator_matrix = np.ones((len(evidence_list), len(circuit["indicators"])), dtype=np.float64)
+    for row, evidence in enumerate(evidence_list):
+        for variable_indicator_ids, indicator_id in parse_evidence(circuit, evidence):
+            indicator_matrix[row, variable_indicator_ids] = 0.0
+            indicator_matrix[row, indicator_id] = 1.0
+    return indicator_matrix
+
+
+# Groups the sum/product nodes of the circuit by level and opcode. Every group can be evaluated with a single
+# gather of the child rows followed by a ufunc.reduceat over the segments of each node.
+# The schedule is computed once and kept in the circuit under "level_schedule"
+# Input: {circuit: {..compiled_circuit_format..}}
+# Output: [(nodes: array([..]), opcode: OP_SUM, child_indices: array([..]), segment_offsets: array([..])), ..]
+def get_level_schedule(circuit):
+    if "level_schedule" in circuit:
+        return circuit["level_schedule"]
+
+    opcodes = circuit["opcodes"]
+    child_offsets = circuit["child_offsets"]
+    levels = circuit["levels"]
+    schedule = []
+    for level in range(1, int(levels.max(initial=0)) + 1):
+        for opcode in (OP_SUM, OP_PRODUCT):
+            nodes = np.flatnonzero((levels == level) & (opcodes == opcode))
+            if len(nodes) == 0:
+                continue
+            starts = child_offsets[nodes]
+            counts = child_offsets[nodes + 1] - starts
+            segment_offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            # position j of the gathered block belongs to the node whose segment contains j
+            child_positions = np.repeat(starts - segment_offsets, counts) + np.arange(counts.sum())
+            schedule.append((nodes, opcode, circuit["children"][child_positions], segment_offsets))
+
+    circuit["level_schedule"] = schedule
+    return schedule
+
+
+# Vectorized counterpart of evaluate_nodes, evaluates the circuit for every row of the indicator matrix at once.
+# Row i of the result holds the values of node i for every evidence in the batch. With maximize, sum nodes take the
+# maximum of their children
+# Input: {circuit: {..compiled_circuit_format..}, indicator_matrix: array([[1, 0, ..], [0, 1, ..]]), maximize: False}
+# Output: array([[1, 0], [0, 1], .., [0.55, 0.45]])
+def evaluate_nodes_batch(circuit, indicator_matrix, maximize=False):
+    opcodes = circuit["opcodes"]
+    indicator_count = len(circuit["indicators"])
+
+    node_values = np.empty((len(opcodes), indicator_matrix.shape[0]), dtype=np.float64)
+    node_values[:indicator_count] = indicator_matrix.T
+    parameters = np.flatnonzero(opcodes == OP_PARAMETER)
+    node_values[parameters] = circuit["values"][parameters, np.newaxis]
+
+    sum_ufunc = np.maximum if maximize else np.add
+    for nodes, opcode, child_indices, segment_offsets in get_level_schedule(circuit):
+        ufunc = sum_ufunc if opcode == OP_SUM else np.multiply
+        node_values[nodes] = ufunc.reduceat(node_values[child_indices], segment_offsets, axis=0)
+    return node_values
+
+
+# Evaluates the compiled circuit for N evidence strings in one vectorized pass
+# Input: {circuit: {..compiled_circuit_format..}, evidence_list: ["B=0,A=1", {"B": "1"}], maximize: False}
+# Output: {"A": array([0.55, 0.3])}
+def evaluate_compiled_circuit_batch(circuit, evidence_list, maximize=False):
+    node_values = evaluate_nodes_batch(circuit, get_indicator_matrix(circuit, evidence_list), maximize)
+    return {key: node_values[index] for key, index in circuit["roots"].items()}
+
+
+# Reverse-mode (downward) pass over the flat program, the upward pass is evaluate_nodes.
+# The roots are the factors of the network polynomial, so the derivative of each root is the product of the others.
+# Products use prefix/suffix products of the children, which stays correct when a child evaluates to 0
+# Input: {circuit: {..compiled_circuit_format..}, node_values: [1, 0, .., 0.55]}
+# Output: [0.3, 0.25, .., 1.0] partial derivative of the network polynomial with respect to every node
+def differentiate_nodes(circuit, node_values):
+    opcodes = circuit["opcodes"].tolist()
+    child_offsets = circuit["child_offsets"].tolist()
+    children = circuit["children"].tolist()
+
+    derivatives = [0.0] * len(opcodes)
+    roots = list(circuit["roots"].values())
+    for i in range(len(roots)):
+        root_derivative = 1.0
+        for j in range(len(roots)):
+            if i != j:
+                root_derivative *= node_values[roots[j]]
+        derivatives[roots[i]] += root_derivative
+
+    for i in range(len(opcodes) - 1, len(circuit["indicators"]) - 1, -1):
+        derivative = derivatives[i]
+        if derivative == 0.0 or opcodes[i] == OP_PARAMETER:
+            continue
+        node_children = children[child_offsets[i]:child_offsets[i + 1]]
+        if opcodes[i] == OP_SUM:
+            for child in node_children:
+                derivatives[child] += derivative
+            continue
+
+        # derivative of a product with respect to a child is the product of all the other children
+        suffix_products = [1.0] * (len(node_children) + 1)
+        for j in range(len(node_children) - 1, -1, -1):
+            suffix_products[j] = suffix_products[j + 1] * node_values[node_children[j]]
+        prefix_product = derivative
+        for j, child in enumerate(node_children):
+            derivatives[child] += prefix_product * suffix_products[j + 1]
+            prefix_product *= node_values[child]
+    return derivatives
+
+
+# Runs the upward and the downward pass once and returns the partial derivative for every indicator.
+# For an unobserved variable X, the derivative of indicator X=x is P(X=x, evidence)
+# Input: {circuit: {..compiled_circuit_format..}, evidence: "B=0,A=1" or {"B": "0", "A": "1"}}
+# Output: {probability: 0.55, indicator_values: [1, 0, ..], derivatives: [0.3, 0.25, ..]}
+def evaluate_indicator_derivatives(circuit, evidence=None):
+    indicator_values = get_indicator_values(circuit, evidence)
+    node_values = evaluate_nodes(circuit, indicator_values)
+    derivatives = differentiate_nodes(circuit, node_values)
+
+    probability = 1.0
+    for index in circuit["roots"].values():
+        probability *= node_values[index]
+    return {
+        "probability": probability,
+        "indicator_values": indicator_values,
+        "derivatives": derivatives[:len(indicator_values)],
+    }
+
+
+# Computes the posterior marginal P(X=x | evidence) of every variable with a single upward and downward pass,
+# instead of one evaluation of the circuit for every (variable, value) pair
+# Input: {circuit: {..compiled_circuit_format..}, evidence: "B=0,A=1" or {"B": "0", "A": "1"}}
+# Output: {"A": {"0": 0.0, "1": 1.0}, "C": {"0": 0.2, "1": 0.8}}
+def compute_posterior_marginals(circuit, evidence=None):
+    result = evaluate_indicator_derivatives(circuit, evidence)
+    return get_posterior_marginals(circuit, result["indicator_values"], result["derivatives"], result["probability"])
+
+
+# Divides the joint probability of every indicator, its value times its derivative, by the probability of the evidence
+# Input: {circuit: {..compiled_circuit_format..}, indicator_values: [1, 0, ..], derivatives: [0.3, 0.25, ..],
+#         probability: 0.55}
+# Output: {"A": {"0": 0.0, "1": 1.0}, "C": {"0": 0.2, "1": 0.8}}
+def get_posterior_marginals(circuit, indicator_values, derivatives, probability):
+    if probability == 0:
+        raise ValueError("Posterior marginals are undefined for evidence with probability 0")
+
+    posteriors = {}
+    for indicator_id, (variable, variable_value) in enumerate(circuit["indicators"]):
+        joint_probability = indicator_values[indicator_id] * derivatives[indicator_id]
+        posteriors.setdefault(variable, {})[variable_value] = joint_probability / probability
+    return posteriors
+
+
+# Vectorized counterpart of differentiate_nodes for the node values of evaluate_nodes_batch, one column per evidence.
+# The groups of the level schedule are visited from the highest level down, so the derivative of a node is complete
+# before it is passed to its children. The derivative of a product with respect to a child is the product of the other
+# children: the product of the non-zero children divided by the child, or that product for the only zero child
+# Input: {circuit: {..compiled_circuit_format..}, node_values: array([[1, 0], [0, 1], .., [0.55, 0.45]])}
+# Output: array([[0.3, 0.2], [0.25, 0.1], .., [1, 1]]) partial derivatives, one row per node
+def differentiate_nodes_batch(circuit, node_values):
+    derivatives = np.zeros_like(node_values)
+    roots = list(circuit["roots"].values())
+    for i in range(len(roots)):
+        derivatives[roots[i]] += np.prod(node_values[roots[:i] + roots[i + 1:]], axis=0)
+
+    for nodes, opcode, child_indices, segment_offsets in reversed(get_level_schedule(circuit)):
+        counts = np.diff(np.append(segment_offsets, len(child_indices)))
+        parent_derivatives = np.repeat(derivatives[nodes], counts, axis=0)
+        if opcode == OP_SUM:
+            np.add.at(derivatives, child_indices, parent_derivatives)
+            continue
+
+        child_values = node_values[child_indices]
+        is_zero = child_values == 0.0
+        zero_counts = np.repeat(np.add.reduceat(is_zero, segment_offsets, axis=0), counts, axis=0)
+        non_zero_products = np.repeat(np.multiply.reduceat(np.where(is_zero, 1.0, child_values), segment_offsets,
+                                                           axis=0), counts, axis=0)
+        other_products = np.where(zero_counts == 0, non_zero_products / np.where(is_zero, 1.0, child_values),
+                                  np.where((zero_counts == 1) & is_zero, non_zero_products, 0.0))
+        np.add.at(derivatives, child_indices, parent_derivatives * other_products)
+    return derivatives
+
+
+# Batched counterpart of compute_posterior_marginals, one vectorized upward and downward pass for the whole batch.
+# Every evidence has to have a probability above 0
+# Input: {circuit: {..compiled_circuit_format..}, evidence_list: ["B=0", {"B": "1"}]}
+# Output: [{"A": {"0": 0.0, "1": 1.0}, ..}, ..]
+def compute_posterior_marginals_batch(circuit, evidence_list):
+    indicator_matrix = get_indicator_matrix(circuit, evidence_list)
+    node_values = evaluate_nodes_batch(circuit, indicator_matrix)
+    derivatives = differentiate_nodes_batch(circuit, node_values)
+    probabilities = np.prod(node_values[list(circuit["roots"].values())], axis=0)
+    return [get_posterior_marginals(circuit, indicator_matrix[row], derivatives[:len(circuit["indicators"]), row],
+                                    probabilities[row]) for row in range(len(evidence_list))]
+
+
+# Creates the parents of every node, the reverse of child_offsets/children, used to find the ancestors of a node.
+# The index is computed once and kept in the circuit under "parent_index"
+# Input: {circuit: {..compiled_circuit_format..}}
+# Output: {parent_offsets: array([..]), parents: array([..])} parents of node i are parents[parent_offsets[i]:..[i + 1]]
+def get_parent_index(circuit):
+    if "parent_index" in circuit:
+        return circuit["parent_index"]
+
+    node_count = len(circuit["opcodes"])
+    children = circuit["children"]
+    node_parents = np.repeat(np.arange(node_count, dtype=np.int64), np.diff(circuit["child_offsets"]))
+    order = np.argsort(children, kind="stable")
+    parent_offsets = np.zeros(node_count + 1, dtype=np.int64)
+    parent_offsets[1:] = np.cumsum(np.bincount(children, minlength=node_count))
+
+    circuit["parent_index"] = {"parent_offsets": parent_offsets, "parents": node_parents[order]}
+    return circuit["parent_index"]
+
+
+# Creates a stateful evaluator that keeps the value of every node for the current evidence, so the next evidence
+# only recomputes the nodes whose value can change. The evaluator is a dict ::
+# {
+#     "circuit": {..compiled_circuit_format..},
+#     "indicator_values": [1, 0, ..], ## indicator values of the current evidence
+#     "node_values": [1, 0, .., 0.55], ## value of every node for the current evidence
+#     ..the arrays of the circuit as lists, used by update_incremental_evaluator..
+# }
+# Input: {circuit: {..compiled_circuit_format..}, evidence: "B=0,A=1" or {"B": "0", "A": "1"}}
+# Output: {..incremental_evaluator_format..}
+def create_incremental_evaluator(circuit, evidence=None):
+    parent_index = get_parent_index(circuit)
+    indicator_values = get_indicator_values(circuit, evidence)
+    return {
+        "circuit": circuit,
+        "indicator_values": indicator_values,
+        "node_values": evaluate_nodes(circuit, indicator_values),
+        "opcodes": circuit["opcodes"].tolist(),
+        "child_offsets": circuit["child_offsets"].tolist(),
+        "children": circuit["children"].tolist(),
+        "parent_offsets": parent_index["parent_offsets"].tolist(),
+        "parents": parent_index["parents"].tolist(),
+    }
+
+
+# Moves the evaluator to a new evidence and returns the value of every root, like evaluate_compiled_circuit.
+# Only the indicators that changed are written, and only their ancestors are recomputed in topological order (the
+# index order). A node whose value does not change stops the propagation, so the work is bounded by the cone of
+# the changed indicators instead of the whole circuit
+# Input: {evaluator: {..incremental_evaluator_format..}, evidence: "B=0,A=1" or {"B": "0", "A": "1"}}
+# Output: {"A": 0.55}
+def update_incremental_evaluator(evaluator, evidence=None):
+    circuit = evaluator["circuit"]
+    node_values = evaluator["node_values"]
+    opcodes = evaluator["opcodes"]
+    child_offsets = evaluator["child_offsets"]
+    children = evaluator["children"]
+    parent_offsets = evaluator["parent_offsets"]
+    parents = evaluator["parents"]
+
+    indicator_values = get_indicator_values(circuit, evidence)
+    dirty_nodes = []  # heap of the nodes to recompute, the smallest index is always computed first
+    queued = set()
+    for indicator_id, value in enumerate(indicator_values):
+        if value != evaluator["indicator_values"][indicator_id]:
+            node_values[indicator_id] = value
+            for parent in parents[parent_offsets[indicator_id]:parent_offsets[indicator_id + 1]]:
+                if parent not in queued:
+                    queued.add(parent)
+                    heapq.heappush(dirty_nodes, parent)
+    evaluator["indicator_values"] = indicator_values
+
+    while dirty_nodes:
+        i = heapq.heappop(dirty_nodes)
+        if opcodes[i] == OP_SUM:
+            result = 0.0
+            for child in children[child_offsets[i]:child_offsets[i + 1]]:
+                result += node_values[child]
+        else:
+            result = 1.0
+            for child in children[child_offsets[i]:child_offsets[i + 1]]:
+                result *= node_values[child]
+        if result == node_values[i]:
+            continue
+        node_values[i] = result
+        for parent in parents[parent_offsets[i]:parent_offsets[i + 1]]:
+            if parent not in queued:
+                queued.add(parent)
+                heapq.heappush(dirty_nodes, parent)
+
+    return {key: node_values[index] for key, index in circuit["roots"].items()}
+
+
+# Creates the lookup table (variable, CPT entry) -> parameter slot, it is created once and kept in the circuit
+# Input: {circuit: {..compiled_circuit_format..}}
+# Output: {("A", "0"): 0, ("B", "0,1"): 1, ..}
+def get_parameter_ids(circuit):
+    if "parameter_ids" not in circuit:
+        circuit["parameter_ids"] = {parameter: parameter_id
+                                    for parameter_id, parameter in enumerate(circuit["parameters"])}
+    return circuit["parameter_ids"]
+
+
+# returns the current parameter vector of the circuit, entry i is the value of circuit["parameters"][i]
+# Input: {circuit: {..compiled_circuit_format..}}
+# Output: array([0.9, 0.1, ..])
+def get_parameter_vector(circuit):
+    return np.array(circuit["values"][circuit["parameter_nodes"]], dtype=np.float64)
+
+
+# Returns a copy of the circuit that reads its parameters from the given vector, the structure of the circuit and
+# its cached tables are shared. The original circuit, which may be a read-only memory-mapped file, is not changed
+# Input: {circuit: {..compiled_circuit_format..}, parameter_vector: [0.9, 0.1, ..]}
+# Output: {..compiled_circuit_format..}
+def set_parameter_vector(circuit, parameter_vector):
+    parameter_vector = np.asarray(parameter_vector, dtype=np.float64)
+    if parameter_vector.shape != (len(circuit["parameters"]),):
+        raise ValueError("Expected " + str(len(circuit["parameters"])) + " parameters, got " +
+                         str(parameter_vector.shape))
+
+    values = np.array(circuit["values"], dtype=np.float64)
+    values[circuit["parameter_nodes"]] = parameter_vector
+    return dict(circuit, values=values)
+
+
+# Swaps in a new CPT set without recompiling, the CPTs use the format of structure_functions.create_universal_dict.
+# Entries that are not given keep their current value, unknown variables or entries raise an error. A parameter
+# folded into the circuit can only be given with its folded value, any other value needs a new compilation
+# Input: {circuit: {..compiled_circuit_format..}, universal_dict: {"A":{"0":0.8, "1":0.2}, "B":{"0,0":0.9, ..}}}
+# Output: {..compiled_circuit_format..}
+def set_parameters(circuit, universal_dict):
+    parameter_ids = get_parameter_ids(circuit)
+    parameter_vector = get_parameter_vector(circuit)
+    for variable, entries in universal_dict.items():
+        for entry, value in entries.items():
+            folded_value = circuit.get("folded_parameters", {}).get((variable, entry))
+            if folded_value is not None and (variable, entry) not in parameter_ids:
+                if value != folded_value:
+                    raise ValueError("Parameter '" + entry + "' of variable '" + variable + "' was folded into the " +
+                                     "circuit as " + str(folded_value) + ", recompile the circuit to change it")
+                continue
+            if (variable, entry) not in parameter_ids:
+                raise ValueError("Unknown parameter '" + entry + "' of variable '" + variable + "'")
+            parameter_vector[parameter_ids[(variable, entry)]] = value
+    return set_parameter_vector(circuit, parameter_vector)
+
+
+# Computes the gradient of the probability of the evidence with respect to every parameter with one upward and one
+# downward pass. Dividing the gradient by the probability gives the gradient of the log-likelihood
+# Input: {circuit: {..compiled_circuit_format..}, evidence: "B=0,A=1" or {"B": "0", "A": "1"}}
+# Output: {probability: 0.55, gradients: array([0.3, 0.25, ..])} entry i belongs to circuit["parameters"][i]
+def compute_parameter_gradients(circuit, evidence=None):
+    node_values = evaluate_nodes(circuit, get_indicator_values(circuit, evidence))
+    derivatives = np.array(differentiate_nodes(circuit, node_values), dtype=np.float64)
+
+    probability = 1.0
+    for index in circuit["roots"].values():
+        probability *= node_values[index]
+    return {"probability": probability, "gradients": derivatives[circuit["parameter_nodes"]]}
+
+
+# Traceback of a max-product evaluation: starting at the roots, every product node follows all its children and every
+# sum node follows its first child with the maximum value. The indicators reached form the maximizing assignment,
+# the indicator of every variable is reached exactly once since every CPT appears once below each product
+# Input: {circuit: {..compiled_circuit_format..}, node_values: [1, 0, .., 0.3] from evaluate_nodes with maximize}
+# Output: {"A": "1", "B": "0"}
+def trace_maximizing_assignment(circuit, node_values):
+    opcodes = circuit["opcodes"]
+    child_offsets = circuit["child_offsets"]
+    children = circuit["children"]
+    indicator_count = len(circuit["indicators"])
+
+    assignment = {}
+    visited = set()
+    stack = list(circuit["roots"].values())
+    while stack:
+        i = stack.pop()
+        if i in visited:
+            continue
+        visited.add(i)
+        if i < indicator_count:
+            variable, variable_value = circuit["indicators"][i]
+            assignment[variable] = variable_value
+            continue
+
+        node_children = children[child_offsets[i]:child_offsets[i + 1]].tolist()
+        if opcodes[i] == OP_SUM:
+            stack.append(next(child for child in node_children if node_values[child] == node_values[i]))
+        elif opcodes[i] == OP_PRODUCT:
+            stack.extend(node_children)
+    return assignment
+
+
+# Returns the most probable explanation from the node values of a max-product evaluation: the product of the roots
+# and the maximizing assignment. Evidence with probability 0 has no explanation and raises a ValueError
+# Input: {circuit: {..compiled_circuit_format..}, node_values: [1, 0, .., 0.3] from evaluate_nodes with maximize}
+# Output: {probability: 0.3, assignment: {"A": "1", "B": "0"}}
+def get_maximizing_explanation(circuit, node_values):
+    probability = 1.0
+    for index in circuit["roots"].values():
+        probability *= node_values[index]
+    if probability == 0:
+        raise ValueError("The most probable explanation is undefined for evidence with probability 0")
+    return {"probability": probability, "assignment": trace_maximizing_assignment(circuit, node_values)}
+
+
+# Computes the most probable explanation (MPE): the assignment of every variable, consistent with the evidence, with
+# the highest joint probability. One max-product evaluation is followed by the traceback
+# Input: {circuit: {..compiled_circuit_format..}, evidence: "B=0" or {"B": "0"}}
+# Output: {probability: 0.3, assignment: {"A": "1", "B": "0"}}
+def compute_most_probable_explanation(circuit, evidence=None):
+    node_values = evaluate_nodes(circuit, get_indicator_values(circuit, evidence), maximize=True)
+    return get_maximizing_explanation(circuit, node_values)
+
+
+# Batched counterpart of compute_most_probable_explanation, one vectorized max-product pass for the whole batch
+# followed by one traceback per evidence
+# Input: {circuit: {..compiled_circuit_format..}, evidence_list: ["B=0", {"B": "1"}]}
+# Output: [{probability: 0.3, assignment: {"A": "1", "B": "0"}}, ..]
+def compute_most_probable_explanation_batch(circuit, evidence_list):
+    node_values = evaluate_nodes_batch(circuit, get_indicator_matrix(circuit, evidence_list), maximize=True)
+    return [get_maximizing_explanation(circuit, node_values[:, column].tolist())
+            for column in range(len(evidence_list))]
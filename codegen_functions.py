@@ -0,0 +1,174 @@
+# Description:
+# This file generates a specialized evaluator for one compiled circuit (see circuit_functions): a Python module with a
+# single function, in which every sum/product node is one assignment to a local variable in topological order. The
+# interpreter of circuit_functions.evaluate_nodes pays for the opcode dispatch and the child lists of every node on
+# every query, the generated function only does the arithmetic, which makes it the fastest evaluator for a single
+# query on small and medium circuits.
+# The module is written next to the circuit file and byte-compiled once by Python's import system (in __pycache__), a
+# module written for another circuit structure is generated again. Without a path it is compiled in memory.
+# The indicators and the parameter vector are arguments of the function, so a circuit re-parameterized with
+# circuit_functions.set_parameter_vector uses the same generated code. Constants created by the compilation or the
+# simplification are written into the code.
+# Format of a generated module ::
+#     # key: 3f2a.. ## hash of the circuit structure, see get_evaluator_key
+#     roots = ["A"] ## buckets of the values returned by evaluate
+#     def evaluate(indicators, parameters):
+#         v0, v1, v2, v3 = indicators
+#         v4, v5 = parameters ## parameter nodes, in the order of the parameter slots
+#         v6 = v0 * v4
+#         v7 = v2 * v5 * 0.5
+#         v8 = v6 + v7 ## or max(v6, v7) for max-product evaluation
+#         return (v8,)
+
+import hashlib
+import importlib.util
+import os
+import py_compile
+import tempfile
+
+import numpy as np
+
+import circuit_functions as cf
+
+GENERATOR_VERSION = 1  # has to be increased whenever the generated code changes, the generated modules are replaced
+MAX_GENERATED_NODES = 100000  # compiling the function of a bigger circuit takes longer than many interpreted queries
+MAX_TERMS_PER_LINE = 32  # wider nodes are accumulated over several lines, CPython compiles long expressions recursively
+
+
+# Calculates the key of the generated code of a circuit from its structure, its constants and the evaluation mode.
+# The values of the parameter slots are arguments of the generated function and are not part of the key
+# Input: {circuit: {..compiled_circuit_format..}, maximize: False}
+# Output: "3f2a..."
+def get_evaluator_key(circuit, maximize=False):
+    constants = np.array(circuit["values"], dtype=np.float64)
+    constants[circuit["parameter_nodes"]] = 0.0
+    digest = hashlib.sha256()
+    for array in (circuit["opcodes"], circuit["child_offsets"], circuit["children"]):
+        digest.update(np.ascontiguousarray(array, dtype=np.int64).tobytes())
+    digest.update(constants.tobytes())
+    digest.update(("|" + ",".join(circuit["roots"]) + "|" + str(list(circuit["roots"].values())) + "|" +
+                   str(maximize) + "|" + str(GENERATOR_VERSION)).encode())
+    return digest.hexdigest()
+
+
+# Writes the expression of a sum/product node as one or more lines of the generated function
+# Input: {name: "v8", opcode: OP_SUM, terms: ["v6", "v7"], maximize: False}
+# Output: ["    v8 = v6 + v7"]
+def get_node_lines(name, opcode, terms, maximize):
+    if not terms:
+        return ["    " + name + " = " + ("0.0" if opcode == cf.OP_SUM else "1.0")]
+    if opcode == cf.OP_SUM and maximize:
+        return ["    " + name + " = " + (terms[0] if len(terms) == 1 else "max(" + ", ".join(terms) + ")")]
+
+    # every line reads the value of the previous one first, so the terms are combined in the order of the children
+    operator = " + " if opcode == cf.OP_SUM else " * "
+    lines = ["    " + name + " = " + operator.join(terms[:MAX_TERMS_PER_LINE])]
+    for start in range(MAX_TERMS_PER_LINE, len(terms), MAX_TERMS_PER_LINE):
+        lines.append("    " + name + " = " + name + operator + operator.join(terms[start:start + MAX_TERMS_PER_LINE]))
+    return lines
+
+
+# Generates the source of the evaluator module of a circuit, in the format described at the top of this file.
+# The terms of every node are read in the order of its children, like circuit_functions.evaluate_nodes, so both
+# evaluators return exactly the same values
+# Input: {circuit: {..compiled_circuit_format..}, maximize: False}
+# Output: "# key: 3f2a..\nroots = [..]\ndef evaluate(indicators, parameters):\n .."
+def generate_evaluator_source(circuit, maximize=False):
+    opcodes = circuit["opcodes"].tolist()
+    child_offsets = circuit["child_offsets"].tolist()
+    children = circuit["children"].tolist()
+    values = circuit["values"].tolist()
+    if len(opcodes) > MAX_GENERATED_NODES:
+        raise ValueError("The circuit has " + str(len(opcodes)) + " nodes, code is only generated for circuits of at "
+                         "most " + str(MAX_GENERATED_NODES) + " nodes")
+
+    indicator_count = len(circuit["indicators"])
+    parameter_nodes = set(circuit["parameter_nodes"].tolist())
+    # constant nodes are written into the expressions of their parents instead of getting a variable
+    terms = ["v" + str(i) if i < indicator_count or opcodes[i] != cf.OP_PARAMETER or i in parameter_nodes
+             else repr(float(values[i])) for i in range(len(opcodes))]
+
+    lines = ["# key: " + get_evaluator_key(circuit, maximize),
+             "# generated by codegen_functions from a compiled circuit, do not edit",
+             "roots = " + repr(list(circuit["roots"])),
+             "",
+             "",
+             "def evaluate(indicators, parameters):"]
+    if indicator_count:
+        lines.append("    " + "".join(terms[i] + ", " for i in range(indicator_count)) + "= indicators")
+    if len(circuit["parameter_nodes"]):
+        lines.append("    " + "".join("v" + str(node) + ", " for node in circuit["parameter_nodes"].tolist()) +
+                     "= parameters")
+    for i in range(indicator_count, len(opcodes)):
+        if opcodes[i] != cf.OP_PARAMETER:
+            node_terms = [terms[child] for child in children[child_offsets[i]:child_offsets[i + 1]]]
+            lines.extend(get_node_lines(terms[i], opcodes[i], node_terms, maximize))
+    lines.append("    return (" + "".join(terms[root] + ", " for root in circuit["roots"].values()) + ")")
+    return "\n".join(lines) + "\n"
+
+
+# returns the key written on the first line of a generated module, None when the file does not exist
+def read_module_key(module_path):
+    try:
+        with open(module_path) as module_file:
+            first_line = module_file.readline()
+    except OSError:
+        return None
+    return first_line[len("# key: "):].strip() if first_line.startswith("# key: ") else None
+
+
+# Writes the source to the module path, through a temporary file renamed into place so processes sharing the
+# directory never import a partial module
+def write_module(source, module_path):
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(module_path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "w") as module_file:
+            module_file.write(source)
+        os.replace(temporary_path, module_path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+# Returns the generated evaluate function of a circuit. With a circuit path the module is kept next to the circuit file
+# ("asia.ac" -> "asia_evaluator.py", "asia_max_evaluator.py" for max-product) and only generated again when its key
+# does not match the circuit. The function is kept in the circuit under "generated_evaluators"
+# Input: {circuit: {..compiled_circuit_format..}, maximize: False, circuit_path: "arithmetic-circuits/asia/asia.ac"}
+# Output: evaluate(indicators, parameters) -> (value of every root, in the order of circuit["roots"])
+def get_generated_evaluator(circuit, maximize=False, circuit_path=None):
+    generated_evaluators = circuit.setdefault("generated_evaluators", {})
+    if maximize in generated_evaluators:
+        return generated_evaluators[maximize]
+
+    if circuit_path is None:
+        namespace = {}
+        exec(compile(generate_evaluator_source(circuit, maximize), "<generated evaluator>", "exec"), namespace)
+        generated_evaluators[maximize] = namespace["evaluate"]
+        return namespace["evaluate"]
+
+    key = get_evaluator_key(circuit, maximize)
+    module_path = os.path.splitext(circuit_path)[0] + ("_max" if maximize else "") + "_evaluator.py"
+    bytecode_path = importlib.util.cache_from_source(module_path)
+    if read_module_key(module_path) != key:
+        write_module(generate_evaluator_source(circuit, maximize), module_path)
+        py_compile.compile(module_path, bytecode_path, doraise=True)
+    elif not os.path.exists(bytecode_path) or os.path.getmtime(bytecode_path) < os.path.getmtime(module_path):
+        # the bytecode is written here since the import system does not write it with PYTHONDONTWRITEBYTECODE
+        py_compile.compile(module_path, bytecode_path, doraise=True)
+    # the import system reuses the bytecode in __pycache__ while the module is unchanged
+    spec = importlib.util.spec_from_file_location("generated_evaluator_" + key[:16], module_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    generated_evaluators[maximize] = module.evaluate
+    return module.evaluate
+
+
+# Evaluates the circuit for the given evidence with its generated evaluator, it returns the same values as
+# circuit_functions.evaluate_compiled_circuit
+# Input: {circuit: {..compiled_circuit_format..}, evidence: "B=0,A=1" or {"B": "0", "A": "1"}, maximize: False,
+#         circuit_path: "arithmetic-circuits/asia/asia.ac"}
+# Output: {"A": 0.55}
+def evaluate_generated_circuit(circuit, evidence=None, maximize=False, circuit_path=None):
+    evaluate = get_generated_evaluator(circuit, maximize, circuit_path)
+    root_values = evaluate(cf.get_indicator_values(circuit, evidence), cf.get_parameter_vector(circuit).tolist())
+    return dict(zip(circuit["roots"], root_values))
@@ -0,0 +1,207 @@
+# Description:
+# This file contains the compilation pipeline of a BN into an arithmetic circuit: the BIF file is parsed, the variables
+# are eliminated into a sum product network and the network is lowered into the flat circuit of circuit_functions.
+# Nothing is written to disk, so it is shared by main, batch_functions and benchmark_functions.
+# The size, memory and time of a compilation are estimated from the elimination order before any node is created, so
+# a compilation over its budget fails at once, or falls back to another elimination order, instead of running until
+# it exhausts the memory of the process.
+# Format of a budget, every limit is optional ::
+# {
+#     "max_nodes": 1000000, ## nodes of the circuit before its simplification
+#     "max_memory": 1073741824, ## bytes
+#     "max_time": 60, ## seconds, the time spent is also checked after every elimination step
+#     "fallback_strategies": ["min_fill", ..], ## orders tried in turn when the estimate of the requested one exceeds
+#                                              ## the budget, default_fallback_strategies by default, [] to fail fast
+# }
+# Format of an estimate ::
+# {
+#     "induced_width": 3, "max_factor_size": 16, ## largest factor of the elimination, see ff.estimate_circuit_size
+#     "nodes": 175, "edges": 262, ## size of the circuit before its simplification, equal nodes are not shared
+#     "memory": 168350, ## bytes, ESTIMATED_NODE_BYTES per node and ESTIMATED_EDGE_BYTES per edge
+#     "time": 0.005, ## seconds, ESTIMATED_NODE_SECONDS per node
+# }
+
+import time
+
+import structure_functions as sf
+import bn_functions as bnf
+import circuit_functions as cf
+import factor_functions as ff
+import simplify_functions as simp
+import trace_functions as trace
+
+# measured over the bundled networks, the peak resident memory of a compilation is within 15% of the estimate
+ESTIMATED_NODE_BYTES = 700
+ESTIMATED_EDGE_BYTES = 175
+ESTIMATED_NODE_SECONDS = 0.00003
+MAX_ESTIMATED_SIZE = 2 ** 62  # far above any circuit that fits in memory
+
+default_fallback_strategies = ["min_fill", "weighted_min_fill", "min_weight", "min_neighbors"]
+
+
+# raised when the estimate of every allowed elimination order exceeds the budget, or when the compilation exceeds it
+class BudgetExceededError(Exception):
+    pass
+
+
+# Estimates the size, memory and time of the compilation with the given elimination order, without creating any node.
+# Sizes above MAX_ESTIMATED_SIZE are saturated to it
+# Input: {bn_graph_nodes: {"A":{"states":["0", "1"], "parents":[], ..}}, elimination_order: ["B", "A"]}
+# Output: {..estimate_format..}
+def estimate_compilation(bn_graph_nodes, elimination_order):
+    estimate = ff.estimate_circuit_size(bn_graph_nodes, elimination_order)
+    # the sizes of wide networks are saturated, they stay over any budget and fit in a float and in JSON
+    for key in ("max_factor_size", "nodes", "edges"):
+        estimate[key] = min(estimate[key], MAX_ESTIMATED_SIZE)
+    estimate["memory"] = estimate["nodes"] * ESTIMATED_NODE_BYTES + estimate["edges"] * ESTIMATED_EDGE_BYTES
+    estimate["time"] = estimate["nodes"] * ESTIMATED_NODE_SECONDS
+    return estimate
+
+
+# lists the limits of the budget exceeded by the estimate
+# Input: {estimate: {..estimate_format..}, budget: {..budget_format..}}
+# Output: ["nodes 1808102 > max_nodes 1000000", ..]
+def get_budget_violations(estimate, budget):
+    violations = []
+    for limit, key in (("max_nodes", "nodes"), ("max_memory", "memory"), ("max_time", "time")):
+        if budget.get(limit) is not None and estimate[key] > budget[limit]:
+            violations.append(key + " " + str(estimate[key]) + " > " + limit + " " + str(budget[limit]))
+    return violations
+
+
+# Finds the elimination order of the requested strategy and checks its estimate against the budget. An order over the
+# budget is replaced by the first fallback strategy whose order fits, and an error lists the estimates when none fits
+# Input: {bn_graph_nodes: {"A":{"states":["0", "1"], "parents":[], ..}}, elimination_strategy: "topological",
+#         budget: {..budget_format..}}
+# Output: ("min_fill", ["B", "A"], {..estimate_format..})
+def find_budgeted_elimination_order(bn_graph_nodes, elimination_strategy, budget=None):
+    elimination_order = bnf.find_elimination_order(bn_graph_nodes, elimination_strategy)
+    estimate = estimate_compilation(bn_graph_nodes, elimination_order)
+    if budget is None:
+        return elimination_strategy, elimination_order, estimate
+
+    rejected = []
+    fallback_strategies = budget.get("fallback_strategies", default_fallback_strategies)
+    for strategy in [elimination_strategy] + [item for item in fallback_strategies if item != elimination_strategy]:
+        if strategy != elimination_strategy:
+            elimination_order = bnf.find_elimination_order(bn_graph_nodes, strategy)
+            estimate = estimate_compilation(bn_graph_nodes, elimination_order)
+        violations = get_budget_violations(estimate, budget)
+        if not violations:
+            return strategy, elimination_order, estimate
+        rejected.append(strategy + " (" + ", ".join(violations) + ")")
+    raise BudgetExceededError("No elimination order fits the budget :: " + "; ".join(rejected))
+
+
+# checks the nodes created and the time spent so far against the budget, the estimate is only an approximation
+def check_budget(budget, nodes_stats, start_time):
+    if budget.get("max_nodes") is not None and nodes_stats["total"] > budget["max_nodes"]:
+        raise BudgetExceededError("Created " + str(nodes_stats["total"]) + " nodes, more than max_nodes " +
+                                  str(budget["max_nodes"]))
+    if budget.get("max_time") is not None and time.perf_counter() - start_time > budget["max_time"]:
+        raise BudgetExceededError("Compilation took more than max_time " + str(budget["max_time"]) + " seconds")
+
+
+# Function uses different function calls from other files to create the final sum product network
+# Every CPT becomes a factor of indicator * parameter products, then the variables are eliminated in the given order.
+# Eliminating the last variable of a connected part of the BN leaves a single root node, stored under that variable.
+# Every elimination step is recorded as an event of the tracer, see trace_functions. With a budget, the nodes created
+# and the time spent are checked after every step and BudgetExceededError is raised as soon as a limit is exceeded
+# Input: {elimination_order: ["B","A"], universal_dict: {"A":{"0":0.9, "1":0.1}},
+#         bn_graph_nodes: {"A":{"states":["0", "1"], "parents":[], "values":[[0.9, 0.1]}}, session: {..session..},
+#         tracer: {..tracer_format..}, budget: {..budget_format..}}
+# Output: {"A":{..node_format..}} where A is the last eliminated node of the BN
+def create_sum_product_network(elimination_order, universal_dict, bn_graph_nodes, session, tracer=None, budget=None):
+    nodes_stats = session["nodes_stats"]
+    budget_start_time = time.perf_counter()
+    start_time = trace.start_phase(tracer)
+    network = ff.create_network(bn_graph_nodes)
+    factors = [ff.create_cpt_factor(session, network, node, bn_graph_nodes[node]["parents"], universal_dict)
+               for node in bn_graph_nodes]
+    trace.end_phase(tracer, "create_cpt_factors", start_time, {"factors": len(factors),
+                                                               "nodes_created": nodes_stats["total"]})
+
+    buckets = {}
+    for step, node in enumerate(elimination_order):
+        start_time = trace.start_phase(tracer)
+        factor_count, node_count = len(factors), nodes_stats["total"]
+        factors, factor = ff.eliminate_variable(session, network, factors, network["ids"][node])
+        if tracer is not None:
+            trace.end_phase(tracer, "eliminate_variable", start_time, {
+                "step": step,
+                "variable": node,
+                "bucket_factors": factor_count - len(factors) + 1,
+                "joint_size": len(factor["nodes"]) * len(network["states"][network["ids"][node]]),
+                "factor_variables": len(factor["variables"]),
+                "factor_size": len(factor["nodes"]),
+                "nodes_created": nodes_stats["total"] - node_count,
+            })
+        if len(factor["variables"]) == 0:
+            buckets[node] = factor["nodes"][0]
+            factors.remove(factor)
+        if budget is not None:
+            check_budget(budget, nodes_stats, budget_start_time)
+
+    # print("BUCKETS ::", buckets)
+    return buckets
+
+
+# Function parses the BIF file and compiles it into the flat arithmetic circuit, nothing is written to disk.
+# The compiled circuit is simplified with the given passes of simplify_functions, the buckets are not. The report
+# gives the size of the circuit before and after every pass, see simplify_functions.simplify_circuit.
+# Every phase is recorded as an event of the tracer, see trace_functions. The BN is checked with the given backend of
+# bn_functions.check_bn_model, "pgmpy" imports pgmpy and runs its own check of the model.
+# With a budget, the compilation is estimated before any node is created and BudgetExceededError is raised when no
+# allowed elimination order fits, see find_budgeted_elimination_order. The strategy used and its estimate are recorded
+# in the find_elimination_order event
+# Input: {absolute_file_path: "....Absolute_path_to_bif_file....", elimination_strategy: "topological",
+#         simplification_passes: [simp.fold_constants, ..], tracer: {..tracer_format..}, check_backend: "native",
+#         budget: {..budget_format..}}
+# Output: ({..compiled_circuit_format..}, {"A":{..node_format..}}, {..session..},
+#          [{pass: "collapse_unary_nodes", before: {nodes: 145, edges: 160}, after: {nodes: 120, edges: 131}}, ..])
+def compile_bif_file(absolute_file_path, elimination_strategy="topological", simplification_passes=None,
+                     tracer=None, check_backend="native", budget=None):
+    start_time = trace.start_phase(tracer)
+    bn_network = bnf.read_bn_file(absolute_file_path)  # reads BIF file
+    trace.end_phase(tracer, "read_bn_file", start_time)
+
+    start_time = trace.start_phase(tracer)
+    bnf.check_bn_model(bn_network, check_backend)  # verify the BN is correct
+    trace.end_phase(tracer, "check_bn_model", start_time, {"backend": check_backend})
+
+    start_time = trace.start_phase(tracer)
+    bn_graph_nodes = bnf.get_bn_graph_nodes(bn_network)  # converts data into usable format
+    universal_dict = sf.create_universal_dict(bn_graph_nodes)  # create a universal dict: {"A":{"0":0.9, "1":0.1}}
+    trace.end_phase(tracer, "get_bn_graph_nodes", start_time, {"variables": len(bn_graph_nodes)})
+
+    start_time = trace.start_phase(tracer)
+    # calculate elimination order, replaced by a fallback strategy when its estimate exceeds the budget
+    elimination_strategy, elimination_order, estimate = find_budgeted_elimination_order(bn_graph_nodes,
+                                                                                        elimination_strategy, budget)
+    trace.end_phase(tracer, "find_elimination_order", start_time, {"strategy": elimination_strategy,
+                                                                   "estimate": estimate})
+    print("Elimination Order (" + elimination_strategy + ") :: ", elimination_order)
+
+    session = sf.create_session()  # holds the nodes and statistics of this circuit only
+    buckets = create_sum_product_network(elimination_order, universal_dict, bn_graph_nodes, session, tracer,
+                                         budget)
+
+    start_time = trace.start_phase(tracer)
+    circuit = cf.compile_arithmetic_circuit(buckets)  # flat program used for every evaluation of the AC
+    circuit["families"] = {node: [node] + bn_graph_nodes[node]["parents"] for node in bn_graph_nodes}
+    trace.end_phase(tracer, "compile_arithmetic_circuit", start_time, {"nodes": len(circuit["opcodes"]),
+                                                                       "edges": len(circuit["children"])})
+
+    start_time = trace.start_phase(tracer)
+    circuit, simplification_report = simp.simplify_circuit(circuit, simplification_passes)
+    trace.end_phase(tracer, "simplify_circuit", start_time, {"nodes": len(circuit["opcodes"]),
+                                                             "edges": len(circuit["children"])})
+    return circuit, buckets, session, simplification_report
+
+
+# reads only the CPTs of a BIF file, used to re-parameterize a compiled circuit with circuit_functions.set_parameters
+# Input: {absolute_file_path: "....Absolute_path_to_bif_file...."}
+# Output: {"A":{"0":0.9, "1":0.1}}
+def read_parameters(absolute_file_path):
+    bn_graph_nodes = bnf.get_bn_graph_nodes(bnf.read_bn_file(absolute_file_path))
+    return sf.create_universal_dict(bn_graph_nodes)
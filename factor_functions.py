@@ -0,0 +1,170 @@
+# Description:
+# This file contains the factors used for bucket elimination while the arithmetic circuit is being created.
+# Variables are identified by integer ids and an assignment of a factor is a single mixed-radix index (the last
+# variable of the factor changes fastest), so joins and marginalization are computed with strides instead of
+# splitting and joining comma separated keys.
+# Format of the network used by this file ::
+# {
+#     "names": ["A", "B"], ## name of every variable, the position is the variable id
+#     "states": [["0", "1"], ["0", "1"]], ## states of every variable
+#     "ids": {"A": 0, "B": 1}, ## variable name -> variable id
+# }
+# Format of a single factor ::
+# {
+#     "variables": [1, 0], ## ids of the variables in the scope of the factor
+#     "cardinalities": [2, 2], ## number of states of every variable in the scope
+#     "nodes": [{..node_format..}, ..], ## one AC node for every assignment, indexed by the mixed-radix index
+# }
+
+import itertools
+import math
+
+import numpy as np
+
+import structure_functions as sf
+
+
+# creates the network representation described above from the common bn_graph_nodes dict
+# Input: {bn_graph_nodes: {"A":{"states":["0", "1"], "parents":[], "values":[[0.9, 0.1]}}}
+# Output: {names: ["A"], states: [["0", "1"]], ids: {"A": 0}}
+def create_network(bn_graph_nodes):
+    names = list(bn_graph_nodes)
+    return {
+        "names": names,
+        "states": [[str(state) for state in bn_graph_nodes[name]["states"]] for name in names],
+        "ids": {name: variable_id for variable_id, name in enumerate(names)},
+    }
+
+
+# calculates the stride of every variable for the mixed-radix index, the last variable has stride 1
+# Input: {cardinalities: [2, 3, 2]}
+# Output: [6, 2, 1]
+def get_strides(cardinalities):
+    strides = [1] * len(cardinalities)
+    for i in range(len(cardinalities) - 2, -1, -1):
+        strides[i] = strides[i + 1] * cardinalities[i + 1]
+    return strides
+
+
+# For every assignment of the given scope, finds the index of the matching assignment of the factor.
+# The scope must contain every variable of the factor, variables of the scope missing in the factor are ignored
+# Input: {variables: [0, 2, 1], cardinalities: [2, 2, 2], factor: {variables: [1, 0], cardinalities: [2, 2], ..}}
+# Output: array([0, 0, 2, 2, 1, 1, 3, 3])
+def get_assignment_indices(variables, cardinalities, factor):
+    factor_strides = dict(zip(factor["variables"], get_strides(factor["cardinalities"])))
+    assignments = np.arange(int(np.prod(cardinalities, dtype=np.int64)), dtype=np.int64)
+
+    indices = np.zeros(len(assignments), dtype=np.int64)
+    for variable, cardinality, stride in zip(variables, cardinalities, get_strides(cardinalities)):
+        if variable in factor_strides:
+            indices += (assignments // stride) % cardinality * factor_strides[variable]
+    return indices
+
+
+# returns the labels (comma separated variable names and states) of every assignment of a scope, used for the nodes
+# Input: {network: {..network_format..}, variables: [0, 1]}
+# Output: ("A,B", ["0,0", "0,1", "1,0", "1,1"])
+def get_assignment_labels(network, variables):
+    node = ",".join(network["names"][variable] for variable in variables)
+    variable_values = [",".join(states) for states in
+                       itertools.product(*[network["states"][variable] for variable in variables])]
+    return node, variable_values
+
+
+# Creates the factor of a CPT, where every entry is the product of the indicator of the variable and the parameter.
+# The entries of universal_dict are ordered by (variable, *parents) with the last parent changing fastest
+# Input: {session: {..session..}, network: {..network_format..}, name: "B", parents: ["A"],
+#         universal_dict: {"B":{"0,0":0.9, ..}}}
+# Output: {variables: [1, 0], cardinalities: [2, 2], nodes: [{..node_format..}, ..]}
+def create_cpt_factor(session, network, name, parents, universal_dict):
+    variables = [network["ids"][name]] + [network["ids"][parent] for parent in parents]
+    cardinalities = [len(network["states"][variable]) for variable in variables]
+    states = network["states"][variables[0]]
+    entries_per_state = len(universal_dict[name]) // len(states)
+
+    nodes = []
+    for i, (key, value) in enumerate(universal_dict[name].items()):
+        indicator_node = sf.create_node(session, "indicator", 1, [], name, states[i // entries_per_state])
+        value_node = sf.create_node(session, "value", value, [], name, key)
+        nodes.append(sf.create_node(session, "product", None, [indicator_node, value_node], name, key))
+    return {"variables": variables, "cardinalities": cardinalities, "nodes": nodes}
+
+
+# Eliminates a variable from the factors: the factors containing the variable are joined with one n-ary product node
+# per assignment of their joint scope, and the variable is summed out with one sum node per remaining assignment.
+# The variable is placed last in the joint scope, so its states are contiguous in the product nodes.
+# The work done is proportional to the size of the joint factor
+# Input: {session: {..session..}, network: {..network_format..}, factors: [{..factor_format..}, ..], variable: 0}
+# Output: ([{..factor_format..}, ..] without the variable, {..factor_format..} created by the elimination)
+def eliminate_variable(session, network, factors, variable):
+    bucket = [factor for factor in factors if variable in factor["variables"]]
+    remaining_factors = [factor for factor in factors if variable not in factor["variables"]]
+
+    variables = []
+    for factor in bucket:
+        variables.extend(item for item in factor["variables"] if item != variable and item not in variables)
+    cardinalities = [len(network["states"][item]) for item in variables]
+    variable_cardinality = len(network["states"][variable])
+
+    # join: one product node for every assignment of the scope followed by the eliminated variable
+    joint_variables = variables + [variable]
+    joint_cardinalities = cardinalities + [variable_cardinality]
+    if len(bucket) == 1:
+        product_nodes = [bucket[0]["nodes"][i] for i in
+                         get_assignment_indices(joint_variables, joint_cardinalities, bucket[0])]
+    else:
+        node, variable_values = get_assignment_labels(network, joint_variables)
+        factor_indices = [get_assignment_indices(joint_variables, joint_cardinalities, factor).tolist()
+                          for factor in bucket]
+        product_nodes = []
+        for assignment, variable_value in enumerate(variable_values):
+            references = [factor["nodes"][indices[assignment]] for factor, indices in zip(bucket, factor_indices)]
+            product_nodes.append(sf.create_node(session, "product", None, references, node, variable_value))
+
+    # marginalize: one sum node over the states of the variable for every assignment of the remaining scope
+    node, variable_values = get_assignment_labels(network, variables)
+    if len(variables) == 0:
+        node = network["names"][variable]
+    sum_nodes = []
+    for assignment, variable_value in enumerate(variable_values):
+        references = product_nodes[assignment * variable_cardinality:(assignment + 1) * variable_cardinality]
+        sum_nodes.append(sf.create_node(session, "sum", None, references, node, variable_value))
+
+    factor = {"variables": variables, "cardinalities": cardinalities, "nodes": sum_nodes}
+    return remaining_factors + [factor], factor
+
+
+# Estimates the circuit created by eliminating the variables in the given order, without creating any node.
+# The elimination is simulated on the scopes of the factors only, and the counts are upper bounds since equal nodes
+# are shared by structure_functions.create_node. The sizes are Python ints, so wide networks do not overflow them
+# Input: {bn_graph_nodes: {"A":{"states":["0", "1"], "parents":[], ..}}, elimination_order: ["B", "A"]}
+# Output: {induced_width: 1, max_factor_size: 4, nodes: 20, edges: 24}
+def estimate_circuit_size(bn_graph_nodes, elimination_order):
+    cardinalities = {name: len(value["states"]) for name, value in bn_graph_nodes.items()}
+    estimate = {"induced_width": 0, "max_factor_size": 0, "nodes": 0, "edges": 0}
+
+    scopes = []
+    for name, value in bn_graph_nodes.items():
+        scope = [name] + list(value["parents"])
+        cpt_size = math.prod(cardinalities[item] for item in scope)
+        estimate["nodes"] += cardinalities[name] + 2 * cpt_size  # indicators, parameter and product per entry
+        estimate["edges"] += 2 * cpt_size
+        estimate["max_factor_size"] = max(estimate["max_factor_size"], cpt_size)
+        scopes.append(set(scope))
+
+    for name in elimination_order:
+        bucket = [scope for scope in scopes if name in scope]
+        scopes = [scope for scope in scopes if name not in scope]
+        joint_scope = set().union(*bucket)
+        joint_size = math.prod(cardinalities[item] for item in joint_scope)
+
+        if len(bucket) > 1:
+            estimate["nodes"] += joint_size
+            estimate["edges"] += joint_size * len(bucket)
+        estimate["nodes"] += joint_size // cardinalities[name]
+        estimate["edges"] += joint_size
+        estimate["induced_width"] = max(estimate["induced_width"], len(joint_scope) - 1)
+        estimate["max_factor_size"] = max(estimate["max_factor_size"], joint_size)
+        if len(joint_scope) > 1:
+            scopes.append(joint_scope - {name})
+    return estimate
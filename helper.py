@@ -14,16 +14,17 @@ def convert_list_items_to_string(input_list):
     return result
 
 
-# converts the keys of the dict to string
-def convert_keys_to_string(dictionary):
-    for item in list(dictionary):
-        if type(item) is tuple:
-            dictionary[",".join(map(str, item))] = dictionary.pop(item)
-    return dictionary
-
-
-# converts the keys of the dict to tuple
-def convert_keys_to_tuple(dictionary):
-    for item in list(dictionary):
-        dictionary[tuple(item.split(","))] = dictionary.pop(item)
-    return dictionary
+# parses an evidence string into a dict, the string is parsed once instead of at every indicator node.
+# Only the first "=" separates the variable from the value, so values like ">=7.5" are kept as they are
+# Input: {evidence: "B=0, A=1"}
+# Output: {"B": "0", "A": "1"}
+def parse_evidence_string(evidence):
+    observed = {}
+    if not evidence:
+        return observed
+    for item in evidence.split(","):
+        variable, separator, variable_value = item.partition("=")
+        if not separator or not variable.strip() or not variable_value.strip():
+            raise ValueError("Invalid evidence item '" + item + "', expected (Variable-Name)=(Variable-Value)")
+        observed[variable.strip()] = variable_value.strip()
+    return observed
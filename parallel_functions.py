@@ -0,0 +1,225 @@
+# Description:
+# This file evaluates large compiled circuits (see circuit_functions) on several cores. The circuit is split into its
+# topological levels: the nodes of a level only read nodes of lower levels, so they can all be evaluated at the same
+# time. The nodes of every level are partitioned into chunks of about the same number of children, and the chunks of a
+# level are evaluated in parallel, the levels one after the other.
+# A chunk is evaluated like a group of circuit_functions.evaluate_nodes_batch: one gather of the child rows and one
+# ufunc.reduceat, which are NumPy kernels that release the GIL, so the chunks run in parallel on a thread pool. With
+# use_processes the chunks run on a process pool instead, and the node values live in shared memory written by every
+# worker. Levels with too few children for several chunks are evaluated by the calling thread, without the pool.
+# Format of a parallel evaluator ::
+# {
+#     "circuit": {..compiled_circuit_format..},
+#     "schedule": [[(nodes, opcode, child_indices, segment_offsets), ..], ..], ## chunks of every level
+#     "workers": 4,
+#     "max_batch_size": 64, ## largest number of evidence evaluated at once, sets the size of the shared memory
+#     "executor": ThreadPoolExecutor OR multiprocessing.Pool,
+#     "shared_memory": SharedMemory OR None, ## node values of the process pool, None for the thread pool
+# }
+# Format of a speedup report ::
+# {
+#     "nodes": 344207, "edges": 893442, "levels": 52, "batch_size": 16, "cpu_count": 8,
+#     "serial": 0.31, ## seconds of circuit_functions.evaluate_nodes_batch
+#     "thread": [{"workers": 2, "time": 0.18, "speedup": 1.72}, ..],
+#     "process": [{"workers": 2, "time": 0.2, "speedup": 1.55}, ..],
+# }
+
+import concurrent.futures
+import contextlib
+import io
+import multiprocessing
+import multiprocessing.shared_memory
+import os
+import sys
+import time
+
+import numpy as np
+
+import circuit_functions as cf
+
+MIN_CHUNK_CHILDREN = 16384  # smaller chunks cost more in scheduling than they save in parallel
+DEFAULT_MAX_BATCH_SIZE = 64
+
+process_worker_state = {}  # schedule and shared memory of the process pool worker running in this process
+
+
+# Partitions the level schedule of the circuit into chunks of about the same number of children, at most workers
+# chunks per (level, opcode) group and at least MIN_CHUNK_CHILDREN children per chunk. The groups of the same level
+# are merged, since sum and product nodes of a level do not depend on each other
+# Input: {circuit: {..compiled_circuit_format..}, workers: 4}
+# Output: [[(nodes: array([..]), opcode: OP_SUM, child_indices: array([..]), segment_offsets: array([..])), ..], ..]
+def get_parallel_schedule(circuit, workers):
+    levels = circuit["levels"]
+    schedule = []
+    for nodes, opcode, child_indices, segment_offsets in cf.get_level_schedule(circuit):
+        level = int(levels[nodes[0]])
+        if not schedule or schedule[-1][0] != level:
+            schedule.append((level, []))
+
+        child_count = len(child_indices)
+        parts = max(1, min(workers, child_count // MIN_CHUNK_CHILDREN))
+        # the first node of every chunk is the node whose segment holds the next share of the children
+        bounds = np.unique(np.searchsorted(segment_offsets, np.arange(1, parts) * child_count / parts))
+        node_bounds = [0] + [int(bound) for bound in bounds if 0 < bound < len(nodes)] + [len(nodes)]
+        for start, end in zip(node_bounds, node_bounds[1:]):
+            child_start = int(segment_offsets[start])
+            child_end = int(segment_offsets[end]) if end < len(nodes) else child_count
+            schedule[-1][1].append((nodes[start:end], opcode, child_indices[child_start:child_end],
+                                    segment_offsets[start:end] - child_start))
+    return [chunks for level, chunks in schedule]
+
+
+# evaluates one chunk of a level, the nodes of the chunk are written to node_values
+def evaluate_chunk(node_values, chunk, maximize):
+    nodes, opcode, child_indices, segment_offsets = chunk
+    ufunc = np.multiply if opcode == cf.OP_PRODUCT else np.maximum if maximize else np.add
+    node_values[nodes] = ufunc.reduceat(node_values[child_indices], segment_offsets, axis=0)
+
+
+# initializer of the process pool workers, the node values are read from and written to the shared memory
+def initialize_process_worker(schedule, shared_memory_name, node_count):
+    process_worker_state["schedule"] = schedule
+    process_worker_state["shared_memory"] = multiprocessing.shared_memory.SharedMemory(shared_memory_name)
+    process_worker_state["node_count"] = node_count
+
+
+# evaluates chunk chunk_index of level level_index in a process pool worker, the batch has batch_size columns
+def run_process_chunk(task):
+    level_index, chunk_index, batch_size, maximize = task
+    node_values = np.ndarray((process_worker_state["node_count"], batch_size), dtype=np.float64,
+                             buffer=process_worker_state["shared_memory"].buf)
+    evaluate_chunk(node_values, process_worker_state["schedule"][level_index][chunk_index], maximize)
+
+
+# Creates a parallel evaluator of the circuit with a pool of workers, one per core by default. The evaluator has to be
+# closed with close_parallel_evaluator, which stops the pool and frees the shared memory
+# Input: {circuit: {..compiled_circuit_format..}, workers: 4, use_processes: False, max_batch_size: 64}
+# Output: {..parallel_evaluator_format..}
+def create_parallel_evaluator(circuit, workers=None, use_processes=False, max_batch_size=DEFAULT_MAX_BATCH_SIZE):
+    workers = workers or os.cpu_count() or 1
+    schedule = get_parallel_schedule(circuit, workers)
+    evaluator = {"circuit": circuit, "schedule": schedule, "workers": workers, "max_batch_size": max_batch_size,
+                 "executor": None, "shared_memory": None}
+    if not use_processes:
+        evaluator["executor"] = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        return evaluator
+
+    node_count = len(circuit["opcodes"])
+    size = max(1, node_count * max_batch_size * np.dtype(np.float64).itemsize)
+    evaluator["shared_memory"] = multiprocessing.shared_memory.SharedMemory(create=True, size=size)
+    try:
+        evaluator["executor"] = multiprocessing.Pool(workers, initialize_process_worker,
+                                                     (schedule, evaluator["shared_memory"].name, node_count))
+    except BaseException:
+        evaluator["shared_memory"].close()
+        evaluator["shared_memory"].unlink()
+        raise
+    return evaluator
+
+
+def close_parallel_evaluator(evaluator):
+    if evaluator["shared_memory"] is None:
+        evaluator["executor"].shutdown()
+        return
+    evaluator["executor"].terminate()
+    evaluator["executor"].join()
+    evaluator["shared_memory"].close()
+    evaluator["shared_memory"].unlink()
+
+
+# Parallel counterpart of circuit_functions.evaluate_nodes_batch, returns the same values. The rows of the indicator
+# matrix are the evidence of the batch, at most max_batch_size of them
+# Input: {evaluator: {..parallel_evaluator_format..}, indicator_matrix: array([[1, 0, ..], [0, 1, ..]]),
+#         maximize: False}
+# Output: array([[1, 0], [0, 1], .., [0.55, 0.45]])
+def evaluate_nodes_parallel(evaluator, indicator_matrix, maximize=False):
+    circuit = evaluator["circuit"]
+    batch_size = indicator_matrix.shape[0]
+    if batch_size > evaluator["max_batch_size"]:
+        raise ValueError("Expected at most " + str(evaluator["max_batch_size"]) + " evidence, got " + str(batch_size))
+
+    opcodes = circuit["opcodes"]
+    shared_memory = evaluator["shared_memory"]
+    if shared_memory is None:
+        node_values = np.empty((len(opcodes), batch_size), dtype=np.float64)
+    else:
+        node_values = np.ndarray((len(opcodes), batch_size), dtype=np.float64, buffer=shared_memory.buf)
+    node_values[:len(circuit["indicators"])] = indicator_matrix.T
+    parameters = np.flatnonzero(opcodes == cf.OP_PARAMETER)
+    node_values[parameters] = circuit["values"][parameters, np.newaxis]
+
+    executor = evaluator["executor"]
+    for level_index, chunks in enumerate(evaluator["schedule"]):
+        if len(chunks) == 1 or batch_size == 0:
+            for chunk in chunks:
+                evaluate_chunk(node_values, chunk, maximize)
+        elif shared_memory is None:
+            for future in [executor.submit(evaluate_chunk, node_values, chunk, maximize) for chunk in chunks]:
+                future.result()
+        else:
+            executor.map(run_process_chunk, [(level_index, chunk_index, batch_size, maximize)
+                                             for chunk_index in range(len(chunks))])
+    # the shared memory is reused by the next evaluation, so the values are returned in a copy
+    return node_values if shared_memory is None else node_values.copy()
+
+
+# times the best of repeats runs of an evaluation
+def time_evaluation(evaluate, repeats):
+    best_time = None
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        evaluate()
+        elapsed = time.perf_counter() - start_time
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+    return best_time
+
+
+# Measures the speedup of the thread and process pools over the serial circuit_functions.evaluate_nodes_batch for every
+# number of workers, and checks that every pool returns the same values as the serial path.
+# The speedup is bounded by the number of cores, given in the report
+# Input: {circuit: {..compiled_circuit_format..}, evidence_list: ["B=0,A=1", ..], worker_counts: [1, 2, 4],
+#         repeats: 3}
+# Output: {..speedup_report_format..}
+def report_parallel_speedup(circuit, evidence_list, worker_counts=None, repeats=3):
+    indicator_matrix = cf.get_indicator_matrix(circuit, evidence_list)
+    worker_counts = worker_counts or sorted({1, 2, os.cpu_count() or 1})
+    serial_values = cf.evaluate_nodes_batch(circuit, indicator_matrix)  # also creates the level schedule
+    report = {
+        "nodes": len(circuit["opcodes"]),
+        "edges": len(circuit["children"]),
+        "levels": int(circuit["levels"].max(initial=0)),
+        "batch_size": len(evidence_list),
+        "cpu_count": os.cpu_count(),
+        "serial": time_evaluation(lambda: cf.evaluate_nodes_batch(circuit, indicator_matrix), repeats),
+        "thread": [],
+        "process": [],
+    }
+    for use_processes, key in ((False, "thread"), (True, "process")):
+        for workers in worker_counts:
+            evaluator = create_parallel_evaluator(circuit, workers, use_processes, len(evidence_list))
+            try:
+                if not np.allclose(evaluate_nodes_parallel(evaluator, indicator_matrix), serial_values,
+                                   rtol=1e-12, atol=0.0):
+                    raise ValueError("The " + key + " pool returned other values than the serial evaluation")
+                elapsed = time_evaluation(lambda: evaluate_nodes_parallel(evaluator, indicator_matrix), repeats)
+            finally:
+                close_parallel_evaluator(evaluator)
+            report[key].append({"workers": workers, "time": elapsed, "speedup": report["serial"] / elapsed})
+    return report
+
+
+if __name__ == "__main__":
+    # python parallel_functions.py network.bif [elimination strategy] [batch size] [workers, ..]
+    import compile_functions as comp
+    import server_functions as srv
+
+    if len(sys.argv) < 2:
+        print("Usage: python parallel_functions.py (BIF file) [elimination strategy] [batch size] [workers, ..]")
+        sys.exit(1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        compiled_circuit = comp.compile_bif_file(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else "topological")[0]
+    variables = {}
+    for variable, variable_value in compiled_circuit["indicators"]:
+        variables.setdefault(variable, []).append(variable_value)
+    batch = srv.sample_random_evidence(variables, int(sys.argv[3]) if len(sys.argv) > 3 else 16)
+    print(report_parallel_speedup(compiled_circuit, batch, [int(item) for item in sys.argv[4:]] or None))
@@ -1,132 +1,202 @@
 # Description:
-# This file is responsible for plotting the Arithmetic circuit, which is received as an input along with the file name.
-# After this file is executed with appropriate inputs, the output would be an SVG file of the Arithmetic circuit.
-# Format of a single node ::
+# This file is responsible for plotting the compiled arithmetic circuit (see circuit_functions), which is received as an
+# input along with the file name, so the plot shows the circuit after its simplification.
+# The circuit is streamed to a DOT file, one line per node and edge, and the DOT file is rendered to an SVG file with
+# Graphviz, unless rendering is turned off or the circuit has more nodes than max_render_nodes.
+# Every node is written once with the id "n(index of the node)", so shared nodes are drawn once and the time needed is
+# linear in the size of the circuit.
+# Large circuits can be inspected by plotting only a selection of the circuit:
+#   root_values: only the sub-circuit feeding the value of a chosen state at the root of a bucket
+#   variables: only the nodes involving one of the chosen variables, and the edges between them. A node involves a
+#       variable when the variable is in the scope of a factor below it: an indicator of the variable, or a parameter of
+#       a CPT whose family (circuit["families"]) contains the variable. So the selection holds every ancestor of a
+#       selected node, a path between two selected nodes never leaves the selection and no edge has to be contracted.
+#       The selection is found by walking up from the indicators and parameters of the variables, so its time
+#       depends on its size (once the parent index of the circuit exists)
+#   max_depth: only the top levels below the root, deeper sub-circuits are drawn as collapsed summary nodes that are
+#       not traversed, so the time needed depends on the selection only
+# The statistics written below every graph are those of the compiled circuit ::
 # {
-#     "type": "", ## possible values: sum/product/value/indicator
-#     "value": , ## probability value
-#     "references": [], ## contains dict representing other nodes
-#     "node": "", ## name of variable, ex: A
-#     "variable_value": "", ## possible value of variable, ex: 0
+#     "total": 145, ## number of nodes
+#     "product": 60, "sum": 30, "parameter": 47, "indicator": 8, ## number of nodes of every type
+#     "edges": 203, ## number of edges
 # }
 
-
-import graphviz
-
-# "duplicates" variable is used to detect & prevent duplicate nodes to be created in graph,thus plotting wrong network
-# "edges" variable is used for the same purpose, but the difference being, it stores the edges between nodes.
-duplicates = {}
-edges = []
-
-
-# This function provides all the required attributes for a node in the network, attributes being: name/label/fillcolor
-# It takes the name of the node
-# (which is of format "(name of variable)_(type)", ex: for variable A and value type node, the name becomes: A_value),
-# node type (value/indicator/sum/product),
-# value of node (probability value),
-# variable_value(indicator of the possible values for node),
-# counter(Used to allow multiple sum/product nodes with same name/label and not let graphviz detect them as duplicates).
-# Input: {node_name: "A_value", type: "value", node_value: 0.5, variable_value: "0", counter: [4]}
-# Output:{node_name: A_value_0.5_5, label: "A_value_0.5", fillcolor: "Lavender"}
-def get_node_attributes(node_name, type, node_value, variable_value, counter):
-    label = node_name
-    fillcolor = "white"
-    if type != "indicator" and type != "value":
-        counter[0] += 1
-        node_name += str(counter)
-
-    if type == "value":
-        label += "_" + str(node_value)
-        node_name = label
-        counter[0] += 1
-        node_name += str(counter)
-        fillcolor = "Lavender"
-    elif type == "indicator":
-        label += "_" + str(variable_value)
-        node_name = label
-        fillcolor = "Thistle"
-    elif type == "sum":
-        label = "+"
-        fillcolor = "LightCoral"
-    elif type == "product":
-        label = "*"
-        fillcolor = "LightCyan"
-    else:
-        label = "#"
-        fillcolor = "DarkSeaGreen"
-
-    return {"node_name": node_name, "label": label, "fillcolor": fillcolor}
-
-
-# The idea behind this function is that the nodes dict contains every node created until the moment this func is called.
-# We search for these nodes to check whether a node with the given node_name exists,
-# if yes, we return the existing node OR we return None
-# Input: {node_name: "A_sum4", node_references: [{ ..node_format.. }], nodes: {"A_sum2":[{ ..node_format.. }]}}
-# Output: None OR "A_sum2"
-def find_duplicate(node_name, node_references, nodes):
-    keys = list(nodes.keys())
-    for i in range(len(keys)):
-        node1 = nodes[keys[i]]
-        if node_references == node1 and node_name != keys[i]:
-            # print(node_name, keys[i])
-            duplicates[node_name] = keys[i]
-            return keys[i]
-
-    return None
-
-
-# The brain of the file, is responsible for converting the dict of dict representing the AC into a visual network
-# Input: {data: {"A":{"0": { ..node_format.. }, "1": { ..node_format.. }}}, dot: ..Graphviz_digraph..}
-# Output: ..Graphviz_digraph..
-def create_graphviz(data, dot):
-    nodes = {}  # used for detecting duplicates
-    counter = [0]  # used to allow duplicate sum/product/variable nodes which have same name.
-
-    # This function is responsible for creation of edges between every node in the network
-    def add_edges(parent_name, children):
-        # This condition is to check whether a node with the same name has been created in the graph,
-        # if yes, then we have already created all the edges concerning this node and need not create duplicates
-        if parent_name in duplicates:
-            # print("FOUND in duplicates:", parent_name, ":: changed to ==", duplicates[parent_name])
-            return True
-
-        # Children here is a list of dicts, with the same format as that of a single node.
-        # They are the references for a given node.
-        for child in children:
-            child_node_name = child["node"] + "_" + child["type"]  # creating the node name, for unique identity
-            child_node_attrib = get_node_attributes(child_node_name, child["type"], child["value"], child["variable_value"], counter)
-
-            # condition is specific to sum/product nodes because they will have the same label
-            # thus their node_name needs to be unique to mark them as unique
-            duplicate = None
-            if child["type"] == "sum" or child["type"] == "product":
-                nodes[child_node_attrib["node_name"]] = child["references"]
-                duplicate = find_duplicate(child_node_attrib["node_name"], child["references"], nodes)
-
-            if duplicate is not None:
-                # this means that a node with the same values has been created so just create an edge.
-                dot.edge(duplicate, parent_name)
-            else:
-                # this means that either the node is a new node and thus needs to be created with and edge
-                dot.node(child_node_attrib["node_name"], child_node_attrib["label"], style='filled', fillcolor=child_node_attrib["fillcolor"])
-                dot.edge(child_node_attrib["node_name"], parent_name)
-            add_edges(child_node_attrib["node_name"], child.get("references", []))  # recursive call to same function
-
-    node_name = data["node"]+"_"+data["type"]
-    node_attrib = get_node_attributes(node_name, data["type"], data["value"], data["variable_value"], counter)
-    dot.node(node_attrib["node_name"], node_attrib["label"], style='filled', fillcolor=node_attrib["fillcolor"])
-    add_edges(node_attrib["node_name"], data["references"])
-    return dot
-
-
-# Main function of the file, is responsible for plotting the network with the provided input values.
-# Input: {data: {"A":{"0": { ..node_format.. }, "1": { ..node_format.. }}}, file_name: "asia"}
-# Output: None
-def plot_graphviz(data, file_name, nodes_stats):
-    # For loop because we receive a dict where keys = possible values of root variable & values = dict of a node format
-    for node in data:
-        dot = graphviz.Digraph("AC_" + file_name + "_" + node, comment='Arithmetic Circuit', format='svg')  # creates a file with the file_name and format
-        dot = create_graphviz(data[node], dot)  # uses the file to plot the network
-        dot.attr(label="Node Stats :: " + str(nodes_stats), labelloc="nodes_stats")
-        dot.render(directory='arithmetic-circuits/'+file_name).replace('\\', '/')
-        print("Created arithmetic circuit at folder: arithmetic-circuits/"+file_name)
+import collections
+import os
+
+import numpy as np
+
+import circuit_functions as cf
+
+DEFAULT_MAX_RENDER_NODES = 5000  # Graphviz layouts get very slow above a few thousand nodes
+
+opcode_names = {cf.OP_INDICATOR: "indicator", cf.OP_PARAMETER: "parameter", cf.OP_SUM: "sum", cf.OP_PRODUCT: "product"}
+
+
+# counts the nodes of every type and the edges of a compiled circuit
+# Input: {circuit: {..compiled_circuit_format..}}
+# Output: {total: 145, product: 60, sum: 30, parameter: 47, indicator: 8, edges: 203}
+def get_circuit_stats(circuit):
+    counts = np.bincount(circuit["opcodes"], minlength=len(opcode_names)).tolist()
+    circuit_stats = {"total": len(circuit["opcodes"])}
+    for opcode in (cf.OP_PRODUCT, cf.OP_SUM, cf.OP_PARAMETER, cf.OP_INDICATOR):
+        circuit_stats[opcode_names[opcode]] = counts[opcode]
+    circuit_stats["edges"] = len(circuit["children"])
+    return circuit_stats
+
+
+# This function provides the attributes used to draw a node, attributes being: label/fillcolor. Parameters are labelled
+# with the variable of their slot, constants created by the compilation or by the simplification have no variable
+# Input: {circuit: {..compiled_circuit_format..}, index: 12, parameter_labels: {12: ("A", "0")}}
+# Output: {label: "A_value_0.5", fillcolor: "Lavender"}
+def get_node_attributes(circuit, index, parameter_labels):
+    opcode = circuit["opcodes"][index]
+    if opcode == cf.OP_PARAMETER:
+        label = "value_" + str(circuit["values"][index])
+        if index in parameter_labels:
+            label = parameter_labels[index][0] + "_" + label
+        return {"label": label, "fillcolor": "Lavender"}
+    elif opcode == cf.OP_INDICATOR:
+        variable, variable_value = circuit["indicators"][index]
+        return {"label": variable + "_indicator_" + str(variable_value), "fillcolor": "Thistle"}
+    elif opcode == cf.OP_SUM:
+        return {"label": "+", "fillcolor": "LightCoral"}
+    elif opcode == cf.OP_PRODUCT:
+        return {"label": "*", "fillcolor": "LightCyan"}
+    return {"label": "#", "fillcolor": "DarkSeaGreen"}
+
+
+# quotes a string to be used as an id or attribute value in a DOT file, line breaks become the \n escape of DOT
+# Input: {text: 'A "quoted" name'}
+# Output: '"A \"quoted\" name"'
+def quote(text):
+    return '"' + str(text).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+
+
+# Returns the given nodes and all their ancestors, found by walking up the parents of the circuit, so the time needed
+# depends on the number of nodes returned
+# Input: {circuit: {..compiled_circuit_format..}, nodes: [3, 4]}
+# Output: {3, 4, 9, 12, ..}
+def get_ancestors(circuit, nodes):
+    parent_index = cf.get_parent_index(circuit)
+    parent_offsets, parents = parent_index["parent_offsets"], parent_index["parents"]
+    ancestors = set(nodes)
+    stack = list(ancestors)
+    while stack:
+        node = stack.pop()
+        for parent in parents[parent_offsets[node]:parent_offsets[node + 1]].tolist():
+            if parent not in ancestors:
+                ancestors.add(parent)
+                stack.append(parent)
+    return ancestors
+
+
+# Returns the nodes involving one of the variables: the indicators of the variables, the parameters of the CPTs whose
+# family contains one of the variables and all their ancestors. Without circuit["families"] (circuits read from a
+# file) the family of a CPT is its own variable only
+# Input: {circuit: {..compiled_circuit_format..}, variables: ["either", "lung"]}
+# Output: {3, 4, 9, 12, ..}
+def get_selected_nodes(circuit, variables):
+    variable_indicators = cf.get_indicator_index(circuit)["variable_indicators"]
+    for variable in variables:
+        if variable not in variable_indicators:
+            raise ValueError("Unknown variable '" + variable + "' in the variables to plot")
+
+    families = circuit.get("families", {})
+    nodes = [indicator for variable in variables for indicator in variable_indicators[variable]]
+    nodes.extend(node for (variable, entry), node in zip(circuit["parameters"], circuit["parameter_nodes"].tolist())
+                 if not variables.isdisjoint(families.get(variable, [variable])))
+    return get_ancestors(circuit, nodes)
+
+
+# Returns the sub-circuit feeding the given state of the variable of a bucket. The bucket is named after the variable
+# eliminated last, so the matching children of the bucket root are those that read the indicator of the state
+# Input: {circuit: {..compiled_circuit_format..}, bucket: "either", variable_value: "yes"}
+# Output: [12, ..] (roots of the cone)
+def get_query_cone(circuit, bucket, variable_value):
+    if bucket not in circuit["roots"]:
+        raise ValueError("Unknown bucket '" + bucket + "', the buckets are: " + ", ".join(circuit["roots"]))
+    indicator_ids = cf.get_indicator_index(circuit)["indicator_ids"]
+    if (bucket, variable_value) not in indicator_ids:
+        raise ValueError("Unknown value '" + variable_value + "' for the root of bucket '" + bucket + "'")
+
+    root = circuit["roots"][bucket]
+    ancestors = get_ancestors(circuit, [indicator_ids[(bucket, variable_value)]])
+    children = circuit["children"][circuit["child_offsets"][root]:circuit["child_offsets"][root + 1]].tolist()
+    cone = [child for child in children if child in ancestors]
+    return cone if cone or root not in ancestors else [root]
+
+
+# Streams the circuit below the roots to a DOT file, the edges go from a child to its parent.
+# Only the selected nodes are written, and nodes at max_depth below the roots that have selected children are written
+# as collapsed summary nodes whose children are not visited. The depth is counted along the selected nodes, so
+# variables and max_depth together give the top levels of the selection
+# Input: {circuit: {..compiled_circuit_format..}, roots: [12], graph_name: "AC_asia_either",
+#         path: "arithmetic-circuits/asia/AC_asia_either.gv", circuit_stats: {"total": 145, ..},
+#         selected_nodes: {3, 4, 9, 12, ..}, max_depth: 4}
+# Output: 145 (number of nodes written)
+def write_dot_file(circuit, roots, graph_name, path, circuit_stats, selected_nodes=None, max_depth=None):
+    child_offsets, children = circuit["child_offsets"], circuit["children"]
+    parameter_labels = dict(zip(circuit["parameter_nodes"].tolist(), circuit["parameters"]))
+    roots = [root for root in roots if selected_nodes is None or root in selected_nodes]
+    visited = set(roots)
+    queue = collections.deque((root, 0) for root in roots)
+    with open(path, "w") as dot_file:
+        dot_file.write("// Arithmetic Circuit\ndigraph " + quote(graph_name) + " {\n")
+        while queue:
+            node, depth = queue.popleft()
+            node_children = [child for child in children[child_offsets[node]:child_offsets[node + 1]].tolist()
+                             if selected_nodes is None or child in selected_nodes]
+            is_collapsed = max_depth is not None and depth >= max_depth and len(node_children) > 0
+
+            attributes = get_node_attributes(circuit, node, parameter_labels)
+            label, style = attributes["label"], "filled"
+            if is_collapsed:
+                label, style = label + "\n(" + str(len(node_children)) + " children collapsed)", "filled,dashed"
+            dot_file.write("\tn" + str(node) + " [label=" + quote(label) + " fillcolor=" +
+                           quote(attributes["fillcolor"]) + " style=" + quote(style) + "]\n")
+            if is_collapsed:
+                continue
+
+            for child in node_children:
+                if child not in visited:
+                    visited.add(child)
+                    queue.append((child, depth + 1))
+                dot_file.write("\tn" + str(child) + " -> n" + str(node) + "\n")
+        dot_file.write("\tlabel=" + quote("Node Stats :: " + str(circuit_stats)) + "\n\tlabelloc=b\n}\n")
+    return len(visited)
+
+
+# Main function of the file, is responsible for plotting the compiled circuit with the provided input values.
+# One DOT file is written for every bucket, or for every bucket of root_values with only the cone of the chosen
+# state. A DOT file is rendered to SVG when render is set and at most max_render_nodes nodes were selected
+# Input: {circuit: {..compiled_circuit_format..}, file_name: "asia", render: True, max_render_nodes: 5000,
+#         root_values: {"A": "0"}, variables: ["A", "B"], max_depth: 4}
+# Output: ["arithmetic-circuits/asia/AC_asia_A.gv.svg" or "arithmetic-circuits/asia/AC_asia_A.gv", ..]
+def plot_graphviz(circuit, file_name, render=True, max_render_nodes=DEFAULT_MAX_RENDER_NODES, root_values=None,
+                  variables=None, max_depth=None):
+    directory = "arithmetic-circuits/" + file_name
+    os.makedirs(directory, exist_ok=True)
+    circuit_stats = get_circuit_stats(circuit)
+    selected_nodes = None if variables is None else get_selected_nodes(circuit, set(variables))
+    created_files = []
+    # For loop because the roots are a dict where keys = bucket names & values = index of the root node of the bucket
+    for bucket in circuit["roots"] if root_values is None else root_values:
+        graph_name = "AC_" + file_name + "_" + bucket
+        if root_values is None:
+            roots = [circuit["roots"][bucket]]
+        else:
+            graph_name += "_" + root_values[bucket]
+            roots = get_query_cone(circuit, bucket, root_values[bucket])
+        dot_path = directory + "/" + graph_name + ".gv"
+        node_count = write_dot_file(circuit, roots, graph_name, dot_path, circuit_stats, selected_nodes, max_depth)
+        if render and node_count <= max_render_nodes:
+            import graphviz  # only needed for the rendering, so the DOT files can be written without it
+            created_files.append(graphviz.render("dot", "svg", dot_path).replace('\\', '/'))
+        else:
+            if render:
+                print("Skipped rendering of", dot_path, "::", node_count, "nodes is more than", max_render_nodes)
+            created_files.append(dot_path)
+    print("Created arithmetic circuit at folder: " + directory)
+    return created_files
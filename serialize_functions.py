@@ -0,0 +1,125 @@
+# Description:
+# This file defines the binary file format of a compiled arithmetic circuit (see circuit_functions) and reads it back
+# with numpy.memmap, so several processes can share one read-only copy of a large circuit without deserializing it.
+# Layout of the file, every number is little-endian and every array starts at a multiple of SECTION_ALIGNMENT ::
+# {
+#     header: magic "BNAC", format version (uint32), node count, child count, indicator count and
+#             metadata size (uint64 each), padded to HEADER_SIZE bytes
+#     opcodes: int8[node count] ## node type of every node, circuit_functions.OP_*
+#     levels: int32[node count]
+#     child_offsets: int64[node count + 1] ## CSR row pointers, children of node i: children[offsets[i]:offsets[i + 1]]
+#     children: int64[child count] ## CSR column indices
+#     values: float64[node count] ## parameters
+#     metadata: utf-8 JSON {"compiler_version": 3, "indicators": [["A", "0"], ..], "roots": {"A": 12},
+#               "parameters": [["A", "0", 4], ..], ## (variable, CPT entry, parameter node) of every parameter slot
+#               "folded_parameters": [["B", "1,0", 0.0], ..]} ## (variable, CPT entry, value) of folded parameters
+# }
+
+import json
+import struct
+import numpy as np
+
+import circuit_functions as cf
+
+FILE_MAGIC = b"BNAC"
+FILE_FORMAT_VERSION = 2
+HEADER_FORMAT = "<4sIQQQQ"
+HEADER_SIZE = 64
+SECTION_ALIGNMENT = 64
+
+# (key in the compiled circuit, dtype, function giving the length of the array from the header counts)
+file_sections = [
+    ("opcodes", np.dtype("<i1"), lambda node_count, child_count: node_count),
+    ("levels", np.dtype("<i4"), lambda node_count, child_count: node_count),
+    ("child_offsets", np.dtype("<i8"), lambda node_count, child_count: node_count + 1),
+    ("children", np.dtype("<i8"), lambda node_count, child_count: child_count),
+    ("values", np.dtype("<f8"), lambda node_count, child_count: node_count),
+]
+
+
+def align_offset(offset):
+    return (offset + SECTION_ALIGNMENT - 1) // SECTION_ALIGNMENT * SECTION_ALIGNMENT
+
+
+# calculates the byte offset of every array and of the metadata from the counts stored in the header
+# Input: {node_count: 10, child_count: 12}
+# Output: ({"opcodes": 64, "levels": 128, ..}, 640)
+def get_section_offsets(node_count, child_count):
+    offsets = {}
+    offset = HEADER_SIZE
+    for key, dtype, get_length in file_sections:
+        offsets[key] = offset
+        offset = align_offset(offset + dtype.itemsize * get_length(node_count, child_count))
+    return offsets, offset
+
+
+# writes the compiled circuit to a file in the format described at the top of this file
+# Input: {circuit: {..compiled_circuit_format..}, path: "arithmetic-circuits/asia/asia.ac"}
+# Output: None
+def write_circuit_file(circuit, path):
+    node_count = len(circuit["opcodes"])
+    child_count = len(circuit["children"])
+    metadata = json.dumps({
+        "compiler_version": cf.COMPILER_VERSION,
+        "indicators": [list(indicator) for indicator in circuit["indicators"]],
+        "roots": {key: int(index) for key, index in circuit["roots"].items()},
+        "parameters": [[variable, entry, int(node)] for (variable, entry), node in
+                       zip(circuit["parameters"], circuit["parameter_nodes"])],
+        "folded_parameters": [[variable, entry, value] for (variable, entry), value in
+                              circuit.get("folded_parameters", {}).items()],
+    }).encode("utf-8")
+    offsets, metadata_offset = get_section_offsets(node_count, child_count)
+
+    with open(path, "wb") as circuit_file:
+        header = struct.pack(HEADER_FORMAT, FILE_MAGIC, FILE_FORMAT_VERSION, node_count, child_count,
+                             len(circuit["indicators"]), len(metadata))
+        circuit_file.write(header.ljust(HEADER_SIZE, b"\0"))
+        for key, dtype, get_length in file_sections:
+            circuit_file.write(b"\0" * (offsets[key] - circuit_file.tell()))
+            circuit_file.write(np.ascontiguousarray(circuit[key], dtype=dtype).tobytes())
+        circuit_file.write(b"\0" * (metadata_offset - circuit_file.tell()))
+        circuit_file.write(metadata)
+
+
+# Reads a circuit file. With memory_map the arrays are read-only numpy.memmap views of the file, which are shared
+# between the processes that map the same file, otherwise they are read into memory.
+# A file written by another circuit_functions.COMPILER_VERSION raises an error, its circuit has to be compiled again
+# Input: {path: "arithmetic-circuits/asia/asia.ac", memory_map: True}
+# Output: {..compiled_circuit_format..}
+def read_circuit_file(path, memory_map=True):
+    with open(path, "rb") as circuit_file:
+        header = circuit_file.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE:
+            raise ValueError("File '" + path + "' is not an arithmetic circuit file")
+        magic, version, node_count, child_count, indicator_count, metadata_size = struct.unpack_from(HEADER_FORMAT,
+                                                                                                      header)
+        if magic != FILE_MAGIC:
+            raise ValueError("File '" + path + "' is not an arithmetic circuit file")
+        if version != FILE_FORMAT_VERSION:
+            raise ValueError("Unsupported arithmetic circuit file version " + str(version))
+
+        offsets, metadata_offset = get_section_offsets(node_count, child_count)
+        circuit_file.seek(metadata_offset)
+        metadata = json.loads(circuit_file.read(metadata_size).decode("utf-8"))
+        if metadata.get("compiler_version") != cf.COMPILER_VERSION:
+            raise ValueError("File '" + path + "' was written by compiler version " +
+                             str(metadata.get("compiler_version")) + ", expected " + str(cf.COMPILER_VERSION))
+
+        circuit = {}
+        for key, dtype, get_length in file_sections:
+            length = get_length(node_count, child_count)
+            if memory_map and length > 0:
+                circuit[key] = np.memmap(path, dtype=dtype, mode="r", offset=offsets[key], shape=(length,))
+            else:
+                circuit_file.seek(offsets[key])
+                circuit[key] = np.frombuffer(circuit_file.read(dtype.itemsize * length), dtype=dtype)
+
+    circuit["indicators"] = [tuple(indicator) for indicator in metadata["indicators"]]
+    circuit["roots"] = metadata["roots"]
+    circuit["parameters"] = [(variable, entry) for variable, entry, node in metadata["parameters"]]
+    circuit["parameter_nodes"] = np.array([node for variable, entry, node in metadata["parameters"]], dtype=np.int64)
+    circuit["folded_parameters"] = {(variable, entry): value
+                                    for variable, entry, value in metadata["folded_parameters"]}
+    if len(circuit["indicators"]) != indicator_count:
+        raise ValueError("File '" + path + "' is corrupted, the indicator count does not match the header")
+    return circuit
@@ -0,0 +1,387 @@
+# Description:
+# This file contains a long-running inference service. The compiled circuits of the networks are loaded once and kept
+# resident, and the queries arrive as JSON lines over a localhost TCP socket or a Unix socket, so a query no longer
+# parses and compiles the network again.
+# Queries for the same network and query type that arrive within batch_window seconds of each other are coalesced
+# into one batched evaluation of the circuit (circuit_functions.evaluate_nodes_batch), which is answered as soon as
+# max_batch_size queries are waiting or the window has passed. The evaluation runs on a thread of the default
+# executor, the event loop keeps reading and answering the other queries meanwhile. The service measures the latency
+# of every query and reports the throughput and latency percentiles with the "metrics" query.
+# A connection can send several queries without waiting for the answers, every answer carries the id of its query.
+# Format of a query (one JSON object per line) ::
+# {
+#     "id": 1, ## returned with the answer, optional
+#     "query": "probability", ## possible values: probability/posteriors/mpe/variables/metrics
+#     "network": "asia", ## name of the network, not needed by the metrics query
+#     "evidence": {"xray": "no"} or "xray=no", ## optional
+# }
+# Format of an answer (one JSON object per line) ::
+# {
+#     "id": 1,
+#     "result": 0.0013, ## probability: P(evidence), posteriors: {"A": {"0": 0.2, "1": 0.8}, ..},
+#                       ## mpe: {probability: 0.3, assignment: {"A": "1", ..}}, variables: {"A": ["0", "1"], ..},
+#                       ## metrics: {..metrics_format..}
+#     "error": None, ## reason of the failure, the result is None then
+# }
+# Format of the metrics ::
+# {
+#     "requests": 1000, "errors": 0, "batches": 40, "mean_batch_size": 25.0,
+#     "uptime": 12.5, "throughput": 80.0, ## seconds since the start and answered queries per second
+#     "latency": {"mean": 0.003, "p50": 0.002, "p90": 0.004, "p99": 0.008}, ## seconds, over the last queries
+# }
+
+import asyncio
+import collections
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+import cache_functions as cache
+import circuit_functions as cf
+import compile_functions as comp
+import serialize_functions as sz
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_BATCH_WINDOW = 0.002  # seconds a query waits for other queries to join its batch
+DEFAULT_MAX_BATCH_SIZE = 256
+LATENCY_SAMPLES = 100000  # latencies kept for the percentiles
+MAX_BATCH_CELLS = 4000000  # node values (and edge values) per evaluation, 32 MB of float64 for the node values
+
+batched_queries = ["probability", "posteriors", "mpe"]
+
+
+# Loads the circuit of every file, BIF files are compiled (through the cache when a cache directory is given) and the
+# other files (.ac) are read with serialize_functions. The tables used by the batched evaluation are created here,
+# before the first query. The network is named after its file
+# Input: {paths: ["....path_to_bif_or_ac_file....", ..], elimination_strategy: "auto",
+#         cache_directory: "arithmetic-circuits/cache"}
+# Output: {"asia": {..compiled_circuit_format..}, ..}
+def load_circuits(paths, elimination_strategy="topological", cache_directory=None):
+    circuits = {}
+    for path in paths:
+        name = os.path.basename(path).split(".")[0]
+        circuit = None
+        if not path.lower().endswith(".bif"):
+            circuit = sz.read_circuit_file(path)
+        elif cache_directory is not None:
+            cache_key = cache.get_cache_key(path, elimination_strategy)
+            circuit = cache.load_circuit(cache_directory, cache_key)
+        if circuit is None:
+            circuit = comp.compile_bif_file(path, elimination_strategy)[0]
+            if cache_directory is not None:
+                cache.store_circuit(cache_directory, cache_key, circuit)
+        cf.get_indicator_index(circuit)
+        cf.get_level_schedule(circuit)
+        circuits[name] = circuit
+    return circuits
+
+
+def create_server_state(circuits, batch_window=DEFAULT_BATCH_WINDOW, max_batch_size=DEFAULT_MAX_BATCH_SIZE):
+    return {
+        "circuits": circuits,
+        "batch_window": batch_window,
+        "max_batch_size": max_batch_size,
+        "queues": {},  # (network, query) -> [(evidence, future), ..] waiting for their batch
+        "timers": {},  # (network, query) -> timer that answers the waiting batch at the end of its window
+        "evaluations": set(),  # tasks of the batches being evaluated
+        "latencies": collections.deque(maxlen=LATENCY_SAMPLES),
+        "requests": 0,
+        "errors": 0,
+        "batches": 0,
+        "batched_requests": 0,
+        "start_time": time.monotonic(),
+    }
+
+
+# evaluates the circuit once for the valid queries of the given rows and stores their answers
+def answer_rows(circuit, query, evidence_list, rows, answers):
+    indicator_matrix = cf.get_indicator_matrix(circuit, [evidence_list[i] for i in rows])
+    node_values = cf.evaluate_nodes_batch(circuit, indicator_matrix, maximize=query == "mpe")
+    probabilities = np.prod(node_values[list(circuit["roots"].values())], axis=0)
+    derivatives = cf.differentiate_nodes_batch(circuit, node_values) if query == "posteriors" else None
+    for column, i in enumerate(rows):
+        try:
+            if query == "probability":
+                result = float(probabilities[column])
+            elif query == "mpe":
+                result = cf.get_maximizing_explanation(circuit, node_values[:, column].tolist())
+            else:
+                result = cf.get_posterior_marginals(circuit, indicator_matrix[column].tolist(),
+                                                    derivatives[:len(circuit["indicators"]), column].tolist(),
+                                                    float(probabilities[column]))
+            answers[i] = {"result": result, "error": None}
+        except ValueError as error:
+            answers[i] = {"result": None, "error": str(error)}
+
+
+# Answers a batch of queries of the same type on one circuit with a single evaluation, or with one evaluation per
+# chunk of queries when the circuit times the batch has more than MAX_BATCH_CELLS values. Invalid evidence and
+# evidence with probability 0 (for posteriors and mpe) only fail their own query
+# Input: {circuit: {..compiled_circuit_format..}, query: "probability", evidence_list: [{"B": "0"}, "A=1"]}
+# Output: [{result: 0.55, error: None}, {result: None, error: "Unknown evidence variable 'C'"}, ..]
+def answer_batch(circuit, query, evidence_list):
+    answers = [None] * len(evidence_list)
+    rows = []
+    for i, evidence in enumerate(evidence_list):
+        try:
+            cf.parse_evidence(circuit, evidence)
+            rows.append(i)
+        except (ValueError, TypeError, AttributeError) as error:
+            answers[i] = {"result": None, "error": str(error)}
+    if not rows:
+        return answers
+
+    # on large circuits a wide batch no longer fits in the caches and is slower than a few narrow ones
+    chunk_size = max(1, MAX_BATCH_CELLS // (len(circuit["opcodes"]) + len(circuit["children"])))
+    for start in range(0, len(rows), chunk_size):
+        answer_rows(circuit, query, evidence_list, rows[start:start + chunk_size], answers)
+    return answers
+
+
+# answers every query waiting for the batch of (network, query) at once, the evaluation runs on the default executor
+# of the event loop so the other connections are served in the meantime
+def flush_batch(state, key):
+    timer = state["timers"].pop(key, None)
+    if timer is not None:
+        timer.cancel()
+    waiting = state["queues"].pop(key, [])
+    if not waiting:
+        return
+
+    state["batches"] += 1
+    state["batched_requests"] += len(waiting)
+    task = asyncio.ensure_future(evaluate_batch(state, key, waiting))
+    state["evaluations"].add(task)
+    task.add_done_callback(state["evaluations"].discard)
+
+
+# evaluates a batch taken from the queue of (network, query) and sets the answers of its queries
+async def evaluate_batch(state, key, waiting):
+    try:
+        answers = await asyncio.get_running_loop().run_in_executor(
+            None, answer_batch, state["circuits"][key[0]], key[1], [evidence for evidence, future in waiting])
+    except Exception as error:  # an unexpected failure fails the batch, not the service
+        answers = [{"result": None, "error": type(error).__name__ + ": " + str(error)}] * len(waiting)
+    for (evidence, future), answer in zip(waiting, answers):
+        if not future.done():
+            future.set_result(answer)
+
+
+# Answers a single query. Batched queries wait for their batch, the others are answered at once
+# Input: {state: {..server_state..}, request: {..query_format..}}
+# Output: {result: 0.55, error: None}
+async def answer_request(state, request):
+    query = request.get("query")
+    if query == "metrics":
+        return {"result": get_metrics(state), "error": None}
+    network = request.get("network")
+    if type(network) != str or network not in state["circuits"]:
+        return {"result": None, "error": "Unknown network '" + str(network) + "'"}
+    circuit = state["circuits"][network]
+    if query == "variables":
+        variables = {}
+        for variable, variable_value in circuit["indicators"]:
+            variables.setdefault(variable, []).append(variable_value)
+        return {"result": variables, "error": None}
+    if type(query) != str or query not in batched_queries:
+        return {"result": None, "error": "Unknown query '" + str(query) + "', expected one of " +
+                                         str(batched_queries + ["variables", "metrics"])}
+
+    key = (network, query)
+    future = asyncio.get_running_loop().create_future()
+    waiting = state["queues"].setdefault(key, [])
+    waiting.append((request.get("evidence"), future))
+    if len(waiting) >= state["max_batch_size"]:
+        flush_batch(state, key)
+    elif len(waiting) == 1:
+        state["timers"][key] = asyncio.get_running_loop().call_later(state["batch_window"], flush_batch, state, key)
+    return await future
+
+
+# answers one line of a connection and writes the answer, the lock keeps the answers of a connection whole
+async def answer_line(state, line, writer, write_lock):
+    start_time = time.perf_counter()
+    request = {}
+    try:
+        parsed_request = json.loads(line)
+        if type(parsed_request) != dict:
+            raise ValueError("A query has to be a JSON object")
+        request = parsed_request
+        answer = await answer_request(state, request)
+    except (ValueError, TypeError, KeyError) as error:
+        answer = {"result": None, "error": str(error)}
+
+    state["requests"] += 1
+    state["errors"] += answer["error"] is not None
+    state["latencies"].append(time.perf_counter() - start_time)
+    async with write_lock:
+        writer.write((json.dumps(dict(answer, id=request.get("id"))) + "\n").encode())
+        await writer.drain()
+
+
+async def handle_connection(state, reader, writer):
+    write_lock = asyncio.Lock()
+    tasks = set()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            task = asyncio.create_task(answer_line(state, line, writer, write_lock))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+# Computes the metrics of the service, see the description at the top of this file
+# Input: {state: {..server_state..}}
+# Output: {..metrics_format..}
+def get_metrics(state):
+    uptime = time.monotonic() - state["start_time"]
+    latencies = np.array(state["latencies"], dtype=np.float64)
+    latency = {"mean": None, "p50": None, "p90": None, "p99": None}
+    if len(latencies):
+        latency = {"mean": float(latencies.mean()), "p50": float(np.percentile(latencies, 50)),
+                   "p90": float(np.percentile(latencies, 90)), "p99": float(np.percentile(latencies, 99))}
+    return {
+        "requests": state["requests"],
+        "errors": state["errors"],
+        "batches": state["batches"],
+        "mean_batch_size": state["batched_requests"] / state["batches"] if state["batches"] else None,
+        "uptime": uptime,
+        "throughput": state["requests"] / uptime if uptime > 0 else None,
+        "latency": latency,
+    }
+
+
+# Starts the service on a Unix socket when unix_path is given, on host:port otherwise, and serves until cancelled.
+# started is called with the state once the socket accepts connections
+# Input: {circuits: {"asia": {..compiled_circuit_format..}}, host: "127.0.0.1", port: 8765, unix_path: None,
+#         batch_window: 0.002, max_batch_size: 256, started: None}
+# Output: None
+async def serve(circuits, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None, batch_window=DEFAULT_BATCH_WINDOW,
+                max_batch_size=DEFAULT_MAX_BATCH_SIZE, started=None):
+    state = create_server_state(circuits, batch_window, max_batch_size)
+
+    async def on_connection(reader, writer):
+        await handle_connection(state, reader, writer)
+
+    if unix_path is not None:
+        server = await asyncio.start_unix_server(on_connection, unix_path)
+        print("Serving", ", ".join(circuits), "on", unix_path)
+    else:
+        server = await asyncio.start_server(on_connection, host, port)
+        print("Serving", ", ".join(circuits), "on", host + ":" + str(port))
+    if started is not None:
+        started(state)
+    async with server:
+        await server.serve_forever()
+
+
+async def open_connection(host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None):
+    if unix_path is not None:
+        return await asyncio.open_unix_connection(unix_path)
+    return await asyncio.open_connection(host, port)
+
+
+# Sends one query and waits for its answer
+# Input: {request: {..query_format..}, host: "127.0.0.1", port: 8765, unix_path: None}
+# Output: {..answer_format..}
+async def send_query(request, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None):
+    reader, writer = await open_connection(host, port, unix_path)
+    try:
+        writer.write((json.dumps(request) + "\n").encode())
+        await writer.drain()
+        return json.loads(await reader.readline())
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+# Draws random evidence from the states of the network, observing 1 to max_observed variables. Some evidence can have
+# probability 0, those posteriors and mpe queries are answered with an error
+# Input: {variables: {"A": ["0", "1"], ..}, count: 2, max_observed: 3, seed: 0}
+# Output: [{"A": "1"}, {"A": "0", "C": "1"}]
+def sample_random_evidence(variables, count, max_observed=3, seed=0):
+    generator = random.Random(seed)
+    names = sorted(variables)
+    return [{name: generator.choice(variables[name])
+             for name in generator.sample(names, generator.randint(1, min(max_observed, len(names))))}
+            for _ in range(count)]
+
+
+# Load-tests a running service: concurrency connections send request_count queries in total, each connection sends
+# its next query when the previous one is answered. The evidence is sampled from the variables of the network unless
+# an evidence list is given. The client measures the latencies itself and fetches the metrics of the service
+# Input: {network: "asia", query: "probability", request_count: 10000, concurrency: 64, evidence_list: None,
+#         host: "127.0.0.1", port: 8765, unix_path: None, seed: 0}
+# Output: {requests: 10000, errors: 0, duration: 2.1, throughput: 4761.9,
+#          latency: {mean: .., p50: .., p90: .., p99: ..}, server: {..metrics_format..}}
+async def run_load_test(network, query="probability", request_count=10000, concurrency=64, evidence_list=None,
+                        host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None, seed=0):
+    if evidence_list is None:
+        answer = await send_query({"query": "variables", "network": network}, host, port, unix_path)
+        if answer["error"] is not None:
+            raise ValueError(answer["error"])
+        evidence_list = sample_random_evidence(answer["result"], min(request_count, 1000), seed=seed)
+
+    latencies = []
+    errors = [0]
+    next_request = [0]
+
+    async def run_connection():
+        reader, writer = await open_connection(host, port, unix_path)
+        try:
+            while next_request[0] < request_count:
+                request_id = next_request[0]
+                next_request[0] += 1
+                request = {"id": request_id, "query": query, "network": network,
+                           "evidence": evidence_list[request_id % len(evidence_list)]}
+                start_time = time.perf_counter()
+                writer.write((json.dumps(request) + "\n").encode())
+                await writer.drain()
+                answer = json.loads(await reader.readline())
+                latencies.append(time.perf_counter() - start_time)
+                errors[0] += answer["error"] is not None
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*[run_connection() for _ in range(concurrency)])
+    duration = time.perf_counter() - start_time
+    latencies = np.array(latencies, dtype=np.float64)
+    server_metrics = await send_query({"query": "metrics"}, host, port, unix_path)
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "duration": duration,
+        "throughput": len(latencies) / duration,
+        "latency": {"mean": float(latencies.mean()), "p50": float(np.percentile(latencies, 50)),
+                    "p90": float(np.percentile(latencies, 90)), "p99": float(np.percentile(latencies, 99))},
+        "server": server_metrics["result"],
+    }
+
+
+if __name__ == "__main__":
+    # python server_functions.py serve asia.bif alarm.ac ..
+    # python server_functions.py load-test asia [query] [request count] [concurrency]
+    if len(sys.argv) > 2 and sys.argv[1] == "serve":
+        asyncio.run(serve(load_circuits(sys.argv[2:])))
+    elif len(sys.argv) > 2 and sys.argv[1] == "load-test":
+        arguments = sys.argv[2:] + ["probability", "10000", "64"][len(sys.argv) - 3:]
+        report = asyncio.run(run_load_test(arguments[0], arguments[1], int(arguments[2]), int(arguments[3])))
+        print(json.dumps(report, indent=2))
+    else:
+        print("Usage: python server_functions.py serve (BIF or .ac files) | load-test (network) [query] [count] "
+              "[concurrency]")
@@ -0,0 +1,185 @@
+# Description:
+# This file contains the simplification passes that run on a compiled arithmetic circuit (see circuit_functions)
+# after its construction and before it is serialized. Every pass returns a new circuit and keeps the evaluation of
+# the circuit unchanged:
+#   fold_constants: product nodes whose children are all parameters become a parameter, parameters equal to 1 are
+#       removed from products, parameters equal to 0 are removed from sums and turn their products into the constant 0.
+#       Sums of several parameters are kept, so the circuit stays correct for max-product evaluation
+#   collapse_unary_nodes: sum/product nodes with a single child are replaced by the child
+#   flatten_chains: a sum (product) child of a sum (product) that is not used anywhere else is merged into its parent,
+#       which becomes a single n-ary node
+# Rebuilding the circuit after every pass removes the nodes that are no longer reachable from the roots and merges
+# the nodes that became equal. The indicators are always kept, so indicator i is still node i.
+# Parameters removed by fold_constants lose their slot in circuit["parameters"] and can no longer be changed with
+# circuit_functions.set_parameters, so the default passes are the structural passes, which keep every parameter of the
+# circuit. Add fold_constants (all_passes) when the CPTs of the compiled circuit will not be re-estimated.
+
+import numpy as np
+
+import circuit_functions as cf
+
+
+# Creates a new compiled circuit from the edited nodes of a circuit. Every node is replaced by its representative
+# (itself, or a node with a smaller index that evaluates to the same value), the nodes that are not reachable from the
+# roots are removed and the nodes with the same opcode, value and children are merged.
+# A parameter slot is kept only if its node is still the same parameter node, the others are recorded with their value
+# in "folded_parameters"
+# Input: {circuit: {..compiled_circuit_format..}, opcodes: [..], values: [..], node_children: [[..], ..],
+#         representatives: [0, 1, 2, 2, ..]}
+# Output: {..compiled_circuit_format..}
+def rebuild_circuit(circuit, opcodes, values, node_children, representatives):
+    indicator_count = len(circuit["indicators"])
+    parameter_slots = set(circuit["parameter_nodes"].tolist())
+
+    live = [False] * len(opcodes)
+    stack = [representatives[index] for index in circuit["roots"].values()]
+    while stack:
+        i = stack.pop()
+        if live[i]:
+            continue
+        live[i] = True
+        stack.extend(representatives[child] for child in node_children[i])
+
+    new_indices = list(range(indicator_count)) + [None] * (len(opcodes) - indicator_count)
+    unique_nodes = {}  # (opcode, value, children) -> new index
+    new_opcodes = [cf.OP_INDICATOR] * indicator_count
+    new_values = [0.0] * indicator_count
+    new_levels = [0] * indicator_count
+    child_offsets = [0] * (indicator_count + 1)
+    children = []
+    for i in range(indicator_count, len(opcodes)):
+        if not live[i] or representatives[i] != i:
+            continue
+        child_indices = tuple(new_indices[representatives[child]] for child in node_children[i])
+        key = (opcodes[i], values[i], child_indices)
+        if i not in parameter_slots and key in unique_nodes:
+            new_indices[i] = unique_nodes[key]
+            continue
+
+        new_indices[i] = len(new_opcodes)
+        if i not in parameter_slots:  # a parameter slot can be changed later, so it is never shared
+            unique_nodes[key] = new_indices[i]
+        new_opcodes.append(opcodes[i])
+        new_values.append(values[i])
+        new_levels.append(1 + max(new_levels[child] for child in child_indices) if child_indices else 0)
+        children.extend(child_indices)
+        child_offsets.append(len(children))
+
+    parameters = []
+    parameter_nodes = []
+    folded_parameters = dict(circuit.get("folded_parameters", {}))
+    for parameter, node in zip(circuit["parameters"], circuit["parameter_nodes"].tolist()):
+        if live[node] and representatives[node] == node and opcodes[node] == cf.OP_PARAMETER:
+            parameters.append(parameter)
+            parameter_nodes.append(new_indices[node])
+        else:
+            folded_parameters[parameter] = float(circuit["values"][node])
+
+    rebuilt_circuit = {
+        "opcodes": np.array(new_opcodes, dtype=np.int8),
+        "child_offsets": np.array(child_offsets, dtype=np.int64),
+        "children": np.array(children, dtype=np.int64),
+        "values": np.array(new_values, dtype=np.float64),
+        "levels": np.array(new_levels, dtype=np.int32),
+        "indicators": circuit["indicators"],
+        "roots": {key: new_indices[representatives[index]] for key, index in circuit["roots"].items()},
+        "parameters": parameters,
+        "parameter_nodes": np.array(parameter_nodes, dtype=np.int64),
+        "folded_parameters": folded_parameters,
+    }
+    if "families" in circuit:
+        rebuilt_circuit["families"] = circuit["families"]
+    return rebuilt_circuit
+
+
+# returns the nodes of a circuit as lists that can be edited by the passes, every node is its own representative
+# Input: {circuit: {..compiled_circuit_format..}}
+# Output: ([opcodes], [values], [[children of node 0], ..], [representatives])
+def unpack_circuit(circuit):
+    child_offsets = circuit["child_offsets"].tolist()
+    children = circuit["children"].tolist()
+    node_children = [children[child_offsets[i]:child_offsets[i + 1]] for i in range(len(circuit["opcodes"]))]
+    return (circuit["opcodes"].tolist(), circuit["values"].tolist(), node_children,
+            list(range(len(circuit["opcodes"]))))
+
+
+# Folds the constant parts of the circuit into parameters, see the description at the top of this file
+# Input: {circuit: {..compiled_circuit_format..}}
+# Output: {..compiled_circuit_format..}
+def fold_constants(circuit):
+    opcodes, values, node_children, representatives = unpack_circuit(circuit)
+    for i in range(len(circuit["indicators"]), len(opcodes)):
+        if opcodes[i] == cf.OP_PARAMETER:
+            continue
+        constant_children = [child for child in node_children[i] if opcodes[child] == cf.OP_PARAMETER]
+
+        if opcodes[i] == cf.OP_SUM:
+            node_children[i] = [child for child in node_children[i]
+                                if opcodes[child] != cf.OP_PARAMETER or values[child] != 0.0]
+            if not node_children[i]:
+                opcodes[i], values[i] = cf.OP_PARAMETER, 0.0
+        elif any(values[child] == 0.0 for child in constant_children):
+            opcodes[i], values[i], node_children[i] = cf.OP_PARAMETER, 0.0, []
+        elif len(constant_children) == len(node_children[i]):
+            opcodes[i], values[i], node_children[i] = (cf.OP_PARAMETER,
+                                                       float(np.prod([values[child] for child in constant_children])),
+                                                       [])
+        else:
+            node_children[i] = [child for child in node_children[i]
+                                if opcodes[child] != cf.OP_PARAMETER or values[child] != 1.0]
+    return rebuild_circuit(circuit, opcodes, values, node_children, representatives)
+
+
+# Replaces every sum/product node that has a single child by that child
+# Input: {circuit: {..compiled_circuit_format..}}
+# Output: {..compiled_circuit_format..}
+def collapse_unary_nodes(circuit):
+    opcodes, values, node_children, representatives = unpack_circuit(circuit)
+    for i in range(len(circuit["indicators"]), len(opcodes)):
+        if opcodes[i] != cf.OP_PARAMETER and len(node_children[i]) == 1:
+            representatives[i] = representatives[node_children[i][0]]
+    return rebuild_circuit(circuit, opcodes, values, node_children, representatives)
+
+
+# Merges the sum (product) children that have no other parent into their sum (product) parent. The nodes are visited
+# in topological order, so the children of a merged child are already flattened
+# Input: {circuit: {..compiled_circuit_format..}}
+# Output: {..compiled_circuit_format..}
+def flatten_chains(circuit):
+    opcodes, values, node_children, representatives = unpack_circuit(circuit)
+    parent_counts = np.bincount(circuit["children"], minlength=len(opcodes)).tolist()
+    roots = set(circuit["roots"].values())
+    for i in range(len(circuit["indicators"]), len(opcodes)):
+        if opcodes[i] == cf.OP_PARAMETER:
+            continue
+        flattened_children = []
+        for child in node_children[i]:
+            if opcodes[child] == opcodes[i] and parent_counts[child] == 1 and child not in roots:
+                flattened_children.extend(node_children[child])
+            else:
+                flattened_children.append(child)
+        node_children[i] = flattened_children
+    return rebuild_circuit(circuit, opcodes, values, node_children, representatives)
+
+
+structural_passes = [collapse_unary_nodes, flatten_chains]
+all_passes = [fold_constants] + structural_passes
+default_passes = structural_passes
+
+
+def get_circuit_size(circuit):
+    return {"nodes": len(circuit["opcodes"]), "edges": len(circuit["children"])}
+
+
+# Runs the passes in the given order and reports the size of the circuit before and after each pass
+# Input: {circuit: {..compiled_circuit_format..}, passes: [fold_constants, collapse_unary_nodes, flatten_chains]}
+# Output: ({..compiled_circuit_format..},
+#          [{pass: "fold_constants", before: {nodes: 145, edges: 160}, after: {nodes: 120, edges: 131}}, ..])
+def simplify_circuit(circuit, passes=None):
+    report = []
+    for simplification_pass in default_passes if passes is None else passes:
+        before = get_circuit_size(circuit)
+        circuit = simplification_pass(circuit)
+        report.append({"pass": simplification_pass.__name__, "before": before, "after": get_circuit_size(circuit)})
+        print("Simplification pass " + simplification_pass.__name__ + " ::", before, "->", report[-1]["after"])
+    return circuit, report
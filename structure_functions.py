@@ -2,28 +2,39 @@
 # This file contains functions that defines the basic structure for representation of a node in the network
 
 import itertools
+import sys
+
 import helper  # custom made helper file
 
+EMPTY_REFERENCES = ()  # references of every leaf node, shared instead of one empty list per leaf
+
 
-# "universal_dict" is basically a dict representing all the BN nodes,
-#   format: {"(node_name)" : {"(node_value)": (probability_value)}}   example: {"A":{"0":0.9, "1":0.1}}
-# "node_stats" is used to maintain the tally/statistics of nodes (total nodes, total sum nodes, total product nodes)
-# "indicator_nodes" is used to identify duplicate indicator nodes and thus prevent them being counted in the stats
-universal_dict = {}
-nodes_stats = {
-    "total": 0,
-    "product": 0,
-    "sum": 0,
-    "parameter": 0,
-    "indicator": 0,
-}
-indicator_nodes = []
+# A compiler session holds the state used while the nodes of one circuit are created, so several networks can be
+# compiled in the same process (also concurrently, one session per thread) without mixing their nodes or statistics.
+# "nodes_stats" is used to maintain the tally/statistics of nodes (total nodes, total sum nodes, total product nodes)
+# "unique_table" maps the identity of a node (type, payload and children) to the node created for it, so the same node
+#   is never created twice and the circuit is a DAG where equal sub-circuits are shared
+# Input: None
+# Output: {nodes_stats: {"total": 0, ..}, unique_table: {}}
+def create_session():
+    return {
+        "nodes_stats": {
+            "total": 0,
+            "product": 0,
+            "sum": 0,
+            "parameter": 0,
+            "indicator": 0,
+        },
+        "unique_table": {},
+    }
 
 
-# Function uses the bn_graph_nodes dict to create a universal dict
+# Function uses the bn_graph_nodes dict to create a universal dict, a dict representing all the BN nodes,
+#   format: {"(node_name)" : {"(node_value)": (probability_value)}}
 # Input: {"A":{"states":["0", "1"], "parents":[], "values":[[0.9, 0.1]}}
 # Output: {"A":{"0":0.9, "1":0.1}}
 def create_universal_dict(bn_graph_nodes):
+    universal_dict = {}
     for key, value in bn_graph_nodes.items():
         universal_dict[key] = {}
         states = value["states"]
@@ -42,18 +53,48 @@ def create_universal_dict(bn_graph_nodes):
     return universal_dict
 
 
-# Common function that creates a node in the network with the format:
+# A node of the network, with the fields of the format:
 # {
 #     "type": "", ## possible values: sum/product/value/indicator
 #     "value": , ## probability value
-#     "references": [], ## contains dict representing other nodes
+#     "references": (), ## tuple of the child nodes, EMPTY_REFERENCES for the leaves
 #     "node": "", ## name of variable, ex: A
 #     "variable_value": "", ## possible value of variable, ex: 0
 # }
+# The fields are stored in __slots__ instead of a dict per node, and node["type"] reads the same field as node.type,
+# so the nodes can still be read like the dicts they replace
+class Node:
+    __slots__ = ("type", "value", "references", "node", "variable_value")
+
+    def __init__(self, node_type, value, references, node, variable_value):
+        self.type = node_type
+        self.value = value
+        self.references = references
+        self.node = node
+        self.variable_value = variable_value
+
+    __getitem__ = object.__getattribute__  # node["type"] is node.type, without a Python call per field read
+
+
+# Common function that creates a node in the network, in the format of Node.
 # references to denote that this node is a parent to these child node in the network
-# Input: {node_type: "value", value: 0.2, references: [], node: "A", variable_value: "0"}
-# Output: {type: "value", value: 0.2, references: [], node: A,  variable_value: "0"}
-def create_node(node_type, value, references, node, variable_value):
+# If a node with the same type, value, variable, variable_value and children (compared by identity) already exists,
+# the existing node is returned and nothing is counted in the stats. Nodes must therefore not be changed after creation.
+# The names and values of the variables are interned, so every node of the same variable shares one string, and the
+# tuple of references is both the key in the unique table and the references of the node.
+# The node is created in the unique table and counted in the stats of the given session
+# Input: {session: {..session..}, node_type: "value", value: 0.2, references: [], node: "A", variable_value: "0"}
+# Output: Node(type: "value", value: 0.2, references: (), node: A,  variable_value: "0")
+def create_node(session, node_type, value, references, node, variable_value):
+    node = sys.intern(node.strip())
+    variable_value = sys.intern(variable_value.strip())
+    references = tuple(references) if references else EMPTY_REFERENCES
+    unique_table = session["unique_table"]
+    nodes_stats = session["nodes_stats"]
+    key = (node_type, value, node, variable_value, references)  # nodes are hashed and compared by identity
+    if key in unique_table:
+        return unique_table[key]
+
     nodes_stats["total"] += 1
     if node_type == "sum":
         nodes_stats["sum"] += 1
@@ -61,19 +102,29 @@ def create_node(node_type, value, references, node, variable_value):
         nodes_stats["product"] += 1
     elif node_type == "value":
         nodes_stats["parameter"] += 1
-    if node_type == "indicator":
+    elif node_type == "indicator":
         nodes_stats["indicator"] += 1
-        # condition checks if an indicator nodes already exists, if yes, we subtract its count from total
-        if node_type+"-"+node+"-"+variable_value in indicator_nodes:
-            # print("found-duplicate", node_type+"-"+node+"-"+variable_value)
-            nodes_stats["total"] -= 1
-            nodes_stats["indicator"] -= 1
-        indicator_nodes.append(node_type+"-"+node+"-"+variable_value)
 
-    return {
-        "type": node_type,
-        "value": value,
-        "references": references,
-        "node": node.strip(),
-        "variable_value": variable_value.strip(),
-    }
+    unique_table[key] = Node(node_type, value, references, node, variable_value)
+    return unique_table[key]
+
+
+# Calculates the memory used by the nodes of a session and the memory the same nodes took as five-key dicts with
+# their own references list and id tuple in the unique table, which is the format created before Node.
+# Strings and values are shared in both formats and are not counted
+# Input: {session: {..session..}}
+# Output: {nodes: 145, node_bytes: 23200, dict_node_bytes: 68000, saved_bytes: 44800}
+def get_node_memory(session):
+    dict_size = sys.getsizeof({"type": 0, "value": 0, "references": 0, "node": 0, "variable_value": 0})
+    node_bytes = 0
+    dict_node_bytes = 0
+    for key, node in session["unique_table"].items():
+        references = node.references
+        node_bytes += sys.getsizeof(node) + sys.getsizeof(key)
+        if references is not EMPTY_REFERENCES:
+            node_bytes += sys.getsizeof(references)
+        # the dict format kept a list of references and a tuple of the ids of the references, one int object each
+        dict_node_bytes += (dict_size + sys.getsizeof(list(references)) + sys.getsizeof(key) +
+                            sys.getsizeof(references) + sum(sys.getsizeof(id(reference)) for reference in references))
+    return {"nodes": len(session["unique_table"]), "node_bytes": node_bytes, "dict_node_bytes": dict_node_bytes,
+            "saved_bytes": dict_node_bytes - node_bytes}
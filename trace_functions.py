@@ -0,0 +1,85 @@
+# Description:
+# This file contains the instrumentation of the compilation. A tracer collects one event for every phase of the
+# compilation and one for every elimination step, passes each event to an optional callback and can write all of them
+# to a JSON trace file, so the step that blows up on a network can be found without a profiler.
+# The instrumented functions take tracer=None when the instrumentation is off, every function of this file returns at
+# once in that case and the counters of the elimination steps are only computed when a tracer is given.
+# Format of a tracer ::
+# {
+#     "callback": print_event, ## called with every event as soon as it is recorded, optional
+#     "path": "arithmetic-circuits/asia/asia.trace.json", ## file written by write_trace, optional
+#     "events": [{..event_format..}, ..], ## in the order in which the phases ended
+# }
+# Format of a single event ::
+# {
+#     "phase": "eliminate_variable", ## possible values: read_bn_file/check_bn_model/get_bn_graph_nodes/
+#                                   ## find_elimination_order/create_cpt_factors/eliminate_variable/
+#                                   ## compile_arithmetic_circuit/simplify_circuit/plot_graphviz
+#     "time": 0.0012, ## seconds spent in the phase
+#     ..counters of the phase, for example for eliminate_variable ::
+#     "step": 3, ## position of the variable in the elimination order
+#     "variable": "lung",
+#     "bucket_factors": 2, ## number of factors joined by the step
+#     "joint_size": 8, ## number of assignments of the joined factor, one product node each
+#     "factor_variables": 2, "factor_size": 4, ## scope and number of assignments of the factor created by the step
+#     "nodes_created": 12, ## nodes added to the session, equal nodes already created before are not counted
+# }
+
+import json
+import time
+
+
+def create_tracer(callback=None, path=None):
+    return {"callback": callback, "path": path, "events": []}
+
+
+# returns the start time of a phase, None when the instrumentation is off
+# Input: {tracer: {..tracer_format..} OR None}
+# Output: 1234.56 OR None
+def start_phase(tracer):
+    if tracer is None:
+        return None
+    return time.perf_counter()
+
+
+# Records the event of a phase that started at start_time, and passes it to the callback of the tracer
+# Input: {tracer: {..tracer_format..} OR None, phase: "find_elimination_order", start_time: 1234.56,
+#         counters: {"strategy": "min_fill"}}
+# Output: None
+def end_phase(tracer, phase, start_time, counters=None):
+    if tracer is None:
+        return
+    event = {"phase": phase, "time": time.perf_counter() - start_time}
+    if counters is not None:
+        event.update(counters)
+    tracer["events"].append(event)
+    if tracer["callback"] is not None:
+        tracer["callback"](event)
+
+
+# callback printing every event on the console
+def print_event(event):
+    print("Trace ::", event)
+
+
+# Sums the events of the tracer by phase
+# Input: {tracer: {..tracer_format..}}
+# Output: {"eliminate_variable": {"count": 8, "time": 0.012}, ..}
+def get_phase_totals(tracer):
+    phase_totals = {}
+    for event in tracer["events"]:
+        phase_total = phase_totals.setdefault(event["phase"], {"count": 0, "time": 0.0})
+        phase_total["count"] += 1
+        phase_total["time"] += event["time"]
+    return phase_totals
+
+
+# Writes the events and the totals by phase to the path of the tracer, nothing is written without a path
+# Input: {tracer: {..tracer_format..} OR None}
+# Output: "arithmetic-circuits/asia/asia.trace.json" OR None
+def write_trace(tracer):
+    if tracer is None or tracer["path"] is None:
+        return None
+    with open(tracer["path"], "w") as trace_file:
+        json.dump({"phases": get_phase_totals(tracer), "events": tracer["events"]}, trace_file, indent=2)
+    return tracer["path"]